@@ -0,0 +1,195 @@
+"""按用户的准入控制与公平排队。
+
+每轮对话在开始前向 AdmissionController 申请准入：
+- 单用户并发上限：同一用户同时进行中的对话轮次不超过 ADMISSION_MAX_CONCURRENT_PER_USER
+- 单用户请求频率：每分钟最多 ADMISSION_REQUESTS_PER_MINUTE 次（令牌桶）
+- 每日 token 额度：超过 ADMISSION_DAILY_TOKEN_BUDGET 后当天不再受理
+- 公平排队：本进程同时处理的轮次达到 ADMISSION_MAX_ACTIVE_TURNS 后，新请求按用户轮转排队，
+  连续发送很多请求的用户不会挤占其他用户
+- 管理员（ADMIN_USER_IDS）不受以上限制
+
+单用户的计数默认保存在进程内；ADMISSION_SHARED_STATE 打开时保存在共享状态后端中，
+多个进程共用同一份并发、频率和额度计数。公平排队只在进程内进行。
+"""
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from datetime import datetime
+
+import config
+import metrics
+import state_store
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason: str, user_message: str):
+        super().__init__(user_message)
+        self.reason = reason
+        self.user_message = user_message
+
+
+class Admission:
+    """一次已准入的对话轮次，结束时必须 release。"""
+
+    def __init__(self, controller: "AdmissionController", user_id: str, slot_id: str = None, queued: bool = False):
+        self.controller = controller
+        self.user_id = user_id
+        self.slot_id = slot_id
+        self.queued = queued
+        self._released = False
+
+    def release(self):
+        if self._released:
+            return
+        self._released = True
+        self.controller._release(self)
+
+
+class AdmissionController:
+    def __init__(self, backend: state_store.StateBackend = None):
+        self.backend = backend or state_store.InProcessStateBackend()
+        self._lock = threading.Lock()
+        self._active_total = 0
+        # user_id -> 该用户等待中的请求；按字典顺序轮转服务，每次服务一个请求后把用户移到末尾
+        self._waiting = OrderedDict()
+
+    @staticmethod
+    def is_admin(user_id: str) -> bool:
+        return user_id in config.ADMIN_USER_IDS
+
+    @staticmethod
+    def _usage_key(user_id: str) -> str:
+        return f"usage:{user_id}:{datetime.now().strftime('%Y%m%d')}"
+
+    def tokens_used_today(self, user_id: str) -> int:
+        record = self.backend.get(self._usage_key(user_id))
+        return record.data.get("tokens", 0) if record else 0
+
+    def charge(self, user_id: str, tokens: float):
+        """把本轮实际消耗的 token 记入该用户当天的额度。"""
+        if not user_id or tokens <= 0:
+            return
+        try:
+            self.backend.update(self._usage_key(user_id),
+                                lambda data: {"tokens": (data or {}).get("tokens", 0) + int(tokens)})
+        except Exception as e:
+            print(f"⚠️ 记录用户用量失败: {e}")
+
+    def reset_usage(self, user_id: str):
+        """管理员操作：清空用户当天已用额度。"""
+        self.backend.delete(self._usage_key(user_id))
+
+    def _take_user_slot(self, user_id: str) -> str:
+        """在一次读-改-写中检查频率和并发上限并占用一个并发名额。"""
+        slot_id = uuid.uuid4().hex
+        rate = config.ADMISSION_REQUESTS_PER_MINUTE
+        outcome = {}
+
+        def take(data):
+            now = time.time()
+            data = data or {"active": {}, "allowance": rate, "updated_at": now}
+            # 进程崩溃时遗留的名额按超时回收
+            active = {k: v for k, v in data["active"].items() if now - v < config.ADMISSION_SLOT_TTL}
+            allowance = min(rate, data["allowance"] + (now - data["updated_at"]) * rate / 60)
+            if allowance < 1:
+                outcome["rejected"] = "rate"
+            elif len(active) >= config.ADMISSION_MAX_CONCURRENT_PER_USER:
+                outcome["rejected"] = "concurrency"
+            else:
+                outcome["rejected"] = None
+                allowance -= 1
+                active[slot_id] = now
+            return {"active": active, "allowance": allowance, "updated_at": now}
+
+        self.backend.update(f"admission:{user_id}", take)
+        if outcome["rejected"] == "rate":
+            raise AdmissionRejected("rate", "⚠️ 您的请求过于频繁，请稍等片刻再发送。")
+        if outcome["rejected"] == "concurrency":
+            raise AdmissionRejected("concurrency", "⚠️ 您还有正在处理中的请求，请等待回复完成后再发送。")
+        return slot_id
+
+    def _release_user_slot(self, user_id: str, slot_id: str):
+        def release(data):
+            data = data or {"active": {}, "allowance": config.ADMISSION_REQUESTS_PER_MINUTE, "updated_at": time.time()}
+            data["active"].pop(slot_id, None)
+            return data
+
+        try:
+            self.backend.update(f"admission:{user_id}", release)
+        except Exception as e:
+            print(f"⚠️ 释放准入名额失败: {e}")
+
+    @property
+    def saturated(self) -> bool:
+        with self._lock:
+            return self._active_total >= config.ADMISSION_MAX_ACTIVE_TURNS or bool(self._waiting)
+
+    def _dispatch(self):
+        # 调用方持有 self._lock
+        while self._active_total < config.ADMISSION_MAX_ACTIVE_TURNS and self._waiting:
+            user_id, waiters = next(iter(self._waiting.items()))
+            waiter = waiters.popleft()
+            if waiters:
+                self._waiting.move_to_end(user_id)
+            else:
+                del self._waiting[user_id]
+            self._active_total += 1
+            waiter.set()
+
+    def _wait_for_turn(self, user_id: str, timeout: float) -> bool:
+        """进程内名额已满时按用户轮转排队。返回是否经过了排队。"""
+        with self._lock:
+            if self._active_total < config.ADMISSION_MAX_ACTIVE_TURNS and not self._waiting:
+                self._active_total += 1
+                return False
+            waiter = threading.Event()
+            self._waiting.setdefault(user_id, deque()).append(waiter)
+        started = time.monotonic()
+        granted = waiter.wait(timeout)
+        with self._lock:
+            if not granted and not waiter.is_set():
+                waiters = self._waiting.get(user_id)
+                if waiters is not None:
+                    waiters.remove(waiter)
+                    if not waiters:
+                        del self._waiting[user_id]
+                raise AdmissionRejected("queue_timeout", "⚠️ 当前咨询人数过多，请稍后再试。")
+        metrics.observe("admission_queue_seconds", time.monotonic() - started)
+        return True
+
+    def admit(self, user_id: str, timeout: float = None) -> Admission:
+        """申请准入，被拒绝时抛出 AdmissionRejected（附带可直接展示给用户的提示）。"""
+        if self.is_admin(user_id):
+            metrics.increment("admission_admitted", kind="admin")
+            return Admission(self, user_id)
+        try:
+            if self.tokens_used_today(user_id) >= config.ADMISSION_DAILY_TOKEN_BUDGET:
+                raise AdmissionRejected("daily_budget", "⚠️ 您今天的咨询额度已用完，请明天再来。")
+            slot_id = self._take_user_slot(user_id)
+            try:
+                timeout = config.ADMISSION_QUEUE_TIMEOUT if timeout is None else min(timeout, config.ADMISSION_QUEUE_TIMEOUT)
+                queued = self._wait_for_turn(user_id, timeout)
+            except AdmissionRejected:
+                self._release_user_slot(user_id, slot_id)
+                raise
+        except AdmissionRejected as e:
+            metrics.increment("admission_rejected", reason=e.reason)
+            raise
+        metrics.increment("admission_admitted", kind="queued" if queued else "direct")
+        return Admission(self, user_id, slot_id, queued)
+
+    def _release(self, admission: Admission):
+        if admission.slot_id is None:
+            return
+        self._release_user_slot(admission.user_id, admission.slot_id)
+        with self._lock:
+            self._active_total -= 1
+            self._dispatch()
+
+
+def create_controller(shared_backend: state_store.StateBackend = None) -> AdmissionController:
+    """ADMISSION_SHARED_STATE 打开时使用传入的共享状态后端，否则使用进程内存储。"""
+    if config.ADMISSION_SHARED_STATE and shared_backend is not None:
+        return AdmissionController(shared_backend)
+    return AdmissionController()
@@ -0,0 +1,251 @@
+"""无界面的 HTTP/SSE 接口，供 HR 系统、微信机器人等集成方使用。
+
+与 Gradio 界面共用 app.py 中的业务流程（unified_chat / analyze_contracts / 会话状态），
+但有以下区别：
+- 会话由显式的 session token 标识，而不是根据 user-agent 推算
+- 客户端只发送新消息，历史记录保存在服务端
+- 回复以 SSE 流式返回增量文本，而不是每次回传完整的聊天记录
+
+启动（同时在 / 提供 Gradio 界面）：
+    python api.py
+或：
+    uvicorn api:api --host 0.0.0.0 --port 7862 --workers 4
+
+多个 uvicorn 进程共用一个合同审查 worker 池（见 contract_jobs.start_worker_pool）。
+"""
+import hashlib
+import json
+import os
+import re
+import secrets
+import shutil
+import tempfile
+from contextlib import asynccontextmanager
+from typing import Iterable, List, Optional
+
+import gradio as gr
+from fastapi import FastAPI, File, Header, HTTPException, UploadFile
+from starlette.background import BackgroundTask
+from pydantic import BaseModel
+from sse_starlette.sse import EventSourceResponse
+
+import app as legal_app
+import config
+import contract_jobs
+import metrics
+import search_index
+
+@asynccontextmanager
+async def _lifespan(_app):
+    if config.CONTRACT_REVIEW_WORKERS > 0:
+        contract_jobs.start_worker_pool(config.CONTRACT_REVIEW_WORKERS)
+    yield
+
+
+api = FastAPI(title="AI法律助手 API", lifespan=_lifespan)
+
+_REPORT_DIR = "./case_analysis_results"
+_REPORT_ID_PATTERN = re.compile(r'^case_analysis_\d{8}_\d{6}$')
+
+
+class ChatRequest(BaseModel):
+    message: str
+    # 可选的整轮时限（秒），不传时使用服务端默认值
+    timeout_seconds: Optional[float] = None
+
+
+def _user_id_from_token(session_token: Optional[str]) -> str:
+    if not session_token:
+        raise HTTPException(status_code=401, detail="缺少 X-Session-Token")
+    return "api_" + hashlib.sha256(session_token.encode()).hexdigest()[:16]
+
+
+def _is_admin(admin_token: Optional[str]) -> bool:
+    return bool(config.ADMIN_API_TOKEN) and secrets.compare_digest(admin_token or "", config.ADMIN_API_TOKEN)
+
+
+def _report_owner(session_token: Optional[str], admin_token: Optional[str]) -> Optional[str]:
+    """报告接口的调用者：携带管理员令牌时返回 None（可查看全部报告），否则为本会话的用户。"""
+    if _is_admin(admin_token):
+        return None
+    return _user_id_from_token(session_token)
+
+
+def _clamp_timeout(timeout_seconds: Optional[float]) -> Optional[float]:
+    """调用方只能把时限调短，不能超过服务端默认值。"""
+    if timeout_seconds is None:
+        return None
+    return max(1.0, min(timeout_seconds, config.REQUEST_DEADLINE_SECONDS))
+
+
+def _sse_from_history(snapshots: Iterable[List], user_id: str):
+    """把 unified_chat 产出的完整历史快照转换为增量事件。
+
+    最后一条回复在上一条基础上追加时发送 delta，否则（状态提示被替换等）发送完整的 message。
+    """
+    previous = ""
+    for history in snapshots:
+        if not history:
+            continue
+        reply = history[-1][1] or ""
+        if reply == previous:
+            continue
+        if previous and reply.startswith(previous):
+            yield {"event": "delta", "data": json.dumps({"text": reply[len(previous):]}, ensure_ascii=False)}
+        else:
+            yield {"event": "message", "data": json.dumps({"text": reply}, ensure_ascii=False)}
+        previous = reply
+    _, system_state = legal_app.get_or_create_user_state(None, user_id)
+    yield {"event": "done", "data": json.dumps({"mode": system_state.current_mode}, ensure_ascii=False)}
+
+
+@api.post("/api/sessions")
+def create_session():
+    """创建新会话，返回之后请求需要携带的 session token。"""
+    return {"session_token": secrets.token_urlsafe(24)}
+
+
+@api.post("/api/chat")
+def chat(body: ChatRequest, x_session_token: Optional[str] = Header(None)):
+    user_id = _user_id_from_token(x_session_token)
+    snapshots = legal_app.unified_chat(body.message, None, None, user_id=user_id,
+                                       deadline_seconds=_clamp_timeout(body.timeout_seconds))
+    return EventSourceResponse(_sse_from_history(snapshots, user_id))
+
+
+@api.post("/api/contracts")
+def review_contracts(files: List[UploadFile] = File(...), x_session_token: Optional[str] = Header(None)):
+    user_id = _user_id_from_token(x_session_token)
+    upload_dir = tempfile.mkdtemp(prefix="contract_upload_")
+    # 任务提交时文件已复制到任务目录；响应结束（包括客户端在开始接收前断开）后删除上传目录
+    cleanup = BackgroundTask(shutil.rmtree, upload_dir, ignore_errors=True)
+    try:
+        file_paths = []
+        for index, upload in enumerate(files):
+            # 加序号避免同名文件互相覆盖
+            path = os.path.join(upload_dir, f"{index:03d}_{os.path.basename(upload.filename or 'upload')}")
+            with open(path, 'wb') as f:
+                shutil.copyfileobj(upload.file, f)
+            file_paths.append(path)
+    except Exception:
+        shutil.rmtree(upload_dir, ignore_errors=True)
+        raise
+
+    def stream():
+        job_ids = []
+        snapshots = legal_app.unified_chat("", None, None, file_paths, user_id=user_id, on_contract_job=job_ids.append)
+        job_sent = False
+        for event in _sse_from_history(snapshots, user_id):
+            if job_ids and not job_sent:
+                # 任务提交后先告知任务编号，断线后可用 GET /api/contracts/{job_id} 重新获取
+                job_sent = True
+                yield {"event": "job", "data": json.dumps({"job_id": job_ids[0]})}
+            yield event
+
+    return EventSourceResponse(stream(), background=cleanup)
+
+
+@api.get("/api/contracts/{job_id}")
+def resume_contract_review(job_id: str, x_session_token: Optional[str] = Header(None)):
+    """按任务编号重新获取合同审查的进度和结果（如服务重启、任务被放回队列后），
+    从头重放已有输出并继续跟随到任务结束。只能获取本会话提交的任务。"""
+    user_id = _user_id_from_token(x_session_token)
+    job = legal_app.contract_job_queue.get(job_id)
+    if job is None or job["user_id"] != user_id:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    snapshots = ([("", text)] for text in legal_app.contract_job_queue.stream(job_id, deadline_at=job["deadline_at"]))
+    return EventSourceResponse(_sse_from_history(snapshots, user_id))
+
+
+@api.post("/api/reset")
+def reset_session(x_session_token: Optional[str] = Header(None)):
+    user_id = _user_id_from_token(x_session_token)
+    legal_app.reset_system(None, user_id)
+    return {"reset": True}
+
+
+@api.get("/api/history")
+def get_history(limit: int = 20, x_session_token: Optional[str] = Header(None)):
+    user_id = _user_id_from_token(x_session_token)
+    history, _ = legal_app.load_user_chat_history(user_id)
+    history = history or []
+    return {"total": len(history), "history": history[-limit:] if limit > 0 else []}
+
+
+def _load_report(report_id: str) -> dict:
+    with open(os.path.join(_REPORT_DIR, f"{report_id}.json"), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+@api.get("/api/case-reports")
+def list_case_reports(page: int = 1, page_size: int = 20, x_session_token: Optional[str] = Header(None),
+                      x_admin_token: Optional[str] = Header(None)):
+    """按时间倒序分页列出本会话的案例分析报告（管理员令牌可列出全部）。"""
+    owner = _report_owner(x_session_token, x_admin_token)
+    names = sorted(
+        (name[:-5] for name in os.listdir(_REPORT_DIR) if name.endswith(".json")) if os.path.isdir(_REPORT_DIR) else [],
+        reverse=True
+    )
+    reports = []
+    for report_id in names:
+        data = _load_report(report_id)
+        if owner is None or data.get("user_id") == owner:
+            reports.append((report_id, data))
+    page, page_size = max(page, 1), min(max(page_size, 1), 100)
+    items = [{
+        "id": report_id,
+        "timestamp": data.get("timestamp"),
+        "case_type": data.get("case_type"),
+        "status": data.get("status", "complete"),
+    } for report_id, data in reports[(page - 1) * page_size: page * page_size]]
+    return {"total": len(reports), "page": page, "page_size": page_size, "items": items}
+
+
+@api.get("/api/case-reports/search")
+def search_case_reports(q: str = "", case_type: Optional[str] = None, date_from: Optional[str] = None,
+                        date_to: Optional[str] = None, page: int = 1, page_size: int = 20,
+                        x_session_token: Optional[str] = Header(None), x_admin_token: Optional[str] = Header(None)):
+    """全文检索本会话的案例分析报告（管理员令牌可检索全部），返回分页结果以及案件类型、月份分面。
+    日期格式为 YYYY-MM-DD。"""
+    owner = _report_owner(x_session_token, x_admin_token)
+    return search_index.get_index().search(q, case_type, date_from, date_to, page, page_size, user_id=owner)
+
+
+@api.get("/api/case-reports/{report_id}")
+def get_case_report(report_id: str, x_session_token: Optional[str] = Header(None),
+                    x_admin_token: Optional[str] = Header(None)):
+    owner = _report_owner(x_session_token, x_admin_token)
+    if not _REPORT_ID_PATTERN.match(report_id) or not os.path.exists(os.path.join(_REPORT_DIR, f"{report_id}.json")):
+        raise HTTPException(status_code=404, detail="报告不存在")
+    data = _load_report(report_id)
+    # 他人的报告与不存在的报告返回相同的结果
+    if owner is not None and data.get("user_id") != owner:
+        raise HTTPException(status_code=404, detail="报告不存在")
+    return data
+
+
+@api.post("/api/admin/users/{user_id}/reset-quota")
+def reset_user_quota(user_id: str, x_admin_token: Optional[str] = Header(None)):
+    """管理员操作：清空指定用户当天已用的 token 额度。"""
+    if not _is_admin(x_admin_token):
+        raise HTTPException(status_code=403, detail="无权访问")
+    legal_app.admission_controller.reset_usage(user_id)
+    return {"user_id": user_id, "reset": True}
+
+
+@api.get("/api/metrics")
+def get_metrics(x_admin_token: Optional[str] = Header(None)):
+    """管理员操作：本进程的运行指标（取消次数、估算节省的 token 等）。"""
+    if not _is_admin(x_admin_token):
+        raise HTTPException(status_code=403, detail="无权访问")
+    return metrics.snapshot()
+
+
+# Gradio 界面挂载在根路径，与接口共用同一个进程和服务层
+api = gr.mount_gradio_app(api, legal_app.demo, path="/")
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(api, host="0.0.0.0", port=config.API_PORT)
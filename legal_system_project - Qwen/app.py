@@ -5,22 +5,29 @@ import pandas as pd
 from datetime import datetime
 import time
 from typing import List
-import re
 import uuid
 import hashlib
 
 from services import (
-    ContractAnalyzer,
     CaseAnalysisGenerator,
     ParalegalAssistant,
     LawyerPromptLoader,
 )
-from utils import (
-    classify_contract_type,
-    extract_text_from_file,
-)
 import config
 import prompts
+import state_store
+import contract_jobs
+import router
+import cancellation
+import deadlines
+import scheduler
+import admission
+import report_prefetch
+import dataset_writer
+import search_index
+import case_retrieval
+from transcript import CaseTranscript, estimate_tokens
+from report_parser import CaseReportSectionParser
 from dashscope import Generation
 from dashscope.api_entities.dashscope_response import Role
 
@@ -30,6 +37,8 @@ class SystemState:
         self.current_mode = "selection"  # selection, legal_knowledge, case_strategy, contract_review
         self.legal_conversation_history = []
         self.case_conversation_history = []
+        # 案件咨询对话的增量文本，与 case_conversation_history 同步更新，供案例分析直接使用
+        self.case_transcript = CaseTranscript()
         self.contract_review_history = []
         self.user_input_round = 0
         self.case_type_selected = None
@@ -38,9 +47,66 @@ class SystemState:
         self.expecting_continue_response = False
         self.loaded_history_for_prompt = None
         self.loaded_state_for_prompt = None
+        # 对应共享状态后端中记录的版本号，写入时用于乐观并发校验
+        self.version = 0
+
+    def reset_case_conversation(self, system_prompt):
+        self.case_conversation_history = [{'role': Role.SYSTEM, 'content': system_prompt}]
+        self.case_transcript = CaseTranscript()
+
+    def append_case_message(self, role, content):
+        self.case_conversation_history.append({'role': role, 'content': content})
+        self.case_transcript.append(role, content)
+
+    def to_dict(self):
+        return {
+            "current_mode": self.current_mode,
+            "user_input_round": self.user_input_round,
+            "case_type_selected": self.case_type_selected,
+            "current_lawyer_prompt": self.current_lawyer_prompt,
+            "legal_conversation_history": self.legal_conversation_history,
+            "case_conversation_history": self.case_conversation_history,
+            "case_transcript": self.case_transcript.to_dict(),
+            "contract_review_history": self.contract_review_history,
+            "expecting_continue_response": self.expecting_continue_response,
+            "loaded_history_for_prompt": self.loaded_history_for_prompt,
+            "loaded_state_for_prompt": self.loaded_state_for_prompt.to_dict() if self.loaded_state_for_prompt else None,
+        }
 
-# Global dictionary to store user states by UUID
+    @classmethod
+    def from_dict(cls, state_data):
+        user_state = cls()
+        user_state.current_mode = state_data.get("current_mode", "selection")
+        user_state.user_input_round = state_data.get("user_input_round", 0)
+        user_state.case_type_selected = state_data.get("case_type_selected", None)
+        user_state.current_lawyer_prompt = state_data.get("current_lawyer_prompt", None)
+        user_state.legal_conversation_history = state_data.get("legal_conversation_history", [])
+        user_state.case_conversation_history = state_data.get("case_conversation_history", [])
+        if "case_transcript" in state_data:
+            user_state.case_transcript = CaseTranscript.from_dict(state_data["case_transcript"])
+        else:
+            user_state.case_transcript = CaseTranscript.from_messages(user_state.case_conversation_history)
+        user_state.contract_review_history = state_data.get("contract_review_history", [])
+        user_state.expecting_continue_response = state_data.get("expecting_continue_response", False)
+        user_state.loaded_history_for_prompt = state_data.get("loaded_history_for_prompt", None)
+        if state_data.get("loaded_state_for_prompt"):
+            user_state.loaded_state_for_prompt = cls.from_dict(state_data["loaded_state_for_prompt"])
+        return user_state
+
+# Shared session state backend (see state_store.py). Every replica reads and
+# writes user state through it; user_states is only a per-process cache that
+# is revalidated against the backend version on each access.
+state_backend = state_store.create_backend()
 user_states = {}
+# Chat history last saved by this process: user_id -> (backend version, history).
+# API turns (history=None) reuse it while the version still matches the cached state.
+user_chat_histories = {}
+# In-flight turns per user, used to cancel abandoned generations
+turn_registry = cancellation.TurnRegistry(state_backend)
+# Provider quota shared by every model call (see scheduler.py)
+llm_scheduler = scheduler.get_scheduler()
+# Per-user concurrency, rate and daily token limits (see admission.py)
+admission_controller = admission.create_controller(state_backend)
 
 def get_user_id_from_request(request: gr.Request):
     """Generate a stable user ID using request headers (browser + IP)."""
@@ -59,46 +125,91 @@ def get_user_id_from_request(request: gr.Request):
         return f"user_{str(uuid.uuid4())[:12]}"
 
 def get_or_create_user_state(request: gr.Request, user_id=None):
-    """Get or create user state for a given user ID."""
+    """Get or create user state for a given user ID.
+
+    The local cache is reused only while its version matches the shared
+    backend; if another replica has written a newer version, reload it.
+    """
     if user_id is None:
         user_id = get_user_id_from_request(request)
-    if user_id not in user_states:
-        user_states[user_id] = SystemState()
-    return user_id, user_states[user_id]
+    cached = user_states.get(user_id)
+    backend_version = state_backend.get_version(user_id)
+    if backend_version == 0:
+        if cached is None or cached.version != 0:
+            cached = SystemState()
+            user_states[user_id] = cached
+        return user_id, cached
+    if cached is None or cached.version != backend_version:
+        record = state_backend.get(user_id)
+        if record is None:
+            cached = SystemState()
+        else:
+            cached = SystemState.from_dict(record.data.get("user_state", {}))
+            cached.version = record.version
+        user_states[user_id] = cached
+    return user_id, cached
+
+def replace_user_state(user_id, new_state, current_state):
+    """Swap in a restored state while keeping the backend version for the next write."""
+    new_state.version = current_state.version
+    user_states[user_id] = new_state
+    return new_state
 
 # For backward compatibility, create a default system state
 system_state = SystemState()
 
 # Instantiate services
-contract_analyzer = ContractAnalyzer()
-case_analyzer = CaseAnalysisGenerator()
+contract_job_queue = contract_jobs.ContractJobQueue()
+case_retriever = case_retrieval.create_retriever()
+case_analyzer = CaseAnalysisGenerator(retriever=case_retriever)
 paralegal = ParalegalAssistant()
 prompt_loader = LawyerPromptLoader()
+ending_predictor = report_prefetch.EndingPredictor()
+report_prefetcher = report_prefetch.ReportPrefetcher(case_analyzer)
+# Embedding routers are built once at startup; None means keyword rules only
+intent_router = router.create_intent_router()
+case_type_router = router.create_case_type_router()
+
+TRUNCATED_REPLY_NOTE = "\n\n⚠️ 回复超时，以上内容可能不完整，您可以继续提问。"
+BUSY_REPLY = "⚠️ 当前咨询人数过多，请稍后再试。"
+
+def estimate_messages_tokens(messages):
+    return estimate_tokens("\n".join(m.get('content') or "" for m in messages))
+
+def wait_for_llm_quota(model, prompt_tokens, kind, message, history, deadline, cancel_token):
+    """Wait for an interactive DashScope slot, showing the estimated wait while queued.
+
+    Used with ``yield from``; returns the scheduler ticket to settle after the call.
+    """
+    tokens = prompt_tokens + config.EXPECTED_COMPLETION_TOKENS.get(kind, 0)
+    notice = scheduler.wait_notice(llm_scheduler.estimate_wait("dashscope", model, tokens))
+    if notice:
+        history[-1] = (message, notice)
+        yield history
+    return llm_scheduler.acquire("dashscope", model, tokens, "interactive",
+                                 timeout=deadline.budget(kind), cancel_token=cancel_token, stage=kind)
 
 # Helper functions
+def dashscope_delta_text(response):
+    """Text carried by one incremental DashScope chunk (used for usage accounting)."""
+    if response.status_code == 200 and hasattr(response.output, 'choices') and response.output.choices:
+        return response.output.choices[0].message.content or ""
+    return ""
+
 def get_formatted_time():
     return datetime.now().strftime("%Y%m%d_%H%M%S")
 
 def save_conversation(history, mode):
-    if not os.path.exists("conversation_datasets"):
-        os.makedirs("conversation_datasets")
-    
-    filename = f"conversation_datasets/{mode}_conversation_{get_formatted_time()}.json"
-    
-    formatted_conversation = {
-        "conversation_id": f"{mode}_{get_formatted_time()}",
-        "model_a": config.LAWYER_MODEL if mode == 'case' else config.LEGAL_MODEL,
-        "conversations": []
-    }
-    
+    conversations = []
     for user_msg, bot_msg in history:
-        formatted_conversation["conversations"].append({"from": "human", "value": user_msg})
-        formatted_conversation["conversations"].append({"from": "gpt", "value": bot_msg})
-        
-    with open(filename, 'w', encoding='utf-8') as f:
-        json.dump([formatted_conversation], f, ensure_ascii=False, indent=4)
+        conversations.append({"from": "human", "value": user_msg})
+        conversations.append({"from": "gpt", "value": bot_msg})
     
-    return filename
+    return dataset_writer.get_writer().append(
+        conversations,
+        source=f"{mode}_conversation",
+        model_a=config.LAWYER_MODEL if mode == 'case' else config.LEGAL_MODEL,
+    )
 
 def save_analysis_result(result_text):
     if not os.path.exists("case_analysis_results"):
@@ -109,30 +220,63 @@ def save_analysis_result(result_text):
         f.write(result_text)
     return filename
 
+def save_case_analysis_result(filename, analysis_data):
+    """Write the structured case analysis atomically so readers never see a half-written file."""
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    tmp_filename = f"{filename}.tmp"
+    with open(tmp_filename, 'w', encoding='utf-8') as f:
+        json.dump(analysis_data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_filename, filename)
+    # Keep the search index in step with the file; a missed update is picked up by `search_index.py sync`
+    try:
+        search_index.get_index().upsert(filename, analysis_data)
+    except Exception as e:
+        print(f"⚠️ 更新报告检索索引失败: {e}")
+    # Completed reports become exemplars for later consultations (embedded in the background)
+    if case_retriever is not None and analysis_data.get("status") == "complete":
+        case_retriever.add_async(os.path.splitext(os.path.basename(filename))[0], analysis_data.get("conversation", ""),
+                                 dict(analysis_data.get("analysis_sections") or {}), analysis_data.get("case_type"))
+    return filename
+
 def get_user_chat_file_path(user_id):
     """Get the file path for storing user's chat history."""
     if not os.path.exists("user_histories"):
         os.makedirs("user_histories")
     return f"user_histories/{user_id}_chat_history.json"
 
+def merge_chat_data(current, chat_data):
+    """Merge a conflicting write: keep the turns already stored by the other request, then append this turn's new ones.
+
+    The session state comes from this turn, which is the one that finished last.
+    """
+    if not current:
+        return chat_data
+    merged_history = [list(turn) for turn in current.get("chat_history") or []]
+    for turn in chat_data.get("chat_history") or []:
+        if list(turn) not in merged_history:
+            merged_history.append(list(turn))
+    return dict(chat_data, chat_history=merged_history)
+
 def save_user_chat_history(user_id, history, user_state):
-    """Save user's chat history and state to a JSON file."""
+    """Save user's chat history and state to the shared backend and a JSON file."""
     try:
         chat_data = {
             "user_id": user_id,
             "last_updated": datetime.now().isoformat(),
             "chat_history": history,
-            "user_state": {
-                "current_mode": user_state.current_mode,
-                "user_input_round": user_state.user_input_round,
-                "case_type_selected": user_state.case_type_selected,
-                "current_lawyer_prompt": user_state.current_lawyer_prompt,
-                "legal_conversation_history": user_state.legal_conversation_history,
-                "case_conversation_history": user_state.case_conversation_history,
-                "contract_review_history": user_state.contract_review_history
-            }
+            "user_state": user_state.to_dict()
         }
         
+        try:
+            record = state_backend.put(user_id, chat_data, expected_version=user_state.version)
+        except state_store.VersionConflictError as e:
+            # 同一用户的另一个请求（可能在其他进程中）已先行写入，在其结果上合并本轮内容后重试
+            print(f"⚠️ 会话状态写入冲突，合并后重试: {e}")
+            record = state_backend.update(user_id, lambda current: merge_chat_data(current, chat_data))
+            chat_data = record.data
+        user_state.version = record.version
+        user_chat_histories[user_id] = (record.version, list(chat_data["chat_history"]))
+
         file_path = get_user_chat_file_path(user_id)
         with open(file_path, 'w', encoding='utf-8') as f:
             json.dump(chat_data, f, ensure_ascii=False, indent=2)
@@ -143,28 +287,25 @@ def save_user_chat_history(user_id, history, user_state):
         return None
 
 def load_user_chat_history(user_id):
-    """Load user's chat history and state from JSON file."""
+    """Load user's chat history and state from the shared backend, falling back to the JSON file."""
     try:
-        file_path = get_user_chat_file_path(user_id)
-        if not os.path.exists(file_path):
-            return None, None
-        
-        with open(file_path, 'r', encoding='utf-8') as f:
-            chat_data = json.load(f)
+        record = state_backend.get(user_id)
+        if record is not None:
+            chat_data = record.data
+        else:
+            file_path = get_user_chat_file_path(user_id)
+            if not os.path.exists(file_path):
+                return None, None
+            
+            with open(file_path, 'r', encoding='utf-8') as f:
+                chat_data = json.load(f)
         
         # Load chat history
         history = chat_data.get("chat_history", [])
         
         # Restore user state
-        state_data = chat_data.get("user_state", {})
-        user_state = SystemState()
-        user_state.current_mode = state_data.get("current_mode", "selection")
-        user_state.user_input_round = state_data.get("user_input_round", 0)
-        user_state.case_type_selected = state_data.get("case_type_selected", None)
-        user_state.current_lawyer_prompt = state_data.get("current_lawyer_prompt", None)
-        user_state.legal_conversation_history = state_data.get("legal_conversation_history", [])
-        user_state.case_conversation_history = state_data.get("case_conversation_history", [])
-        user_state.contract_review_history = state_data.get("contract_review_history", [])
+        user_state = SystemState.from_dict(chat_data.get("user_state", {}))
+        user_state.version = record.version if record is not None else 0
         
         return history, user_state
     except Exception as e:
@@ -197,53 +338,59 @@ def get_initial_prompt():
 **或直接上传合同文件开始合同审查！**
 '''
 
-def analyze_contracts(files):
+def analyze_contracts(files, cancel_token=None, deadline=None, user_id=None, on_submit=None):
+    """提交合同审查任务并转发进度。on_submit(job_id) 在任务入队（上传文件已复制到任务目录）后调用。"""
     if not files:
         yield "❌ **错误**：请先上传文件。"
         return
 
-    file_paths = [f.name for f in files]
+    file_paths = [f if isinstance(f, str) else f.name for f in files]
 
     if len(file_paths) > 1:
-        if all(p.lower().endswith(('.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.webp')) for p in file_paths):
-            mode = "multi_image"
-        else:
+        if not all(p.lower().endswith(('.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.webp')) for p in file_paths):
             yield "❌ **错误**：上传多个文件时，必须全部是图片。"
             return
-    elif file_paths[0].lower().endswith(('.pdf', '.docx', '.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.webp')):
-        mode = "single_document"
-    else:
+    elif not file_paths[0].lower().endswith(('.pdf', '.docx', '.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.webp')):
         yield "❌ **错误**：不支持的文件格式。请上传 PDF, DOCX, 或图片文件。"
         return
 
     try:
-        yield "⏳ **正在提取文本...**"
-        if mode == "multi_image":
-            text = contract_analyzer.extract_texts_from_multiple_images(file_paths)
-        else:
-            text = extract_text_from_file(file_paths[0])
-
-        if not text.strip():
-            yield "❌ **错误**：未能从文件中提取到任何文本。"
-            return
-
-        contract_type = classify_contract_type(text)
-        yield f"📌 **初步识别的合同类型**：{contract_type}\n\n---\n\n⏳ **正在进行深度分析，请稍候...**"
-
-        full_response = f"📌 **初步识别的合同类型**：{contract_type}\n\n---\n\n"
-        for chunk in contract_analyzer.analyze_contract_stream(text, contract_type, file_paths):
-            full_response += chunk
-            yield full_response
+        # OCR 与模型分析在独立的 worker 进程池中执行，这里只负责提交任务并转发进度
+        deadline = deadline or deadlines.Deadline(config.CONTRACT_REVIEW_DEADLINE_SECONDS)
+        job_id = contract_job_queue.submit(file_paths, deadline_at=deadline.expires_at, user_id=user_id)
+        if on_submit is not None:
+            on_submit(job_id)
+        streamed_text = ""
+        completed = False
+        try:
+            for streamed_text in contract_job_queue.stream(job_id, deadline_at=deadline.expires_at):
+                if cancel_token is not None and cancel_token.cancelled:
+                    break
+                yield streamed_text
+            completed = not (cancel_token is not None and cancel_token.cancelled)
+        finally:
+            # 本轮被取消，或客户端断开（生成器在 yield 处被关闭）时，通知 worker 停止该任务，
+            # worker 会关闭 DeepSeek 的流式连接
+            if not completed:
+                contract_job_queue.request_cancel(job_id)
+                cancellation.record_cancellation("contract", streamed_text)
+            # 合同原文只有 worker 知道，这里按输出估算并计入用户额度
+            admission_controller.charge(user_id, estimate_tokens(streamed_text))
 
     except Exception as e:
         yield f"❌ **程序发生严重错误**：\n\n`{str(e)}`"
 
-def reset_system(request: gr.Request=None):
+def reset_system(request: gr.Request=None, user_id=None):
     """Reset the current user's system state and clear their chat history."""
-    if request is not None:
-        user_id = get_user_id_from_request(request)
-        # Reset user state
+    if request is not None or user_id is not None:
+        if user_id is None:
+            user_id = get_user_id_from_request(request)
+        # Stop any generation (including a prefetched report) still running for this user, then reset user state
+        turn_registry.cancel(user_id, "reset")
+        report_prefetcher.discard(user_id)
+        state_backend.delete(user_id)
         user_states[user_id] = SystemState()
+        user_chat_histories.pop(user_id, None)
         # Clear the saved chat history file
         file_path = get_user_chat_file_path(user_id)
         if os.path.exists(file_path):
@@ -256,8 +403,8 @@ def reset_system(request: gr.Request=None):
     global system_state
     system_state = SystemState()
 
-def chat_legal_knowledge_stream(message, history, request: gr.Request):
-    user_id, system_state = get_or_create_user_state(request)
+def chat_legal_knowledge_stream(message, history, request: gr.Request, user_id=None, cancel_token=None, deadline=None):
+    user_id, system_state = get_or_create_user_state(request, user_id)
     
     if not system_state.legal_conversation_history or system_state.current_mode != "legal_knowledge":
         system_state.legal_conversation_history = [{'role': Role.SYSTEM, 'content': prompts.LEGAL_CONSULTANT_PROMPT}]
@@ -270,31 +417,56 @@ def chat_legal_knowledge_stream(message, history, request: gr.Request):
     
     history.append((message, ""))
     
+    deadline = deadline or deadlines.Deadline()
     try:
+        prompt_tokens = estimate_messages_tokens(system_state.legal_conversation_history)
+        try:
+            ticket = yield from wait_for_llm_quota(config.LEGAL_MODEL, prompt_tokens, "legal", message, history,
+                                                   deadline, cancel_token)
+        except (deadlines.DeadlineExceeded, scheduler.QuotaWaitCancelled):
+            history[-1] = (message, BUSY_REPLY)
+            yield history
+            return
+        
         responses = Generation.call(
             model=config.LEGAL_MODEL,
             messages=system_state.legal_conversation_history,
             result_format='message',
             stream=True,
-            incremental_output=True
+            incremental_output=True,
+            # DashScope 的流由其 SDK 内部的生成器读取，无法从外部关闭；读超时使停滞的连接自行结束
+            request_timeout=config.STREAM_IDLE_TIMEOUT
         )
         
         full_response = ""
         
-        for response in responses:
-            if response.status_code == 200:
-                if hasattr(response.output, 'choices') and response.output.choices:
-                    delta_content = response.output.choices[0].message.content
-                    if delta_content:
-                        full_response += delta_content
-                        history[-1] = (message, full_response)
-                        yield history
-                        time.sleep(0.02)
-            else:
-                error_msg = f"API错误: {response.code} - {response.message}"
-                history[-1] = (message, error_msg)
-                yield history
-                return
+        try:
+            for response in deadlines.iter_within(
+                cancellation.cancellable(responses, cancel_token, "legal", dashscope_delta_text),
+                deadline.budget("legal"), "legal"
+            ):
+                if response.status_code == 200:
+                    if hasattr(response.output, 'choices') and response.output.choices:
+                        delta_content = response.output.choices[0].message.content
+                        if delta_content:
+                            full_response += delta_content
+                            history[-1] = (message, full_response)
+                            yield history
+                            time.sleep(0.02)
+                else:
+                    error_msg = f"API错误: {response.code} - {response.message}"
+                    history[-1] = (message, error_msg)
+                    yield history
+                    return
+        except deadlines.DeadlineExceeded:
+            # 保留已生成的内容，提示回复不完整
+            deadlines.record_degradation("legal", "truncate")
+            full_response += TRUNCATED_REPLY_NOTE
+            history[-1] = (message, full_response)
+            yield history
+        finally:
+            ticket.settle(prompt_tokens + estimate_tokens(full_response))
+            admission_controller.charge(user_id, prompt_tokens + estimate_tokens(full_response))
         
         system_state.legal_conversation_history.append({'role': Role.ASSISTANT, 'content': full_response})
         
@@ -304,6 +476,12 @@ def chat_legal_knowledge_stream(message, history, request: gr.Request):
         yield history
 
 def detect_case_type(user_input):
+    # 先走向量路由（内含明确关键词的快速通道），置信度不足时再用下面的关键词规则
+    if case_type_router is not None:
+        routed = case_type_router.route(user_input)
+        if routed.label is not None:
+            return routed.label
+    
     user_input_lower = user_input.lower().strip()
     
     if user_input_lower in ['1', '2', '3', '4', '5']:
@@ -341,11 +519,12 @@ def detect_conversation_end(lawyer_response):
     
     return not has_question_mark
 
-def chat_case_strategy_stream(message, history, request: gr.Request):
-    user_id, system_state = get_or_create_user_state(request)
+def chat_case_strategy_stream(message, history, request: gr.Request, user_id=None, cancel_token=None, deadline=None):
+    user_id, system_state = get_or_create_user_state(request, user_id)
+    deadline = deadline or deadlines.Deadline()
     
     if not system_state.case_conversation_history or system_state.current_mode != "case_strategy":
-        system_state.case_conversation_history = [{'role': Role.SYSTEM, 'content': prompts.DEFAULT_LAWYER_SYSTEM_PROMPT}]
+        system_state.reset_case_conversation(prompts.DEFAULT_LAWYER_SYSTEM_PROMPT)
         system_state.current_mode = "case_strategy"
         system_state.user_input_round = 0
         system_state.case_type_selected = None
@@ -367,13 +546,13 @@ def chat_case_strategy_stream(message, history, request: gr.Request):
                 # 如果检测到案件类型，直接确认并设置
                 system_state.case_type_selected = detected_type
                 system_state.current_lawyer_prompt = prompt_loader.load_lawyer_prompt(detected_type)
-                system_state.case_conversation_history = [{'role': Role.SYSTEM, 'content': system_state.current_lawyer_prompt}]
+                system_state.reset_case_conversation(system_state.current_lawyer_prompt)
                 
                 case_name = config.CASE_TYPES[detected_type]["name"]
                 response_msg = f"您好！我是您的专业劳动法律师，很高兴为您提供法律咨询服务。我了解您的案件类型是：{case_name}\n\n现在让我们开始详细了解您的具体情况。"
                 
-                system_state.case_conversation_history.append({'role': Role.USER, 'content': message})
-                system_state.case_conversation_history.append({'role': Role.ASSISTANT, 'content': response_msg})
+                system_state.append_case_message(Role.USER, message)
+                system_state.append_case_message(Role.ASSISTANT, response_msg)
                 
                 full_response = f"【案件类型确认】\n{response_msg}"
                 history[-1] = (message, full_response)
@@ -382,8 +561,8 @@ def chat_case_strategy_stream(message, history, request: gr.Request):
             else:
                 # 如果检测不到案件类型，显示选择提示
                 prompt_response = get_case_selection_prompt()
-                system_state.case_conversation_history.append({'role': Role.USER, 'content': message})
-                system_state.case_conversation_history.append({'role': Role.ASSISTANT, 'content': prompt_response})
+                system_state.append_case_message(Role.USER, message)
+                system_state.append_case_message(Role.ASSISTANT, prompt_response)
                 history[-1] = (message, prompt_response)
                 yield history
                 return
@@ -394,13 +573,13 @@ def chat_case_strategy_stream(message, history, request: gr.Request):
             if detected_type:
                 system_state.case_type_selected = detected_type
                 system_state.current_lawyer_prompt = prompt_loader.load_lawyer_prompt(detected_type)
-                system_state.case_conversation_history = [{'role': Role.SYSTEM, 'content': system_state.current_lawyer_prompt}]
+                system_state.reset_case_conversation(system_state.current_lawyer_prompt)
                 
                 case_name = config.CASE_TYPES[detected_type]["name"]
                 response_msg = f"您好！我是您的专业劳动法律师，很高兴为您提供法律咨询服务。我了解您的案件类型是：{case_name}。\n现在让我们开始详细了解您的具体情况。"
                 
-                system_state.case_conversation_history.append({'role': Role.USER, 'content': message})
-                system_state.case_conversation_history.append({'role': Role.ASSISTANT, 'content': response_msg})
+                system_state.append_case_message(Role.USER, message)
+                system_state.append_case_message(Role.ASSISTANT, response_msg)
                 
                 full_response = f"【案件类型确认】\n{response_msg}"
                 history[-1] = (message, full_response)
@@ -408,8 +587,8 @@ def chat_case_strategy_stream(message, history, request: gr.Request):
                 return
             else:
                 selection_prompt = "抱歉，我暂时无法对你的描述进行案件类型判断，请您重新描述您的情况。" + get_case_selection_prompt()
-                system_state.case_conversation_history.append({'role': Role.USER, 'content': message})
-                system_state.case_conversation_history.append({'role': Role.ASSISTANT, 'content': selection_prompt})
+                system_state.append_case_message(Role.USER, message)
+                system_state.append_case_message(Role.ASSISTANT, selection_prompt)
                 full_response = f"【请重新选择案件类型】\n{selection_prompt}"
                 history[-1] = (message, full_response)
                 yield history
@@ -418,100 +597,203 @@ def chat_case_strategy_stream(message, history, request: gr.Request):
         effective_round = system_state.user_input_round - (2 if system_state.case_type_selected else 1)
         
         if effective_round <= 4:
-            polished_message = paralegal.polish_user_input(message)
-            system_state.case_conversation_history.append({'role': Role.USER, 'content': polished_message})
+            polished_message = paralegal.polish_user_input(message, cancel_token, deadline)
+            if polished_message != message:
+                admission_controller.charge(user_id, estimate_tokens(prompts.PARALEGAL_SYSTEM_PROMPT + message + polished_message))
+            system_state.append_case_message(Role.USER, polished_message)
             final_message = polished_message
         else:
-            system_state.case_conversation_history.append({'role': Role.USER, 'content': message})
+            system_state.append_case_message(Role.USER, message)
             final_message = message
         
+        lawyer_messages = system_state.case_conversation_history
+        if deadline.remaining() < config.DEADLINE_SHRINK_CONTEXT_BELOW:
+            # 剩余时间不多时只带最近的对话，缩短首字延迟
+            lawyer_messages = deadlines.shrink_messages(lawyer_messages)
+            deadlines.record_degradation("lawyer", "shrink_context")
+        
+        prompt_tokens = estimate_messages_tokens(lawyer_messages)
+        try:
+            ticket = yield from wait_for_llm_quota(config.LAWYER_MODEL, prompt_tokens, "lawyer", message, history,
+                                                   deadline, cancel_token)
+        except (deadlines.DeadlineExceeded, scheduler.QuotaWaitCancelled):
+            # 撤回本轮用户消息，避免下一轮出现连续两条用户消息
+            system_state.case_conversation_history.pop()
+            system_state.case_transcript = CaseTranscript.from_messages(system_state.case_conversation_history)
+            system_state.user_input_round -= 1
+            history[-1] = (message, BUSY_REPLY)
+            yield history
+            return
+        
         responses = Generation.call(
             model=config.LAWYER_MODEL,
-            messages=system_state.case_conversation_history,
+            messages=lawyer_messages,
             result_format='message',
             stream=True,
-            incremental_output=True
+            incremental_output=True,
+            request_timeout=config.STREAM_IDLE_TIMEOUT
         )
         
         full_response = ""
+        truncated = False
         
-        for response in responses:
-            if response.status_code == 200:
-                if hasattr(response.output, 'choices') and response.output.choices:
-                    delta_content = response.output.choices[0].message.content
-                    if delta_content:
-                        full_response += delta_content
-                        display_response = f"【律师回复】\n{full_response}"
-                        history[-1] = (message, display_response)
-                        yield history
-                        time.sleep(0.01)
-            else:
-                error_msg = f"API错误: {response.code} - {response.message}"
-                history[-1] = (message, error_msg)
-                yield history
-                return
+        # 报告预生成：以截至本条用户消息的对话为准，律师回复输出期间一旦预测为收尾就在后台开始生成
+        prefetch_key = system_state.case_transcript.content_hash
+        prefetch_eligible = config.REPORT_PREFETCH_ENABLED and system_state.user_input_round > 3
+        prefetch_started = False
+        case_type_name = config.CASE_TYPES.get(system_state.case_type_selected, {}).get("name", "未知类型")
+        if prefetch_eligible:
+            coverage = report_prefetch.checklist_coverage(
+                report_prefetch.user_text(system_state.case_transcript), system_state.case_type_selected
+            )
         
-        system_state.case_conversation_history.append({'role': Role.ASSISTANT, 'content': full_response})
+        try:
+            for response in deadlines.iter_within(
+                cancellation.cancellable(responses, cancel_token, "lawyer", dashscope_delta_text),
+                deadline.budget("lawyer"), "lawyer"
+            ):
+                if response.status_code == 200:
+                    if hasattr(response.output, 'choices') and response.output.choices:
+                        delta_content = response.output.choices[0].message.content
+                        if delta_content:
+                            full_response += delta_content
+                            if (prefetch_eligible and not prefetch_started
+                                    and ending_predictor.likely(system_state.user_input_round, full_response, coverage)):
+                                report_prefetcher.start(user_id, prefetch_key, system_state.case_transcript.text,
+                                                        system_state.case_transcript.token_count, deadline,
+                                                        case_type=case_type_name, cancel_token=cancel_token)
+                                prefetch_started = True
+                            display_response = f"【律师回复】\n{full_response}"
+                            history[-1] = (message, display_response)
+                            yield history
+                            time.sleep(0.01)
+                else:
+                    error_msg = f"API错误: {response.code} - {response.message}"
+                    history[-1] = (message, error_msg)
+                    yield history
+                    return
+        except deadlines.DeadlineExceeded:
+            deadlines.record_degradation("lawyer", "truncate")
+            truncated = True
+            history[-1] = (message, f"【律师回复】\n{full_response}{TRUNCATED_REPLY_NOTE}")
+            yield history
+        finally:
+            ticket.settle(prompt_tokens + estimate_tokens(full_response))
+            admission_controller.charge(user_id, prompt_tokens + estimate_tokens(full_response))
+        
+        system_state.append_case_message(Role.ASSISTANT, full_response)
+        if truncated or (cancel_token is not None and cancel_token.cancelled):
+            report_prefetcher.discard(user_id)
+            return
         
         should_generate_analysis = detect_conversation_end(full_response)
+        if not should_generate_analysis:
+            # 律师仍在提问，对话继续，之前的预生成作废
+            report_prefetcher.discard(user_id)
 
         if should_generate_analysis and system_state.user_input_round > 3:
             try:
-                conversation_content = ""
-                for msg in system_state.case_conversation_history:
-                    if msg['role'] in ['user', 'assistant']:
-                        role_name = "用户" if msg['role'] == 'user' else "律师"
-                        content = msg['content']
-                        content = re.sub(r'^【.*?】\s*', '', content)
-                        conversation_content += f"{role_name}: {content}\n\n"
+                transcript = system_state.case_transcript
+                prefetched = report_prefetcher.take(user_id, prefetch_key)
+                if prefetched is not None:
+                    conversation_content = prefetched.conversation_content
+                    conversation_hash = prefetch_key
+                    conversation_tokens = prefetched.transcript_tokens
+                else:
+                    conversation_content = transcript.text
+                    conversation_hash = transcript.content_hash
+                    conversation_tokens = transcript.token_count
                 
-                if conversation_content.strip():
+                if conversation_content:
                     analysis_start = "\n\n🎯 **正在为您生成专业案例分析报告...**\n\n"
                     history[-1] = (message, full_response + analysis_start)
                     yield history
                     
-                    case_analysis = case_analyzer.generate_case_analysis(conversation_content.strip())
+                    timestamp = pd.Timestamp.now().strftime('%Y%m%d_%H%M%S')
+                    analysis_filename = f"./case_analysis_results/case_analysis_{timestamp}.json"
+                    analysis_data = {
+                        "timestamp": timestamp,
+                        # 报告接口只向咨询者本人（或管理员）返回报告
+                        "user_id": user_id,
+                        "case_type": config.CASE_TYPES.get(system_state.case_type_selected, {}).get("name", "未知类型"),
+                        "conversation": conversation_content,
+                        "conversation_hash": conversation_hash,
+                        "conversation_tokens": conversation_tokens,
+                        "case_analysis": "",
+                        "analysis_sections": {},
+                        "status": "generating"
+                    }
                     
-                    if case_analysis and case_analysis != "生成分析失败":
-                        timestamp = pd.Timestamp.now().strftime('%Y%m%d_%H%M%S')
-                        
-                        analysis_data = {
-                            "timestamp": timestamp,
-                            "case_type": config.CASE_TYPES.get(system_state.case_type_selected, {}).get("name", "未知类型"),
-                            "conversation": conversation_content,
-                            "case_analysis": case_analysis,
-                            "analysis_sections": {}
-                        }
-                        
-                        sections = re.split(r'【(案情分析|当前应对方案|维权与赔偿方案)】', case_analysis)
-                        for i in range(1, len(sections), 2):
-                            if i + 1 < len(sections):
-                                section_title = sections[i]
-                                section_content = sections[i + 1].strip()
-                                analysis_data["analysis_sections"][section_title] = section_content
-                        
-                        os.makedirs('./case_analysis_results', exist_ok=True)
-                        analysis_filename = f"./case_analysis_results/case_analysis_{timestamp}.json"
-                        with open(analysis_filename, 'w', encoding='utf-8') as f:
-                            json.dump(analysis_data, f, ensure_ascii=False, indent=2)
-                        
-                        final_content = f"{full_response}\n\n🎯 **专业案例分析报告**\n\n"
-                        
-                        paragraphs = case_analysis.split('\n\n')
-                        for para in paragraphs:
-                            if para.strip():
-                                final_content += para + "\n\n"
+                    # 逐段解析流式输出：每完成一个部分就展示并落盘，三部分齐全后提前结束生成
+                    section_parser = CaseReportSectionParser()
+                    final_content = f"{full_response}\n\n🎯 **专业案例分析报告**\n\n"
+                    generation_error = None
+                    
+                    def _show_sections(completed_sections):
+                        nonlocal final_content
+                        for section_title, section_content in completed_sections:
+                            analysis_data["analysis_sections"][section_title] = section_content
+                            analysis_data["case_analysis"] = section_parser.report_text
+                            save_case_analysis_result(analysis_filename, analysis_data)
+                            final_content += f"【{section_title}】\n{section_content}\n\n"
+                        return bool(completed_sections)
+                    
+                    if prefetched is not None:
+                        # 报告已在律师回复期间开始生成，先重放已生成的部分再继续等待
+                        analysis_stats = prefetched.stats
+                        analysis_source = prefetched.stream()
+                        close_analysis = prefetched.cancel
+                    else:
+                        analysis_upstream = deadlines.Upstream()
+                        close_analysis = analysis_upstream.close
+                        analysis_stats = {}
+                        analysis_tier = None
+                        if deadline.remaining() < config.DEADLINE_FAST_TIER_BELOW:
+                            # 剩余时间不足以等待推理模型，改用快速档
+                            analysis_tier = "fast"
+                            deadlines.record_degradation("analysis", "fast_tier")
+                        analysis_source = case_analyzer.generate_case_analysis_stream(
+                            conversation_content, tier=analysis_tier, transcript_tokens=conversation_tokens,
+                            stats=analysis_stats, cancel_token=cancel_token, deadline=deadline,
+                            case_type=analysis_data["case_type"], upstream=analysis_upstream
+                        )
+                    try:
+                        for delta in deadlines.iter_within(analysis_source, deadline.budget("analysis"), "analysis",
+                                                           close=close_analysis):
+                            if _show_sections(section_parser.feed(delta)):
                                 history[-1] = (message, final_content)
                                 yield history
-                                time.sleep(0.1)
-
+                            if section_parser.should_stop():
+                                break
+                    except Exception as e:
+                        generation_error = e
+                    admission_controller.charge(
+                        user_id, (analysis_stats.get("prompt_tokens") or 0) + (analysis_stats.get("completion_tokens") or 0)
+                    )
+                    if _show_sections(section_parser.finish()):
+                        history[-1] = (message, final_content)
+                        yield history
+                    
+                    if section_parser.sections:
+                        analysis_data["case_analysis"] = section_parser.report_text
+                        analysis_data["analysis_tier"] = analysis_stats.get("tier")
+                        analysis_data["analysis_model"] = analysis_stats.get("model")
+                        analysis_data["retrieval"] = analysis_stats.get("retrieval")
+                        analysis_data["status"] = "complete" if section_parser.complete else "partial"
+                        save_case_analysis_result(analysis_filename, analysis_data)
+                    
+                    if section_parser.complete:
                         summary = f"{final_content}\n✅ 案例分析已完成并保存！\n📁 文件路径：{analysis_filename}\n\n💡 您可以：\n1. 继续提问补充信息\n2. 开始新的咨询\n3. 查看保存的分析报告"
-                        saved_conversation_file = save_case_conversation_history(request)
+                        saved_conversation_file = save_case_conversation_history(request, user_id)
                         if saved_conversation_file:
-                            summary += f"\n📁 对话历史已保存：{saved_conversation_file}"
+                            summary += f"\n📁 对话历史已保存（记录编号：{saved_conversation_file}）"
                         history[-1] = (message, summary)
                         yield history
-                        
+                    elif section_parser.sections:
+                        reason = f"：{generation_error}" if generation_error else ""
+                        partial_msg = f"{final_content}\n⚠️ 报告生成中断{reason}，已完成的部分已保存至：{analysis_filename}\n您可以继续补充信息后重新生成。"
+                        history[-1] = (message, partial_msg)
+                        yield history
                     else:
                         error_msg = f"{full_response}\n\n❌ 案例分析生成失败，请稍后重试。"
                         history[-1] = (message, error_msg)
@@ -527,9 +809,9 @@ def chat_case_strategy_stream(message, history, request: gr.Request):
         history[-1] = (message, error_msg)
         yield history
 
-def save_case_conversation_history(request: gr.Request):
+def save_case_conversation_history(request: gr.Request, user_id=None):
     try:
-        user_id, system_state = get_or_create_user_state(request)
+        user_id, system_state = get_or_create_user_state(request, user_id)
         
         if not system_state.case_conversation_history:
             return
@@ -561,20 +843,25 @@ def save_case_conversation_history(request: gr.Request):
                 "conversations": current_conversation
             })
         
-        timestamp = pd.Timestamp.now().strftime('%Y%m%d_%H%M%S')
-        os.makedirs('./conversation_datasets', exist_ok=True)
-        filename = f"./conversation_datasets/case_consultation_{user_id}_{timestamp}.json"
-        
-        with open(filename, 'w', encoding='utf-8') as f:
-            json.dump(sharegpt_data, f, ensure_ascii=False, indent=2)
-            
-        return filename
+        # 追加到分片数据集（dataset_writer.py），系统提示词通过旁表引用
+        writer = dataset_writer.get_writer()
+        record_ids = [
+            writer.append(item["conversations"], item["system_prompt"],
+                          source="case_consultation", user_id=user_id, case_type=system_state.case_type_selected)
+            for item in sharegpt_data
+        ]
+        return ", ".join(record_ids)
         
     except Exception as e:
         print(f"保存对话历史失败: {e}")
         return None
 
 def detect_user_intent(user_input):
+    if intent_router is not None:
+        routed = intent_router.route(user_input)
+        if routed.label is not None:
+            return routed.label
+    
     user_input_lower = user_input.lower().strip()
     
     contract_keywords = [
@@ -611,14 +898,84 @@ def detect_user_intent(user_input):
         
     return 'unknown'
 
-def unified_chat_with_clear(message, history, request: gr.Request, files=None):
-    """包装函数：执行聊天功能并清空输入框"""
-    for response in unified_chat(message, history, request, files):
-        yield response, ""
+def window_history(history, visible_turns):
+    """Return only the most recent turns for the client; older turns stay on the server."""
+    if not history or len(history) <= visible_turns:
+        return history or []
+    hidden = len(history) - visible_turns
+    return [("", f"📜 更早的 {hidden} 轮对话已折叠，点击“加载更早的对话”查看。")] + history[-visible_turns:]
+
+def unified_chat_with_clear(message, visible_turns, request: gr.Request):
+    """包装函数：执行聊天功能并清空输入框
+
+    客户端只发送新消息，完整历史由服务端加载；返回给客户端的只是最近 visible_turns 轮。
+    """
+    for response in unified_chat(message, None, request):
+        yield window_history(response, visible_turns), ""
 
-def unified_chat(message, history, request: gr.Request, files=None):
+def unified_chat_upload(files, visible_turns, request: gr.Request):
+    """包装函数：上传合同文件进行审查，同样只返回最近的对话窗口"""
+    for response in unified_chat("", None, request, files):
+        yield window_history(response, visible_turns)
+
+def load_older_history(visible_turns, request: gr.Request):
+    """Widen the client window by one page of older turns."""
+    user_id, _ = get_or_create_user_state(request)
+    history, _ = load_user_chat_history(user_id)
+    visible_turns += config.CHAT_HISTORY_WINDOW
+    return window_history(history or [], visible_turns), visible_turns
+
+def unified_chat(message, history, request: gr.Request, files=None, user_id=None, deadline_seconds=None,
+                 on_contract_job=None):
+    """Entry point shared by the Gradio UI and the HTTP API (api.py).
+
+    The UI identifies users from the request; API callers pass an explicit
+    user_id derived from their session token. Each call is one turn with its
+    own cancellation token: a new turn, a reset or a client disconnect stops
+    the model calls still running for the previous one. Turns are admitted
+    per user first (admission.py). The turn deadline
+    (deadline_seconds, or the configured default) is split into per-stage
+    budgets further down the pipeline. on_contract_job(job_id) is called once
+    uploaded files have been submitted to the contract review queue.
+    """
+    if user_id is None:
+        user_id = get_user_id_from_request(request)
+    if deadline_seconds is None:
+        deadline_seconds = config.CONTRACT_REVIEW_DEADLINE_SECONDS if files else config.REQUEST_DEADLINE_SECONDS
+    deadline = deadlines.Deadline(deadline_seconds)
+    
+    # Admission control: per-user limits, then fair queuing when the process is saturated
+    shown_message = message if message or not files else "用户上传了合同文件"
+    if admission_controller.saturated and not admission_controller.is_admin(user_id):
+        waiting_history = list(history or load_user_chat_history(user_id)[0] or [])
+        waiting_history.append((shown_message, "⏳ 当前咨询人数较多，正在排队，请稍候..."))
+        yield waiting_history
+    try:
+        admitted = admission_controller.admit(user_id, timeout=deadline.remaining())
+    except admission.AdmissionRejected as e:
+        rejected_history = list(history or load_user_chat_history(user_id)[0] or [])
+        rejected_history.append((shown_message, e.user_message))
+        yield rejected_history
+        return
+    
+    cancel_token = turn_registry.begin_turn(user_id)
+    turn = _unified_chat_turn(message, history, request, files, user_id, cancel_token, deadline, on_contract_job)
+    try:
+        for snapshot in turn:
+            yield snapshot
+    except GeneratorExit:
+        # 客户端断开：先取消令牌，再关闭内层生成器，使上游流在关闭时能记录节省的用量
+        cancel_token.cancel("disconnect")
+        report_prefetcher.discard(user_id)
+        raise
+    finally:
+        turn.close()
+        turn_registry.end_turn(user_id, cancel_token)
+        admitted.release()
+
+def _unified_chat_turn(message, history, request, files, user_id, cancel_token, deadline, on_contract_job=None):
     # Identify user and load existing history if available
-    user_id, system_state = get_or_create_user_state(request)
+    user_id, system_state = get_or_create_user_state(request, user_id)
     
     # 处理对continue_prompt的响应
     if system_state.expecting_continue_response:
@@ -636,8 +993,7 @@ def unified_chat(message, history, request: gr.Request, files=None):
             if system_state.loaded_history_for_prompt:
                 history = system_state.loaded_history_for_prompt
                 if system_state.loaded_state_for_prompt:
-                    user_states[user_id] = system_state.loaded_state_for_prompt
-                    system_state = user_states[user_id]
+                    system_state = replace_user_state(user_id, system_state.loaded_state_for_prompt, system_state)
                 # 清理临时存储
                 system_state.loaded_history_for_prompt = None
                 system_state.loaded_state_for_prompt = None
@@ -651,8 +1007,8 @@ def unified_chat(message, history, request: gr.Request, files=None):
         # 检查是否包含重新开始关键词
         elif any(keyword in message_lower for keyword in restart_keywords):
             # 用户选择重新开始
-            reset_system(request)
-            new_history = initialize_user_session(request)
+            reset_system(request, user_id)
+            new_history = initialize_user_session(request, user_id)
             save_user_chat_history(user_id, new_history, system_state)
             yield new_history
             return
@@ -686,18 +1042,24 @@ def unified_chat(message, history, request: gr.Request, files=None):
             return
 
     loaded = False
-    if not history:
+    cached_history = user_chat_histories.get(user_id)
+    if not history and system_state.version and cached_history and cached_history[0] == system_state.version:
+        # get_or_create_user_state has just checked the version against the backend: nothing newer to load
+        history = list(cached_history[1])
+        loaded = True
+    elif not history:
         loaded_history, loaded_state = load_user_chat_history(user_id)
         if loaded_history is not None:
             history = loaded_history
             if loaded_state:
-                user_states[user_id] = loaded_state
+                # Rebind: the stream handlers read the cached state, and this turn saves system_state
+                system_state = replace_user_state(user_id, loaded_state, system_state)
             loaded = True
     
     # Handle file uploads for contract review
     if files and len(files) > 0:
         system_state.current_mode = "contract_review"
-        for response in analyze_contracts(files):
+        for response in analyze_contracts(files, cancel_token, deadline, user_id, on_contract_job):
             if not history:
                 history = []
             if len(history) == 0:
@@ -722,17 +1084,20 @@ def unified_chat(message, history, request: gr.Request, files=None):
     
     # Route based on current mode/state
     if system_state.current_mode == "case_strategy":
-        for response in chat_case_strategy_stream(message, history, request):
-            # Each yielded response is a full history snapshot
-            save_user_chat_history(user_id, response, system_state)
-            yield response
+        for response in chat_case_strategy_stream(message, history, request, user_id, cancel_token, deadline):
+            # Each yielded response is a full history snapshot; keep the latest one
+            # (the handler builds its own list when the caller passed history=None)
+            history = response
+            save_user_chat_history(user_id, history, system_state)
+            yield history
         if history and "案例分析已完成并保存！" in history[-1][1]:
             system_state.current_mode = "selection"
         save_user_chat_history(user_id, history, system_state)
     elif system_state.current_mode == "legal_knowledge":
-        for response in chat_legal_knowledge_stream(message, history):
-            save_user_chat_history(user_id, response, system_state)
-            yield response
+        for response in chat_legal_knowledge_stream(message, history, request, user_id, cancel_token, deadline):
+            history = response
+            save_user_chat_history(user_id, history, system_state)
+            yield history
         system_state.current_mode = "selection"
         save_user_chat_history(user_id, history, system_state)
     elif system_state.current_mode == "contract_review":
@@ -754,16 +1119,18 @@ def unified_chat(message, history, request: gr.Request, files=None):
             yield history
         elif intent == 'legal_knowledge':
             system_state.current_mode = "legal_knowledge"
-            for response in chat_legal_knowledge_stream(message, history, request):
-                save_user_chat_history(user_id, response, system_state)
-                yield response
+            for response in chat_legal_knowledge_stream(message, history, request, user_id, cancel_token, deadline):
+                history = response
+                save_user_chat_history(user_id, history, system_state)
+                yield history
             system_state.current_mode = "selection"
             save_user_chat_history(user_id, history, system_state)
         elif intent == 'case_strategy':
             system_state.current_mode = "case_strategy"
-            for response in chat_case_strategy_stream(message, history, request):
-                save_user_chat_history(user_id, response, system_state)
-                yield response
+            for response in chat_case_strategy_stream(message, history, request, user_id, cancel_token, deadline):
+                history = response
+                save_user_chat_history(user_id, history, system_state)
+                yield history
             if history and "案例分析已完成并保存！" in history[-1][1]:
                 system_state.current_mode = "selection"
             save_user_chat_history(user_id, history, system_state)
@@ -787,9 +1154,9 @@ def unified_chat(message, history, request: gr.Request, files=None):
             save_user_chat_history(user_id, history, system_state)
             yield history
 
-def initialize_user_session(request: gr.Request=None):
+def initialize_user_session(request: gr.Request=None, user_id=None):
     """Initialize user session when page loads."""
-    user_id, system_state = get_or_create_user_state(request)
+    user_id, system_state = get_or_create_user_state(request, user_id)
     
     # Try to load existing chat history
     loaded_history, loaded_state = load_user_chat_history(user_id)
@@ -797,7 +1164,7 @@ def initialize_user_session(request: gr.Request=None):
     if loaded_history is not None and len(loaded_history) > 0:
         # Restore previous state
         if loaded_state:
-            user_states[user_id] = loaded_state
+            system_state = replace_user_state(user_id, loaded_state, system_state)
         return loaded_history
     else:
         # Return initial prompt for new users
@@ -832,8 +1199,11 @@ def initialize_user_session_with_prompt(request: gr.Request):
         system_state.expecting_continue_response = True
         system_state.loaded_history_for_prompt = loaded_history
         system_state.loaded_state_for_prompt = loaded_state
+        # Persist the pending prompt so that whichever replica receives the
+        # reply knows we are waiting for "继续"/"重新开始"
+        save_user_chat_history(user_id, loaded_history, system_state)
         
-        # Add the prompt to history but don't save yet
+        # Add the prompt to history but don't save it
         prompt_history = loaded_history.copy()
         prompt_history.append(("", continue_prompt))
         
@@ -858,11 +1228,14 @@ with gr.Blocks(title="AI法律助手 - 专业劳动法咨询平台", theme=gr.th
     with gr.Row():
         with gr.Column(scale=2):
             # Chatbot
+            load_older_btn = gr.Button("⬆️ 加载更早的对话", variant="secondary", size="sm")
             chatbot = gr.Chatbot(
                 label="对话记录",
                 height=600,
                 value=[]
             )
+            # 客户端当前显示的对话轮数；历史记录以服务端为准
+            visible_turns = gr.State(config.CHAT_HISTORY_WINDOW)
             
             with gr.Row():
                 msg = gr.Textbox(
@@ -905,40 +1278,51 @@ with gr.Blocks(title="AI法律助手 - 专业劳动法咨询平台", theme=gr.th
                 """
             )
     
-    # Load user's previous history when page loads
+    # Load user's previous history when page loads (only the latest window is sent)
+    def _init_history_window(request: gr.Request):
+        return window_history(initialize_user_session_with_prompt(request), config.CHAT_HISTORY_WINDOW), config.CHAT_HISTORY_WINDOW
+    
     demo.load(
-        fn=initialize_user_session_with_prompt,
+        fn=_init_history_window,
         inputs=None,
-        outputs=chatbot
+        outputs=[chatbot, visible_turns]
     )
     
     submit_btn.click(
         fn=unified_chat_with_clear,
-        inputs=[msg, chatbot],
+        inputs=[msg, visible_turns],
         outputs=[chatbot, msg]
     )
     
     msg.submit(
         fn=unified_chat_with_clear,
-        inputs=[msg, chatbot],
+        inputs=[msg, visible_turns],
         outputs=[chatbot, msg]
     )
     
     upload_btn.click(
-        fn=unified_chat,
-        inputs=[msg, chatbot, file_input],
+        fn=unified_chat_upload,
+        inputs=[file_input, visible_turns],
         outputs=chatbot
     )
     
+    load_older_btn.click(
+        fn=load_older_history,
+        inputs=[visible_turns],
+        outputs=[chatbot, visible_turns]
+    )
+    
     def _reset_and_init_history(request: gr.Request):
         reset_system(request)
-        return initialize_user_session(request)
+        return initialize_user_session(request), config.CHAT_HISTORY_WINDOW
     
     clear_btn.click(
         fn=_reset_and_init_history,
         inputs=None,
-        outputs=chatbot
+        outputs=[chatbot, visible_turns]
     )
 
 if __name__ == "__main__":
-    demo.launch(server_name="0.0.0.0", server_port=7861, show_error=True)
\ No newline at end of file
+    if config.CONTRACT_REVIEW_WORKERS > 0:
+        contract_jobs.start_worker_pool(config.CONTRACT_REVIEW_WORKERS)
+    demo.launch(server_name="0.0.0.0", server_port=config.SERVER_PORT, show_error=True)
\ No newline at end of file
@@ -0,0 +1,130 @@
+"""多页图片的批量 OCR：逐页检测文本行，跨页合并识别。
+
+reader.readtext 每次只处理一张图片，并且在 CPU 上逐个文本行调用识别模型（batch size 为 1）。
+一份多页合同通常有几百个文本行，这里：
+1. 逐页运行文本检测（检测模型的输入是整页图片，无法跨页合并），裁出文本行
+2. 把各页的文本行按轮汇集，每轮至少攒够 _BATCHES_PER_ROUND 批；轮内按宽度排序后
+   每 OCR_RECOGNITION_BATCH_SIZE 行送入识别模型一次（宽度相近的放在同一批，减少补白）
+3. 识别结果按页、按从上到下的顺序还原，与 readtext(detail=0) 的输出格式一致
+
+按轮处理使得超时中断时，已完成的轮次中的页面仍然可用。
+
+使用 EasyOCR 的内部接口（Reader.detect、utils.get_image_list、recognition.get_text）。
+某页检测失败或某一轮识别失败时，相关页面退回 readtext 单页识别。
+"""
+import math
+from typing import Callable, List, Optional
+
+import cv2
+import numpy as np
+from easyocr import easyocr as easyocr_module
+from easyocr.recognition import get_text
+from easyocr.utils import get_image_list, reformat_input
+
+import config
+import deadlines
+import metrics
+import utils
+
+_BATCHES_PER_ROUND = 4
+
+
+def _decode(path: str) -> np.ndarray:
+    image = cv2.imdecode(np.fromfile(path, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError("无法解析图像，cv2.imdecode 失败")
+    return image
+
+
+def detect_lines(reader, path: str) -> List[np.ndarray]:
+    """单页文本检测。返回从上到下排列、已缩放到识别模型输入高度的文本行图片。"""
+    img, img_cv_grey = reformat_input(_decode(path))
+    horizontal_list, free_list = reader.detect(img, reformat=False)
+    image_list, _ = get_image_list(horizontal_list[0], free_list[0], img_cv_grey,
+                                   model_height=easyocr_module.imgH)
+    return [crop for _, crop in image_list]
+
+
+def recognize_lines(reader, crops: List[np.ndarray], batch_size: int) -> List[str]:
+    """按顺序每 batch_size 行识别一次；每批的输入宽度取该批最宽的一行。"""
+    img_h = easyocr_module.imgH
+    # 与 Reader.recognize 未指定 allowlist / blocklist 时相同：忽略所选语言之外的字符
+    ignore_char = ''.join(set(reader.character) - set(reader.lang_char))
+    texts = []
+    for start in range(0, len(crops), batch_size):
+        batch = crops[start:start + batch_size]
+        img_w = math.ceil(max(crop.shape[1] for crop in batch) / img_h) * img_h
+        result = get_text(reader.character, img_h, int(img_w), reader.recognizer, reader.converter,
+                          [(None, crop) for crop in batch], ignore_char=ignore_char, decoder='greedy',
+                          batch_size=batch_size, workers=0, device=reader.device)
+        texts.extend(item[1] for item in result)
+    return texts
+
+
+def read_pages(
+    reader,
+    paths: List[str],
+    batch_size: Optional[int] = None,
+    call: Optional[Callable] = None,
+    texts: Optional[List[Optional[str]]] = None
+) -> List[Optional[str]]:
+    """识别多页图片，返回各页文本。
+
+    call(fn, *args) 用于包装每一步耗时调用（如加上超时）；传入 texts 时按页填入已完成的结果，
+    调用被 deadlines.DeadlineExceeded 中断后，未完成的页面保持为 None。
+    """
+    batch_size = batch_size or config.OCR_RECOGNITION_BATCH_SIZE
+    call = call or (lambda fn, *args: fn(*args))
+    if texts is None:
+        texts = []
+    texts[:] = [None] * len(paths)
+    pending = []  # [(页号, 文本行图片)]
+
+    def read_single(index):
+        try:
+            texts[index] = call(utils._extract_from_image, paths[index], reader)
+        except deadlines.DeadlineExceeded:
+            raise
+        except Exception as e:
+            print(f"\n⚠️ 图片处理失败 [{paths[index]}]: {str(e)}")
+            texts[index] = ""
+
+    def recognize_round():
+        pages = pending[:]
+        pending.clear()
+        lines = [(page, position, crop) for page, crops in pages for position, crop in enumerate(crops)]
+        order = sorted(range(len(lines)), key=lambda i: lines[i][2].shape[1])
+        try:
+            recognized = call(recognize_lines, reader, [lines[i][2] for i in order], batch_size)
+        except deadlines.DeadlineExceeded:
+            raise
+        except Exception as e:
+            print(f"\n⚠️ 批量识别失败，改为逐页识别: {str(e)}")
+            metrics.increment("ocr_batch_fallback", stage="recognize")
+            for page, _ in pages:
+                read_single(page)
+            return
+        page_lines = {page: [""] * len(crops) for page, crops in pages}
+        for i, text in zip(order, recognized):
+            page, position, _ = lines[i]
+            page_lines[page][position] = text
+        for page, values in page_lines.items():
+            texts[page] = "\n".join(values).strip()
+        metrics.observe("ocr_recognition_lines", len(lines))
+
+    for index, path in enumerate(paths):
+        try:
+            crops = call(detect_lines, reader, path)
+        except deadlines.DeadlineExceeded:
+            raise
+        except Exception as e:
+            print(f"\n⚠️ 文本检测失败，改为单页识别 [{path}]: {str(e)}")
+            metrics.increment("ocr_batch_fallback", stage="detect")
+            read_single(index)
+            continue
+        pending.append((index, crops))
+        if sum(len(crops) for _, crops in pending) >= batch_size * _BATCHES_PER_ROUND:
+            recognize_round()
+    if pending:
+        recognize_round()
+    return texts
@@ -0,0 +1,273 @@
+"""批量合同审查：一次处理整个目录或压缩包中的合同。
+
+界面上的合同审查一次只能上传一份。HR 合规审计通常一次提交几百份合同，这里提供命令行批处理：
+- 遍历目录或 .zip / .tar(.gz) 压缩包，每个 PDF、DOCX 或图片文件是一份合同；
+  --group-images 时同一文件夹下的图片合并为一份多页合同
+- 文本提取 / OCR、合同类型识别、公章检测在进程池中批量进行（每个进程只加载一次 OCR 模型）；
+  多页图片合同中重复和空白的图片不做识别，记入 skipped_images
+- 深度分析（ContractAnalyzer）在线程池中并发调用，按 batch 优先级经调度器排队，
+  不占用为在线聊天保留的额度（config.LLM_INTERACTIVE_RESERVE）
+- 每完成一份合同立即向 results.jsonl 追加一行；中断后重新运行会跳过已成功的合同
+- 结束时写出 summary.json（状态、合同类型、公章、总体评价分布和吞吐量）
+
+    python batch_review.py /data/contracts.zip --out batch_results/acme --group-images
+"""
+import argparse
+import json
+import os
+import re
+import shutil
+import tarfile
+import tempfile
+import time
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from datetime import datetime
+from typing import Dict, List
+
+import config
+
+DOCUMENT_EXTENSIONS = ('.pdf', '.docx')
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tiff', '.webp')
+RESULTS_FILE = "results.jsonl"
+SUMMARY_FILE = "summary.json"
+_RATING_PATTERN = re.compile(r'(基本正规|存在明显问题|正规)')
+
+
+def unpack(source: str, work_dir: str) -> str:
+    """压缩包解压到临时目录；目录原样返回。"""
+    if os.path.isdir(source):
+        return source
+    target = os.path.join(work_dir, os.path.basename(source))
+    if zipfile.is_zipfile(source):
+        with zipfile.ZipFile(source) as archive:
+            for member in archive.infolist():
+                # 旧版 Windows 压缩工具写入的中文文件名按 GBK 编码
+                if not member.flag_bits & 0x800:
+                    try:
+                        member.filename = member.filename.encode('cp437').decode('gbk')
+                    except (UnicodeEncodeError, UnicodeDecodeError):
+                        pass
+                archive.extract(member, target)
+    elif tarfile.is_tarfile(source):
+        with tarfile.open(source) as archive:
+            archive.extractall(target, filter="data")
+    else:
+        raise ValueError(f"不支持的输入：{source}（需要目录、zip 或 tar 压缩包）")
+    return target
+
+
+def collect_contracts(root: str, group_images: bool = False) -> List[Dict]:
+    """返回 [{"contract_id": 相对路径, "files": [...]}]，按路径排序，作为断点续跑的稳定编号。"""
+    contracts = []
+    for directory, _, names in sorted(os.walk(root)):
+        names = sorted(n for n in names if not n.startswith('.'))
+        images = [n for n in names if n.lower().endswith(IMAGE_EXTENSIONS)]
+        for name in names:
+            if name.lower().endswith(DOCUMENT_EXTENSIONS) or (name in images and not group_images):
+                path = os.path.join(directory, name)
+                contracts.append({"contract_id": os.path.relpath(path, root), "files": [path]})
+        if group_images and images:
+            contracts.append({
+                "contract_id": os.path.relpath(directory, root) + os.sep,
+                "files": [os.path.join(directory, n) for n in images],
+            })
+    return contracts
+
+
+# ---- 提取阶段（进程池） ----
+
+_ocr_reader = None
+
+
+def _get_ocr_reader():
+    global _ocr_reader
+    if _ocr_reader is None:
+        import utils
+        _ocr_reader = utils.easyocr.Reader(['ch_sim', 'en'])
+    return _ocr_reader
+
+
+def prepare_contract(contract: Dict) -> Dict:
+    """提取文本并完成类型识别和公章检测，不调用大模型。"""
+    import batch_ocr
+    import clause_extractor
+    import image_dedup
+    import services
+    import text_normalizer
+    import utils
+
+    started = time.time()
+    result = dict(contract)
+    try:
+        files = contract["files"]
+        if len(files) > 1:
+            files, skipped = image_dedup.select_images(files, _get_ocr_reader())
+            if skipped:
+                result["skipped_images"] = skipped
+        if len(files) > 1 and config.OCR_RECOGNITION_BATCH_SIZE > 1:
+            texts = batch_ocr.read_pages(_get_ocr_reader(), files)
+        else:
+            texts = []
+            for path in files:
+                if path.lower().endswith(IMAGE_EXTENSIONS):
+                    texts.append(utils._extract_from_image(path, _get_ocr_reader()))
+                else:
+                    texts.append(utils.extract_text_from_file(path))
+        normalized = text_normalizer.normalize(text_normalizer.PAGE_BREAK.join(t for t in texts if t))
+        text = normalized.text
+        result["text"] = text
+        result["normalization_removed"] = normalized.removed
+        if text.strip():
+            ranking = utils.rank_contract_types(text)
+            result["contract_types"] = ranking
+            result["contract_type"] = utils.describe_contract_types(ranking)
+            result["has_seal"] = services.detect_seal(text, contract["files"])
+            result["missing_clauses"] = clause_extractor.extract(text).missing_required
+        else:
+            result["status"] = "empty"
+            result["error"] = "未能从文件中提取到任何文本"
+    except Exception as e:
+        result["status"] = "failed"
+        result["error"] = f"文本提取失败: {e}"
+    result["extract_seconds"] = round(time.time() - started, 2)
+    return result
+
+
+# ---- 分析阶段（线程池） ----
+
+def analyze_prepared(analyzer, prepared: Dict) -> Dict:
+    started = time.time()
+    chunks = []
+    try:
+        for chunk in analyzer.analyze_contract_stream(prepared["text"], prepared["contract_type"], prepared["files"],
+                                                      priority="batch", has_seal=prepared["has_seal"]):
+            chunks.append(chunk)
+        prepared["status"] = "ok"
+    except Exception as e:
+        prepared["status"] = "failed"
+        prepared["error"] = str(e)
+    analysis = "".join(chunks)
+    prepared["analysis"] = analysis
+    rating = _RATING_PATTERN.search(analysis)
+    prepared["overall_rating"] = rating.group(1) if rating else None
+    prepared["analyze_seconds"] = round(time.time() - started, 2)
+    return prepared
+
+
+def _result_record(result: Dict) -> Dict:
+    record = {key: value for key, value in result.items() if key != "text"}
+    record["text_chars"] = len(result.get("text") or "")
+    record["finished_at"] = datetime.now().isoformat()
+    return record
+
+
+def load_checkpoint(out_dir: str) -> Dict[str, Dict]:
+    """results.jsonl 中每份合同的最新结果。"""
+    done = {}
+    path = os.path.join(out_dir, RESULTS_FILE)
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # 中断时写了一半的最后一行
+                    continue
+                done[record["contract_id"]] = record
+    return done
+
+
+def summarize(records: List[Dict], elapsed: float, processed: int) -> Dict:
+    def count(key):
+        counts = {}
+        for record in records:
+            value = record.get(key)
+            counts[str(value)] = counts.get(str(value), 0) + 1
+        return counts
+
+    top_types = [(r.get("contract_types") or [{"type": None}])[0]["type"] for r in records]
+    return {
+        "contracts": len(records),
+        "status": count("status"),
+        "overall_rating": count("overall_rating"),
+        "has_seal": count("has_seal"),
+        "contract_type": {str(t): top_types.count(t) for t in sorted(set(top_types), key=str)},
+        "this_run": {
+            "processed": processed,
+            "seconds": round(elapsed, 1),
+            "contracts_per_hour": round(processed / elapsed * 3600, 1) if elapsed > 0 else None,
+        },
+    }
+
+
+def run(source: str, out_dir: str, group_images: bool = False, extract_workers: int = None,
+        concurrency: int = None, retry_failed: bool = True) -> Dict:
+    from services import ContractAnalyzer
+
+    os.makedirs(out_dir, exist_ok=True)
+    work_dir = tempfile.mkdtemp(prefix="batch_review_")
+    try:
+        contracts = collect_contracts(unpack(source, work_dir), group_images)
+        done = load_checkpoint(out_dir)
+        finished_statuses = ("ok", "empty") if retry_failed else ("ok", "empty", "failed")
+        pending = [c for c in contracts if done.get(c["contract_id"], {}).get("status") not in finished_statuses]
+        print(f"共 {len(contracts)} 份合同，已完成 {len(contracts) - len(pending)} 份，本次处理 {len(pending)} 份")
+
+        analyzer = ContractAnalyzer()
+        started = time.time()
+        processed = 0
+        concurrency = concurrency or config.BATCH_REVIEW_CONCURRENCY
+        with open(os.path.join(out_dir, RESULTS_FILE), 'a', encoding='utf-8') as results_file, \
+                ProcessPoolExecutor(max_workers=extract_workers or config.BATCH_REVIEW_EXTRACT_WORKERS) as extract_pool, \
+                ThreadPoolExecutor(max_workers=concurrency) as analyze_pool:
+
+            def write(result):
+                nonlocal processed
+                record = _result_record(result)
+                results_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+                results_file.flush()
+                done[record["contract_id"]] = record
+                processed += 1
+                if processed % 10 == 0 or processed == len(pending):
+                    rate = processed / max(time.time() - started, 1e-6) * 3600
+                    print(f"进度 {processed}/{len(pending)}，约 {rate:.0f} 份/小时")
+
+            extracting = {extract_pool.submit(prepare_contract, c) for c in pending}
+            analyzing = set()
+            while extracting or analyzing:
+                finished, _ = wait(extracting | analyzing, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    if future in extracting:
+                        extracting.discard(future)
+                        prepared = future.result()
+                        if prepared.get("status"):
+                            write(prepared)
+                        else:
+                            analyzing.add(analyze_pool.submit(analyze_prepared, analyzer, prepared))
+                    else:
+                        analyzing.discard(future)
+                        write(future.result())
+
+        records = [done[c["contract_id"]] for c in contracts if c["contract_id"] in done]
+        summary = summarize(records, time.time() - started, processed)
+        with open(os.path.join(out_dir, SUMMARY_FILE), 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+        return summary
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="批量合同审查")
+    parser.add_argument("source", help="合同所在目录，或 zip / tar 压缩包")
+    parser.add_argument("--out", required=True, help="结果目录（results.jsonl、summary.json），重复运行时断点续跑")
+    parser.add_argument("--group-images", action="store_true", help="同一文件夹下的图片作为一份多页合同")
+    parser.add_argument("--extract-workers", type=int, default=None, help="文本提取 / OCR 进程数")
+    parser.add_argument("--concurrency", type=int, default=None, help="同时进行的深度分析数")
+    parser.add_argument("--no-retry-failed", action="store_true", help="续跑时不重试失败的合同")
+    args = parser.parse_args()
+
+    result = run(args.source, args.out, args.group_images, args.extract_workers, args.concurrency,
+                 retry_failed=not args.no_retry_failed)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
@@ -0,0 +1,121 @@
+"""案例分析档位离线评测。
+
+把 conversation_datasets/ 中保存的咨询对话逐条重放给每个分析档位，统计延迟、
+token 用量和报告格式合规率，用于决定 CASE_ANALYSIS_TIERS 与降级阈值。
+
+    python -m benchmarks.case_analysis_tiers --tiers full,bounded,fast --limit 10
+
+--retrieval-dir 指定相似案例索引（case_retrieval.py）时，报告会带上检索到的参考案例，档位
+auto 表示由检索结果和负载决定档位。索引应由与评测对话不重叠的报告构建，否则结果偏乐观。
+"""
+import argparse
+import json
+import statistics
+import time
+
+import case_retrieval
+import config
+import dataset_writer
+from report_parser import check_report_structure
+from services import CaseAnalysisGenerator
+
+
+def load_conversations(dataset_dir, limit=None):
+    for index, conversation in enumerate(dataset_writer.iter_conversations(dataset_dir)):
+        if limit and index >= limit:
+            break
+        yield conversation.get("id") or f"conversation_{index}", [conversation]
+
+
+def run_once(generator, conversation_content, tier, case_type=None):
+    stats = {}
+    started = time.perf_counter()
+    first_token_at = None
+    chunks = []
+    error = None
+    try:
+        for delta in generator.generate_case_analysis_stream(conversation_content, tier=None if tier == "auto" else tier,
+                                                             stats=stats, case_type=case_type):
+            if first_token_at is None:
+                first_token_at = time.perf_counter()
+            chunks.append(delta)
+    except Exception as e:
+        error = str(e)
+    finished = time.perf_counter()
+    report = "".join(chunks)
+    return {
+        "tier": tier,
+        "model": stats.get("model"),
+        "retrieval": (stats.get("retrieval") or {}).get("mode"),
+        "latency": finished - started,
+        "first_token_latency": (first_token_at - started) if first_token_at else None,
+        "prompt_tokens": stats.get("prompt_tokens"),
+        "completion_tokens": stats.get("completion_tokens"),
+        "reasoning_tokens": stats.get("reasoning_tokens"),
+        "report_chars": len(report),
+        "error": error,
+        "checks": check_report_structure(report) if report else {"compliant": False},
+    }
+
+
+def _percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def summarize(results):
+    summary = {}
+    for tier in sorted({r["tier"] for r in results}):
+        rows = [r for r in results if r["tier"] == tier]
+        ok_rows = [r for r in rows if not r["error"]]
+        latencies = [r["latency"] for r in ok_rows]
+        completion = [r["completion_tokens"] for r in ok_rows if r["completion_tokens"] is not None]
+        summary[tier] = {
+            "runs": len(rows),
+            "errors": len(rows) - len(ok_rows),
+            "latency_p50": _percentile(latencies, 50),
+            "latency_p95": _percentile(latencies, 95),
+            "completion_tokens_mean": statistics.mean(completion) if completion else None,
+            "compliance_rate": sum(1 for r in ok_rows if r["checks"]["compliant"]) / len(ok_rows) if ok_rows else 0.0,
+        }
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="离线评测各案例分析档位的延迟、用量和格式合规率")
+    parser.add_argument("--datasets", default="conversation_datasets", help="ShareGPT 格式对话文件所在目录")
+    parser.add_argument("--tiers", default=",".join(config.CASE_ANALYSIS_TIERS), help="逗号分隔的档位名")
+    parser.add_argument("--limit", type=int, default=None, help="最多评测的对话数")
+    parser.add_argument("--output", default=None, help="逐条结果写入的 JSON 文件")
+    parser.add_argument("--retrieval-dir", default=None, help="相似案例索引目录，不指定时不检索")
+    args = parser.parse_args()
+
+    retriever = case_retrieval.CaseRetrievalIndex(args.retrieval_dir) if args.retrieval_dir else None
+    generator = CaseAnalysisGenerator(retriever=retriever)
+    tiers = [t.strip() for t in args.tiers.split(",") if t.strip()]
+    results = []
+    for source, data in load_conversations(args.datasets, args.limit):
+        conversation_content = generator.extract_conversation_content(data)
+        if not conversation_content:
+            continue
+        for tier in tiers:
+            case_type = config.CASE_TYPES.get(data[0].get("case_type"), {}).get("name")
+            result = run_once(generator, conversation_content, tier, case_type)
+            result["source"] = source
+            results.append(result)
+            print(f"{result['source']} [{tier}] {result['latency']:.1f}s "
+                  f"tokens={result['completion_tokens']} compliant={result['checks']['compliant']}"
+                  + (f" error={result['error']}" if result["error"] else ""))
+
+    summary = summarize(results)
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({"summary": summary, "results": results}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
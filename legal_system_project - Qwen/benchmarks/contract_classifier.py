@@ -0,0 +1,80 @@
+"""合同类型识别基准测试。
+
+对比旧实现（逐类型、逐关键词做 `in` 查找）与 utils.rank_contract_types 的单次扫描在长合同上的耗时。
+默认使用由关键词和填充文本合成的合同，也可以用 --files 指定真实的合同文本文件。
+
+    python -m benchmarks.contract_classifier --sizes 10000,50000,100000
+"""
+import argparse
+import statistics
+import time
+
+import utils
+
+
+def legacy_classify(text):
+    """重构前的实现：按字典顺序返回第一个有关键词命中的类型。"""
+    for name, keywords in utils.CONTRACT_TYPE_KEYWORDS.items():
+        if any(keyword in text for keyword in keywords):
+            return name
+    return utils.UNKNOWN_CONTRACT_TYPE
+
+
+def legacy_full_scan(text):
+    """旧方式下要得到全部命中（用于打分）所需的扫描：每个关键词一次完整查找。"""
+    return {name: [k for k in keywords if k in text] for name, keywords in utils.CONTRACT_TYPE_KEYWORDS.items()}
+
+
+def synthesize_contract(size):
+    """合成一份多页的兼职协议：标题之后是常见的劳动合同条款，按页重复到指定长度（模拟 OCR 全文）。"""
+    title = "兼职协议\n甲方因业务需要聘请乙方兼职，乙方兼任项目顾问工作，为期一年。\n"
+    page = (
+        "第一条 工作内容和工作地点：乙方的工作地点由甲方安排，工作时间安排由双方协商确定。\n"
+        "第二条 劳动报酬：甲方按月向乙方支付报酬，不低于当地最低工资标准。\n"
+        "第三条 保密义务：乙方对在工作中知悉的甲方商业秘密负有保密义务。\n"
+        "第四条 违约责任：任何一方违反本协议约定的，应当承担相应的违约责任。\n"
+        "第五条 争议解决：因本协议发生的争议，双方应协商解决，协商不成的可申请仲裁。\n"
+        "甲乙双方本着平等自愿、协商一致的原则订立本协议，共同遵守协议所列条款。\n"
+    )
+    text = title
+    while len(text) < size:
+        text += page
+    return text[:size]
+
+
+def timeit(fn, text, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(text)
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="合同类型识别基准测试")
+    parser.add_argument("--sizes", default="10000,50000,100000", help="合成合同的字符数，逗号分隔")
+    parser.add_argument("--files", nargs="*", default=None, help="使用真实合同文本文件代替合成文本")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    if args.files:
+        samples = []
+        for path in args.files:
+            with open(path, 'r', encoding='utf-8') as f:
+                samples.append((path, f.read()))
+    else:
+        samples = [(f"synthetic-{size}", synthesize_contract(int(size))) for size in args.sizes.split(",")]
+
+    print(f"{'样本':<22}{'字符数':>10}{'旧-首个命中':>14}{'旧-全量扫描':>14}{'新-单次扫描':>14}  识别结果（旧 / 新）")
+    for name, text in samples:
+        legacy_ms = timeit(legacy_classify, text, args.repeat)
+        full_ms = timeit(legacy_full_scan, text, args.repeat)
+        new_ms = timeit(utils.rank_contract_types, text, args.repeat)
+        ranking = utils.rank_contract_types(text)
+        print(f"{name:<22}{len(text):>10}{legacy_ms:>12.2f}ms{full_ms:>12.2f}ms{new_ms:>12.2f}ms  "
+              f"{legacy_classify(text)} / {utils.describe_contract_types(ranking)}")
+
+
+if __name__ == "__main__":
+    main()
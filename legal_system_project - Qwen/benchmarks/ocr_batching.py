@@ -0,0 +1,73 @@
+"""批量 OCR 基准测试（CPU）。
+
+对同一组合同图片分别用逐页 readtext（原实现）和 batch_ocr 的跨页批量识别处理，
+比较总耗时、每分钟页数，以及与逐页结果逐行一致的比例。不同批大小的结果用于调整
+config.OCR_RECOGNITION_BATCH_SIZE。
+
+    python -m benchmarks.ocr_batching samples/contract_pages/ --batch-sizes 8,16,32,64 --threads 4
+"""
+import argparse
+import os
+import time
+
+import torch
+
+import batch_ocr
+import utils
+from batch_review import IMAGE_EXTENSIONS
+
+
+def collect_images(inputs):
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            paths.extend(os.path.join(item, name) for name in sorted(os.listdir(item))
+                         if name.lower().endswith(IMAGE_EXTENSIONS))
+        else:
+            paths.append(item)
+    return paths
+
+
+def line_agreement(baseline, texts):
+    """两组结果中逐行相同的行数占逐页结果总行数的比例。"""
+    total = same = 0
+    for expected, actual in zip(baseline, texts):
+        expected_lines, actual_lines = expected.split("\n"), (actual or "").split("\n")
+        total += len(expected_lines)
+        same += sum(1 for a, b in zip(expected_lines, actual_lines) if a == b)
+    return same / total if total else 1.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批量 OCR 基准测试")
+    parser.add_argument("images", nargs="+", help="图片文件或包含图片的目录，视为同一份合同的各页")
+    parser.add_argument("--batch-sizes", default="8,16,32,64", help="识别批大小，逗号分隔")
+    parser.add_argument("--threads", type=int, default=None, help="torch CPU 线程数")
+    parser.add_argument("--repeat", type=int, default=1)
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    paths = collect_images(args.images)
+    reader = utils.easyocr.Reader(['ch_sim', 'en'], gpu=False)
+    # 预热：首次推理包含模型初始化开销
+    utils._extract_from_image(paths[0], reader)
+
+    def run(fn):
+        started = time.perf_counter()
+        for _ in range(args.repeat):
+            texts = fn()
+        return texts, (time.perf_counter() - started) / args.repeat
+
+    baseline, baseline_seconds = run(lambda: [utils._extract_from_image(path, reader) for path in paths])
+    print(f"{len(paths)} 页，torch 线程数 {torch.get_num_threads()}")
+    print(f"{'方式':<16}{'耗时':>10}{'页/分钟':>10}{'加速':>8}{'逐行一致':>10}")
+    print(f"{'逐页 readtext':<16}{baseline_seconds:>9.1f}s{len(paths) / baseline_seconds * 60:>10.1f}{1:>7.2f}x{1:>10.1%}")
+    for batch_size in (int(size) for size in args.batch_sizes.split(",")):
+        texts, seconds = run(lambda: batch_ocr.read_pages(reader, paths, batch_size=batch_size))
+        print(f"{f'批量 {batch_size}':<16}{seconds:>9.1f}s{len(paths) / seconds * 60:>10.1f}"
+              f"{baseline_seconds / seconds:>7.2f}x{line_agreement(baseline, texts):>10.1%}")
+
+
+if __name__ == "__main__":
+    main()
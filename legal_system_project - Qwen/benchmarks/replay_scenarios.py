@@ -0,0 +1,66 @@
+"""基于 cassette 回放的端到端场景测试（不访问模型服务）。
+
+逐个加载 cassette，用其中记录的用户消息依次调用 app.unified_chat，模型调用全部由 cassette
+回放。统计每轮的首次输出时间和总耗时（p50/p95）以及 cassette 未命中的调用次数。
+默认以最快速度回放，衡量的是应用自身的开销；--realtime 按录制时的节奏回放。
+
+    python cassettes.py build --out cassettes
+    python -m benchmarks.replay_scenarios --cassettes cassettes --realtime --speed 4
+"""
+import argparse
+import glob
+import os
+import time
+
+import cassettes
+import config
+from benchmarks.router_latency import percentile
+
+
+def run_scenario(app, cassette_path, realtime, speed):
+    user_id = f"replay_{os.path.splitext(os.path.basename(cassette_path))[0]}"
+    player = cassettes.replaying(cassette_path, realtime=realtime, speed=speed)
+    first_output, totals = [], []
+    with player:
+        app.reset_system(user_id=user_id)
+        for message in (player.cassette.scenario or {}).get("inputs", []):
+            started = time.perf_counter()
+            first = None
+            for _ in app.unified_chat(message, None, None, user_id=user_id):
+                if first is None:
+                    first = time.perf_counter() - started
+            totals.append(time.perf_counter() - started)
+            first_output.append(first if first is not None else totals[-1])
+        app.reset_system(user_id=user_id)
+    return first_output, totals, player.misses
+
+
+def main():
+    parser = argparse.ArgumentParser(description="cassette 回放场景测试")
+    parser.add_argument("--cassettes", default="cassettes")
+    parser.add_argument("--realtime", action="store_true", help="按录制时的分片间隔回放")
+    parser.add_argument("--speed", type=float, default=1.0, help="--realtime 时的加速倍数")
+    args = parser.parse_args()
+
+    # 场景会在短时间内连续发送大量消息，测试时不受单用户频率限制
+    config.ADMISSION_REQUESTS_PER_MINUTE = float("inf")
+    import app
+
+    first_output, totals, misses = [], [], 0
+    paths = sorted(glob.glob(os.path.join(args.cassettes, "*.json")))
+    for path in paths:
+        first, total, missed = run_scenario(app, path, args.realtime, args.speed)
+        first_output += first
+        totals += total
+        misses += missed
+
+    if not totals:
+        print(f"未找到可回放的场景：{args.cassettes}")
+        return
+    print(f"场景 {len(paths)} 个，对话轮次 {len(totals)} 轮，cassette 未命中 {misses} 次")
+    print(f"首次输出 p50 {percentile(first_output, 50) * 1000:.1f} ms, p95 {percentile(first_output, 95) * 1000:.1f} ms")
+    print(f"每轮总耗时 p50 {percentile(totals, 50) * 1000:.1f} ms, p95 {percentile(totals, 95) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""报告预生成预测器离线评测（不调用模型）。
+
+把 conversation_datasets/ 中的咨询对话逐轮重放：每条律师回复按固定长度切成流式分片，
+在每个分片处询问 EndingPredictor，与实际结果（该回复是否是对话的最后一条）对比，统计：
+- 命中：最后一条回复期间触发了预生成，以及触发时回复已输出的比例（越早越好）
+- 误触发：非最后一条回复期间触发了预生成（浪费一次报告调用）
+
+    python -m benchmarks.report_prefetch --threshold 0.75 --chunk-chars 8
+"""
+import argparse
+import os
+
+import config
+import dataset_writer
+from report_prefetch import EndingPredictor, checklist_coverage, user_text
+from transcript import CaseTranscript
+
+
+def replay(conversation, predictor, chunk_chars, case_type=None):
+    """返回每条律师回复的 (是否为最后一条, 触发位置比例或 None)。"""
+    messages = conversation.get("conversations", [])
+    transcript = CaseTranscript()
+    rounds = 0
+    outcomes = []
+    last_gpt_index = max((i for i, m in enumerate(messages) if m.get("from") == "gpt"), default=-1)
+    for index, msg in enumerate(messages):
+        role, text = msg.get("from"), msg.get("value", "")
+        if role == "human":
+            rounds += 1
+            transcript.append(role, text)
+            continue
+        # 与线上一致：类型确认之后才开始计算有效轮次，且至少 3 轮之后才考虑生成报告
+        triggered_at = None
+        if rounds > 3:
+            coverage = checklist_coverage(user_text(transcript), case_type)
+            for end in range(chunk_chars, len(text) + chunk_chars, chunk_chars):
+                if predictor.likely(rounds, text[:end], coverage):
+                    triggered_at = min(end, len(text)) / max(len(text), 1)
+                    break
+        outcomes.append((index == last_gpt_index, triggered_at))
+        transcript.append(role, text)
+    return outcomes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="报告预生成预测器离线评测")
+    parser.add_argument("--dataset-dir", default=os.path.join("..", "conversation_datasets"))
+    parser.add_argument("--threshold", type=float, default=config.REPORT_PREFETCH_THRESHOLD)
+    parser.add_argument("--chunk-chars", type=int, default=8)
+    args = parser.parse_args()
+
+    predictor = EndingPredictor(threshold=args.threshold)
+    endings = hits = false_triggers = replies = 0
+    trigger_points = []
+    for conversation in dataset_writer.iter_conversations(args.dataset_dir):
+        for is_last, triggered_at in replay(conversation, predictor, args.chunk_chars):
+            replies += 1
+            if is_last:
+                endings += 1
+                if triggered_at is not None:
+                    hits += 1
+                    trigger_points.append(triggered_at)
+            elif triggered_at is not None:
+                false_triggers += 1
+
+    print(f"阈值 {args.threshold}，律师回复 {replies} 条，其中收尾 {endings} 条")
+    print(f"收尾命中：{hits}/{endings}")
+    if trigger_points:
+        print(f"平均触发位置：回复输出到 {sum(trigger_points) / len(trigger_points):.0%} 时")
+    print(f"误触发：{false_triggers}/{replies - endings}")
+
+
+if __name__ == "__main__":
+    main()
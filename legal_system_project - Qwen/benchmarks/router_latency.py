@@ -0,0 +1,75 @@
+"""意图路由延迟测试。
+
+逐条路由一组典型用户输入，统计单条调用的 p50/p99 延迟以及批量路由的吞吐；
+p99 超过 config.ROUTER_LATENCY_BUDGET_MS 时以非零状态码退出，可直接放进发布前检查。
+
+    python -m benchmarks.router_latency --rounds 50
+"""
+import argparse
+import sys
+import time
+
+import config
+import router
+
+SAMPLE_MESSAGES = [
+    "公司突然辞退了我，我该怎么办？",
+    "帮我看看这份劳动合同有没有问题",
+    "试用期最长可以约定多久",
+    "我在工地上摔伤了，老板不管",
+    "我这个工作的合同期限到了公司不续签",
+    "年假没休完，离职时公司要折算工资吗",
+    "公司三个月没发工资了",
+    "平台派单的骑手算不算公司员工",
+    "我想咨询一下",
+    "合同审查",
+]
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def measure_route_latency(intent_router, rounds):
+    """逐条路由 SAMPLE_MESSAGES rounds 遍，返回每次调用的耗时（毫秒）。"""
+    # 预热：首次推理包含线程池和内存分配开销
+    intent_router.route_batch(SAMPLE_MESSAGES)
+
+    timings = []
+    for _ in range(rounds):
+        for message in SAMPLE_MESSAGES:
+            started = time.perf_counter()
+            intent_router.route(message)
+            timings.append((time.perf_counter() - started) * 1000)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="意图路由延迟测试")
+    parser.add_argument("--rounds", type=int, default=50, help="每条样本重复路由的次数")
+    parser.add_argument("--budget-ms", type=float, default=config.ROUTER_LATENCY_BUDGET_MS)
+    args = parser.parse_args()
+
+    intent_router = router.create_intent_router()
+    if intent_router is None:
+        print("向量路由不可用，无法测试")
+        return 1
+
+    timings = measure_route_latency(intent_router, args.rounds)
+
+    batch = SAMPLE_MESSAGES * 10
+    started = time.perf_counter()
+    intent_router.route_batch(batch)
+    batch_ms = (time.perf_counter() - started) * 1000
+
+    p50, p99 = percentile(timings, 50), percentile(timings, 99)
+    print(f"单条路由：n={len(timings)} p50={p50:.2f}ms p99={p99:.2f}ms（预算 {args.budget_ms}ms）")
+    print(f"批量路由：{len(batch)} 条共 {batch_ms:.1f}ms，平均 {batch_ms / len(batch):.2f}ms/条")
+    for message, result in zip(SAMPLE_MESSAGES, intent_router.route_batch(SAMPLE_MESSAGES)):
+        print(f"  {message} -> {result}")
+    return 0 if p99 <= args.budget_ms else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,142 @@
+"""模型调用的取消机制。
+
+每个用户的每一轮对话持有一个 CancellationToken。用户点击“重新开始”、再次发送消息或关闭页面时，
+上一轮的令牌被取消；律师、法律助理、合同分析和案例报告的调用在每个流式分片处检查令牌，
+一旦取消就关闭上游 HTTP 流，并把估算节省的 token 数记入指标。
+
+轮次信息同时写入共享状态后端，另一个进程上的“重新开始”也能让本进程中的生成停下来。
+"""
+import threading
+import time
+import uuid
+from typing import Callable, Iterable, Iterator, Optional
+
+import config
+import metrics
+from transcript import estimate_tokens
+
+
+class CancellationToken:
+    """parent 为所属轮次的令牌时（如后台预生成报告），轮次取消后本令牌也随之取消。"""
+
+    def __init__(self, turn_id: str = None, remote_check: Callable[[], bool] = None,
+                 parent: "CancellationToken" = None):
+        self.turn_id = turn_id or uuid.uuid4().hex
+        self.reason = None
+        self._event = threading.Event()
+        self._remote_check = remote_check
+        self._last_remote_check = time.monotonic()
+        self._parent = parent
+
+    def cancel(self, reason: str = "cancelled"):
+        if not self._event.is_set():
+            self.reason = reason
+            self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        if self._event.is_set():
+            return True
+        if self._parent is not None and self._parent.cancelled:
+            self.cancel(self._parent.reason)
+            return True
+        # 远程检查有网络开销，按间隔节流
+        if self._remote_check is not None:
+            now = time.monotonic()
+            if now - self._last_remote_check >= config.CANCEL_REMOTE_CHECK_INTERVAL:
+                self._last_remote_check = now
+                if self._remote_check():
+                    self.cancel("superseded")
+        return self._event.is_set()
+
+
+def record_cancellation(kind: str, generated_text: str = ""):
+    """记录一次被取消的调用，按该类调用的典型输出长度估算节省的 token。"""
+    generated = estimate_tokens(generated_text)
+    saved = max(0, config.EXPECTED_COMPLETION_TOKENS.get(kind, 0) - generated)
+    metrics.increment("cancelled_calls", kind=kind)
+    metrics.increment("cancelled_tokens_saved", saved, kind=kind)
+    return saved
+
+
+def cancellable(stream: Iterable, token: Optional[CancellationToken], kind: str,
+                text_of: Callable[[object], str] = None) -> Iterator:
+    """包装上游流式响应：令牌取消后停止迭代，并且无论如何结束都会关闭上游连接。"""
+    pieces = []
+    try:
+        for chunk in stream:
+            if token is not None and token.cancelled:
+                record_cancellation(kind, "".join(pieces))
+                return
+            if text_of is not None:
+                pieces.append(text_of(chunk) or "")
+            yield chunk
+        if token is not None and token.cancelled:
+            return
+    except GeneratorExit:
+        # 调用方被关闭（如页面断开）时，令牌已由入口处取消
+        if token is not None and token.cancelled:
+            record_cancellation(kind, "".join(pieces))
+        raise
+    finally:
+        close = getattr(stream, "close", None)
+        if close is not None:
+            close()
+
+
+class TurnRegistry:
+    """记录每个用户当前进行中的对话轮次。开始新一轮会取消同一用户的上一轮。"""
+
+    def __init__(self, backend=None):
+        self.backend = backend
+        self._tokens = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(user_id):
+        return f"turn:{user_id}"
+
+    def _remote_check(self, user_id, turn_id):
+        def check():
+            try:
+                record = self.backend.get(self._key(user_id))
+            except Exception:
+                return False
+            return record is None or record.data.get("turn_id") != turn_id
+        return check
+
+    def begin_turn(self, user_id: str) -> CancellationToken:
+        turn_id = uuid.uuid4().hex
+        if self.backend is not None:
+            self.backend.update(self._key(user_id), lambda _: {"turn_id": turn_id, "started_at": time.time()})
+            token = CancellationToken(turn_id, self._remote_check(user_id, turn_id))
+        else:
+            token = CancellationToken(turn_id)
+        with self._lock:
+            previous = self._tokens.get(user_id)
+            self._tokens[user_id] = token
+        if previous is not None:
+            previous.cancel("resubmit")
+        return token
+
+    def end_turn(self, user_id: str, token: CancellationToken):
+        with self._lock:
+            if self._tokens.get(user_id) is token:
+                del self._tokens[user_id]
+            else:
+                return
+        if self.backend is not None:
+            try:
+                record = self.backend.get(self._key(user_id))
+                if record is not None and record.data.get("turn_id") == token.turn_id:
+                    self.backend.delete(self._key(user_id))
+            except Exception:
+                pass
+
+    def cancel(self, user_id: str, reason: str = "reset"):
+        with self._lock:
+            token = self._tokens.pop(user_id, None)
+        if token is not None:
+            token.cancel(reason)
+        if self.backend is not None:
+            self.backend.delete(self._key(user_id))
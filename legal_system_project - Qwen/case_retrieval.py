@@ -0,0 +1,200 @@
+"""相似既往案例检索：复用已有报告，缩短新报告的生成时间。
+
+拖欠加班费、试用期被辞退、未签书面合同等咨询的事实高度相似，却每次都从零调用推理模型
+生成报告。这里对已完成的报告建立向量索引（本地句向量模型 + FAISS 内积检索），生成报告时：
+- 相似度达到 CASE_RETRIEVAL_MIN_SIMILARITY：把最相似的几份报告压缩成简短的参考案例放进提示词
+- 同一案件类型且相似度达到 CASE_RETRIEVAL_DRAFT_SIMILARITY：把最相似的报告作为草稿，
+  改用快速档模型按本案事实改写，不再等待推理模型
+
+向量只由用户一方的发言计算（案件事实），不受律师提问方式的影响。参考报告中的当事人、单位、
+金额和日期都属于其他案件，提示词要求模型一律以本案对话为准。
+
+索引以追加方式保存在 CASE_RETRIEVAL_DIR 中（vectors.f32 + meta.jsonl），报告完成时增量写入；
+其他进程写入的新案例在下次检索时自动加载。补录已有报告：
+    python case_retrieval.py sync --dir ../case_analysis_results
+"""
+import argparse
+import glob
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import numpy as np
+
+import config
+from transcript import role_label
+
+VECTORS_FILE = "vectors.f32"
+META_FILE = "meta.jsonl"
+
+
+def case_facts(conversation_content: str) -> str:
+    """对话中用户说的部分，用作检索向量的输入。"""
+    prefix = role_label('user') + ": "
+    parts = [part[len(prefix):] for part in conversation_content.split("\n\n") if part.startswith(prefix)]
+    return "\n".join(parts)[:config.CASE_RETRIEVAL_FACT_CHARS]
+
+
+class SimilarCase:
+    def __init__(self, similarity: float, meta: Dict):
+        self.similarity = similarity
+        self.report_id = meta["report_id"]
+        self.case_type = meta.get("case_type")
+        self.sections = meta.get("sections") or {}
+
+    def exemplar(self, max_chars: int = None) -> str:
+        """压缩后的参考案例：每个部分只保留开头。"""
+        max_chars = max_chars or config.CASE_RETRIEVAL_EXEMPLAR_CHARS
+        per_section = max(1, max_chars // max(len(self.sections), 1))
+        return "\n".join(f"【{title}】{text[:per_section]}" for title, text in self.sections.items())
+
+    def draft(self) -> str:
+        return "\n\n".join(f"【{title}】\n{text}" for title, text in self.sections.items())
+
+
+class Retrieval:
+    """一次检索的结果：draft 不为空时走草稿改写，否则 exemplars 作为参考案例。"""
+
+    def __init__(self, cases: List[SimilarCase], draft: Optional[SimilarCase]):
+        self.cases = cases
+        self.draft = draft
+
+    @property
+    def mode(self) -> str:
+        return "draft" if self.draft else ("exemplars" if self.cases else "none")
+
+    def summary(self) -> Dict:
+        return {
+            "mode": self.mode,
+            "similar_cases": [{"id": case.report_id, "similarity": round(case.similarity, 3)} for case in self.cases],
+        }
+
+
+class CaseRetrievalIndex:
+    def __init__(self, directory: str = None):
+        import faiss
+        import embeddings
+
+        self._faiss = faiss
+        self._encode = embeddings.encode
+        self.directory = directory or config.CASE_RETRIEVAL_DIR
+        os.makedirs(self.directory, exist_ok=True)
+        self.meta: List[Dict] = []
+        self.index = None
+        self._known_ids = set()
+        self._vector_bytes = 0
+        self._lock = threading.Lock()
+        # 写入放在后台线程中，报告保存不必等待向量计算
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="case-retrieval")
+        self._load_new()
+
+    def _load_new(self):
+        """加载本进程之后由其他进程追加的案例。调用方持有 self._lock（构造时除外）。"""
+        vectors_path = os.path.join(self.directory, VECTORS_FILE)
+        meta_path = os.path.join(self.directory, META_FILE)
+        if not os.path.exists(vectors_path) or os.path.getsize(vectors_path) == self._vector_bytes:
+            return
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            entries = [json.loads(line) for line in f if line.strip()]
+        vectors = np.fromfile(vectors_path, dtype=np.float32)
+        dim = entries[0]["dim"] if entries else 0
+        if not dim:
+            return
+        # 两个文件分别追加，进程中断时以条数较少的一个为准
+        count = min(len(entries), len(vectors) // dim)
+        start = len(self.meta)
+        if count <= start:
+            return
+        if self.index is None:
+            self.index = self._faiss.IndexFlatIP(dim)
+        self.index.add(np.ascontiguousarray(vectors[start * dim:count * dim].reshape(-1, dim)))
+        for entry in entries[start:count]:
+            self.meta.append(entry)
+            self._known_ids.add(entry["report_id"])
+        self._vector_bytes = count * dim * 4
+
+    def add(self, report_id: str, conversation_content: str, sections: Dict[str, str], case_type: str = None) -> bool:
+        facts = case_facts(conversation_content)
+        if not facts or not sections:
+            return False
+        vector = self._encode([facts])
+        with self._lock:
+            self._load_new()
+            if report_id in self._known_ids:
+                return False
+            entry = {"report_id": report_id, "case_type": case_type, "sections": sections, "dim": vector.shape[1]}
+            with open(os.path.join(self.directory, META_FILE), 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            with open(os.path.join(self.directory, VECTORS_FILE), 'ab') as f:
+                f.write(vector.tobytes())
+            if self.index is None:
+                self.index = self._faiss.IndexFlatIP(vector.shape[1])
+            self.index.add(vector)
+            self.meta.append(entry)
+            self._known_ids.add(report_id)
+            self._vector_bytes += vector.nbytes
+        return True
+
+    def add_async(self, report_id: str, conversation_content: str, sections: Dict[str, str], case_type: str = None):
+        def run():
+            try:
+                self.add(report_id, conversation_content, sections, case_type)
+            except Exception as e:
+                print(f"⚠️ 写入相似案例索引失败: {e}")
+
+        self._executor.submit(run)
+
+    def sync(self, directory: str) -> int:
+        added = 0
+        for path in sorted(glob.glob(os.path.join(directory, "*.json"))):
+            with open(path, 'r', encoding='utf-8') as f:
+                report = json.load(f)
+            if report.get("status", "complete") != "complete":
+                continue
+            report_id = os.path.splitext(os.path.basename(path))[0]
+            if self.add(report_id, report.get("conversation") or "", report.get("analysis_sections") or {},
+                        report.get("case_type")):
+                added += 1
+        return added
+
+    def lookup(self, conversation_content: str, case_type: str = None, top_k: int = None) -> Retrieval:
+        facts = case_facts(conversation_content)
+        with self._lock:
+            self._load_new()
+            if not facts or self.index is None or self.index.ntotal == 0:
+                return Retrieval([], None)
+        query = self._encode([facts])
+        with self._lock:
+            k = min(top_k or config.CASE_RETRIEVAL_TOP_K, self.index.ntotal)
+            similarities, neighbors = self.index.search(query, k)
+            cases = [SimilarCase(float(similarity), self.meta[neighbor])
+                     for similarity, neighbor in zip(similarities[0], neighbors[0])
+                     if neighbor >= 0 and similarity >= config.CASE_RETRIEVAL_MIN_SIMILARITY]
+        draft = None
+        if cases and cases[0].similarity >= config.CASE_RETRIEVAL_DRAFT_SIMILARITY \
+                and case_type and cases[0].case_type == case_type:
+            draft = cases[0]
+        return Retrieval(cases, draft)
+
+
+def create_retriever() -> Optional[CaseRetrievalIndex]:
+    if not config.CASE_RETRIEVAL_ENABLED:
+        return None
+    try:
+        return CaseRetrievalIndex()
+    except Exception as e:
+        print(f"⚠️ 相似案例索引初始化失败，报告将直接生成: {e}")
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="相似案例索引")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    sync_parser = subparsers.add_parser("sync", help="把已完成的报告加入索引")
+    sync_parser.add_argument("--dir", default="case_analysis_results")
+    args = parser.parse_args()
+
+    retriever = CaseRetrievalIndex()
+    print(f"新增 {retriever.sync(args.dir)} 个案例，索引共 {len(retriever.meta)} 个")
@@ -0,0 +1,528 @@
+"""大模型调用的录制与回放（cassette）。
+
+录制时替换 dashscope.Generation.call 与 OpenAI 兼容客户端（DeepSeek、DashScope 兼容模式）的
+chat.completions.create，把每次调用的请求指纹、每个流式分片的内容和相对时间写入 cassette 文件；
+回放时不访问网络，按原始节奏（可加速）或以最快速度重放分片。这样 unified_chat 的完整场景
+就成为可重复的基准和测试，路由、持久化、渲染等改动的效果不再被服务商的抖动淹没。
+
+请求匹配：先按指纹（模型、消息、主要参数；消息中的时间戳会被归一化）匹配，匹配不到时
+按同一服务商、同一调用方式（流式/非流式）的录制顺序依次取用。
+
+    with cassettes.recording("cassettes/demo.json"):
+        ...  # 正常调用 app.unified_chat
+    with cassettes.replaying("cassettes/demo.json", realtime=False):
+        ...
+
+从已有数据构建 cassette（律师回复、法律助理润色、案例报告，分片时间为合成值）：
+    python cassettes.py build --out cassettes
+"""
+import argparse
+import glob
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+import config
+import dataset_writer
+from transcript import CaseTranscript
+
+CASSETTE_VERSION = 1
+_TIMESTAMP_PATTERN = re.compile(r'\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}:\d{2}')
+_FINGERPRINT_PARAMS = ("model", "stream", "temperature", "max_tokens", "extra_body", "incremental_output")
+
+
+class CassetteMiss(Exception):
+    """回放时找不到与请求对应的录制记录。"""
+
+
+def fingerprint(provider: str, kwargs: Dict[str, Any]) -> str:
+    payload = {key: kwargs.get(key) for key in _FINGERPRINT_PARAMS}
+    payload["provider"] = provider
+    payload["messages"] = [
+        {"role": m.get("role"), "content": _TIMESTAMP_PATTERN.sub("<time>", m.get("content") or "")}
+        for m in kwargs.get("messages") or []
+    ]
+    canonical = json.dumps(payload, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()[:24]
+
+
+# ---- 分片序列化：只保留业务代码会读取的字段 ----
+
+def _dashscope_to_dict(response) -> Dict[str, Any]:
+    output = getattr(response, "output", None)
+    choices = getattr(output, "choices", None) if output else None
+    usage = getattr(response, "usage", None)
+    return {
+        "status_code": response.status_code,
+        "code": getattr(response, "code", None),
+        "message": getattr(response, "message", None),
+        "content": choices[0].message.content if choices else None,
+        "finish_reason": choices[0].finish_reason if choices else None,
+        "usage": {key: usage[key] for key in ("input_tokens", "output_tokens") if key in usage} if usage else None,
+    }
+
+
+def _dashscope_from_dict(data: Dict[str, Any]):
+    output = None
+    if data.get("content") is not None or data.get("status_code") == 200:
+        message = SimpleNamespace(role="assistant", content=data.get("content"))
+        output = SimpleNamespace(choices=[SimpleNamespace(message=message, finish_reason=data.get("finish_reason"))])
+    return SimpleNamespace(status_code=data["status_code"], code=data.get("code"), message=data.get("message"),
+                           output=output, usage=data.get("usage"), request_id="cassette")
+
+
+def _openai_usage_to_dict(usage) -> Optional[Dict[str, Any]]:
+    if not usage:
+        return None
+    details = getattr(usage, "completion_tokens_details", None)
+    return {
+        "prompt_tokens": usage.prompt_tokens,
+        "completion_tokens": usage.completion_tokens,
+        "reasoning_tokens": getattr(details, "reasoning_tokens", None) if details else None,
+    }
+
+
+def _openai_usage_from_dict(data: Optional[Dict[str, Any]]):
+    if not data:
+        return None
+    return SimpleNamespace(prompt_tokens=data["prompt_tokens"], completion_tokens=data["completion_tokens"],
+                           completion_tokens_details=SimpleNamespace(reasoning_tokens=data.get("reasoning_tokens")))
+
+
+def _openai_chunk_to_dict(chunk) -> Dict[str, Any]:
+    choice = chunk.choices[0] if chunk.choices else None
+    delta = getattr(choice, "delta", None)
+    return {
+        "has_choice": choice is not None,
+        "content": getattr(delta, "content", None),
+        "reasoning_content": getattr(delta, "reasoning_content", None),
+        "finish_reason": getattr(choice, "finish_reason", None),
+        "usage": _openai_usage_to_dict(getattr(chunk, "usage", None)),
+    }
+
+
+def _openai_chunk_from_dict(data: Dict[str, Any]):
+    choices = []
+    if data.get("has_choice", True):
+        delta = SimpleNamespace(role="assistant", content=data.get("content"),
+                                reasoning_content=data.get("reasoning_content"))
+        choices.append(SimpleNamespace(index=0, delta=delta, finish_reason=data.get("finish_reason")))
+    return SimpleNamespace(choices=choices, usage=_openai_usage_from_dict(data.get("usage")))
+
+
+def _openai_response_to_dict(response) -> Dict[str, Any]:
+    return {"content": response.choices[0].message.content, "usage": _openai_usage_to_dict(response.usage)}
+
+
+def _openai_response_from_dict(data: Dict[str, Any]):
+    message = SimpleNamespace(role="assistant", content=data.get("content"))
+    return SimpleNamespace(choices=[SimpleNamespace(index=0, message=message, finish_reason="stop")],
+                           usage=_openai_usage_from_dict(data.get("usage")))
+
+
+def _openai_provider(completions) -> str:
+    base_url = str(getattr(getattr(completions, "_client", None), "base_url", ""))
+    if "deepseek" in base_url:
+        return "deepseek"
+    if "volces" in base_url:
+        return "ark"
+    return "dashscope-compatible"
+
+
+# ---- cassette 文件 ----
+
+class Cassette:
+    def __init__(self, interactions: List[Dict[str, Any]] = None, scenario: Dict[str, Any] = None, source: str = None):
+        self.interactions = interactions or []
+        self.scenario = scenario
+        self.source = source
+
+    @classmethod
+    def load(cls, path: str) -> "Cassette":
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return cls(data.get("interactions", []), data.get("scenario"), data.get("source"))
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                "version": CASSETTE_VERSION,
+                "source": self.source,
+                "scenario": self.scenario,
+                "interactions": self.interactions,
+            }, f, ensure_ascii=False, indent=1)
+        os.replace(temp_path, path)
+
+
+def _interaction(provider, kwargs, stream, chunks, error=None):
+    messages = kwargs.get("messages") or []
+    return {
+        "provider": provider,
+        "model": kwargs.get("model"),
+        "stream": stream,
+        "fingerprint": fingerprint(provider, kwargs),
+        "request": {"message_count": len(messages), "last_message": (messages[-1].get("content") or "")[-500:] if messages else ""},
+        "chunks": chunks,
+        "error": error,
+    }
+
+
+# ---- 替换 SDK 入口 ----
+
+@contextmanager
+def _patched(dashscope_call, openai_create):
+    from dashscope import Generation
+    from openai.resources.chat.completions import Completions
+
+    original_call = Generation.__dict__.get("call")
+    original_create = Completions.__dict__["create"]
+    Generation.call = staticmethod(dashscope_call)
+    Completions.create = openai_create
+    try:
+        yield
+    finally:
+        if original_call is not None:
+            Generation.call = original_call
+        else:
+            del Generation.call
+        Completions.create = original_create
+
+
+class _RecordingStream:
+    """透传上游流式响应，同时记录每个分片及其相对时间。"""
+
+    def __init__(self, upstream, on_chunk, on_finish):
+        self._upstream = upstream
+        self._on_chunk = on_chunk
+        self._on_finish = on_finish
+
+    def __iter__(self):
+        try:
+            for chunk in self._upstream:
+                self._on_chunk(chunk)
+                yield chunk
+        finally:
+            self._on_finish()
+
+    def close(self):
+        close = getattr(self._upstream, "close", None)
+        if close is not None:
+            close()
+
+
+class Recorder:
+    def __init__(self, path: str, scenario: Dict[str, Any] = None):
+        self.path = path
+        self.cassette = Cassette(scenario=scenario, source="recorded")
+        self._lock = threading.Lock()
+
+    def _append(self, interaction):
+        with self._lock:
+            self.cassette.interactions.append(interaction)
+
+    def _record(self, provider, kwargs, call, to_dict):
+        started = time.monotonic()
+        stream = bool(kwargs.get("stream"))
+        try:
+            result = call()
+        except Exception as e:
+            self._append(_interaction(provider, kwargs, stream, [], error=str(e)))
+            raise
+        if not stream:
+            self._append(_interaction(provider, kwargs, False, [{"t": time.monotonic() - started, "data": to_dict(result)}]))
+            return result
+        chunks = []
+        return _RecordingStream(
+            result,
+            lambda chunk: chunks.append({"t": round(time.monotonic() - started, 4), "data": to_dict(chunk)}),
+            lambda: self._append(_interaction(provider, kwargs, True, chunks)),
+        )
+
+    def __enter__(self):
+        from dashscope import Generation
+        from openai.resources.chat.completions import Completions
+
+        original_call = Generation.call
+        original_create = Completions.create
+        recorder = self
+
+        def dashscope_call(*args, **kwargs):
+            return recorder._record("dashscope", kwargs, lambda: original_call(*args, **kwargs), _dashscope_to_dict)
+
+        def openai_create(completions, *args, **kwargs):
+            to_dict = _openai_chunk_to_dict if kwargs.get("stream") else _openai_response_to_dict
+            return recorder._record(_openai_provider(completions), kwargs,
+                                    lambda: original_create(completions, *args, **kwargs), to_dict)
+
+        self._patch = _patched(dashscope_call, openai_create)
+        self._patch.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._patch.__exit__(*exc_info)
+        self.cassette.save(self.path)
+
+
+class _ReplayStream:
+    def __init__(self, chunks, from_dict, realtime: bool, speed: float):
+        self._chunks = chunks
+        self._from_dict = from_dict
+        self._realtime = realtime
+        self._speed = speed
+        self._closed = False
+
+    def __iter__(self):
+        started = time.monotonic()
+        for chunk in self._chunks:
+            if self._closed:
+                return
+            if self._realtime:
+                delay = started + chunk["t"] / self._speed - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            yield self._from_dict(chunk["data"])
+
+    def close(self):
+        self._closed = True
+
+
+class Player:
+    def __init__(self, cassette: Cassette, realtime: bool = False, speed: float = 1.0):
+        self.cassette = cassette
+        self.realtime = realtime
+        self.speed = speed
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._by_fingerprint: Dict[str, deque] = {}
+        self._in_order: Dict[tuple, deque] = {}
+        self._used = set()
+        for index, interaction in enumerate(cassette.interactions):
+            self._by_fingerprint.setdefault(interaction["fingerprint"], deque()).append(index)
+            self._in_order.setdefault((interaction["provider"], interaction["stream"]), deque()).append(index)
+
+    def _take(self, provider, kwargs):
+        stream = bool(kwargs.get("stream"))
+        with self._lock:
+            for queue in (self._by_fingerprint.get(fingerprint(provider, kwargs)),
+                          self._in_order.get((provider, stream))):
+                while queue:
+                    index = queue.popleft()
+                    if index not in self._used:
+                        self._used.add(index)
+                        return self.cassette.interactions[index]
+            self.misses += 1
+        raise CassetteMiss(f"cassette 中没有与该请求对应的记录（{provider} / {kwargs.get('model')}）")
+
+    def _replay(self, provider, kwargs, from_dict):
+        interaction = self._take(provider, kwargs)
+        if interaction.get("error"):
+            raise RuntimeError(interaction["error"])
+        if not interaction["stream"]:
+            chunk = interaction["chunks"][0]
+            if self.realtime:
+                time.sleep(chunk["t"] / self.speed)
+            return from_dict(chunk["data"])
+        return _ReplayStream(interaction["chunks"], from_dict, self.realtime, self.speed)
+
+    def __enter__(self):
+        player = self
+
+        def dashscope_call(*args, **kwargs):
+            return player._replay("dashscope", kwargs, _dashscope_from_dict)
+
+        def openai_create(completions, *args, **kwargs):
+            from_dict = _openai_chunk_from_dict if kwargs.get("stream") else _openai_response_from_dict
+            return player._replay(_openai_provider(completions), kwargs, from_dict)
+
+        self._patch = _patched(dashscope_call, openai_create)
+        self._patch.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._patch.__exit__(*exc_info)
+
+
+def recording(path: str, scenario: Dict[str, Any] = None) -> Recorder:
+    return Recorder(path, scenario)
+
+
+def replaying(path: str, realtime: bool = False, speed: float = 1.0) -> Player:
+    """realtime=True 时按录制时的分片间隔回放（speed 为加速倍数），否则以最快速度回放。"""
+    return Player(Cassette.load(path), realtime, speed)
+
+
+# ---- 从已有数据构建 ----
+
+# 与 app.chat_case_strategy_stream 中程序生成的回复对应
+_CANNED_REPLY_PATTERN = re.compile(
+    r"我了解您的案件类型是|^抱歉，我暂时无法对你的描述进行案件类型判断|在开始为您提供专业法律建议之前，我需要了解您遇到的具体情况"
+)
+# app 只润色前几轮的用户消息（user_input_round - 2 <= 4）
+_POLISHED_ROUNDS = 6
+
+
+def _synthetic_chunks(text: str, to_data, chunk_chars: int, first_chunk_delay: float, chunk_interval: float):
+    chunks = []
+    t = first_chunk_delay
+    for start in range(0, len(text), chunk_chars):
+        chunks.append({"t": round(t, 4), "data": to_data(text[start:start + chunk_chars])})
+        t += chunk_interval
+    return chunks
+
+
+def _dashscope_text_chunk(text):
+    return {"status_code": 200, "code": "", "message": "", "content": text, "finish_reason": None, "usage": None}
+
+
+def _synthetic_interaction(provider, model, stream, messages, chunks):
+    kwargs = {"model": model, "messages": messages, "stream": stream}
+    interaction = _interaction(provider, kwargs, stream, chunks)
+    # 合成的请求与线上实际请求不会完全一致，回放时依靠按顺序匹配
+    interaction["synthetic"] = True
+    return interaction
+
+
+def is_canned_reply(text: str) -> bool:
+    """案件类型确认、请用户重新描述等回复由程序直接生成，不对应模型调用。"""
+    return bool(_CANNED_REPLY_PATTERN.search(text or ""))
+
+
+def cassette_from_conversation(conversation: Dict[str, Any], source: str, chunk_chars: int = 4,
+                               first_chunk_delay: float = 0.6, chunk_interval: float = 0.03,
+                               report_text: str = None) -> Cassette:
+    """把一条 ShareGPT 对话转换为 cassette，调用顺序与 app.chat_case_strategy_stream 一致：
+    每条律师回复对应一次律师流式调用，前 _POLISHED_ROUNDS 轮中律师调用之前各有一次法律助理润色
+    （原样返回用户消息）；案件类型确认等固定回复不对应调用。提供 report_text 时再加入一次案例报告调用。
+
+    场景的输入是全部用户消息。对话数据中保存的是润色后的消息，回放时润色调用原样返回它，
+    律师调用收到的消息与录制时一致。
+    """
+    messages = [{"role": "system", "content": conversation.get("system_prompt", "")}]
+    interactions = []
+    inputs = []
+    turns = conversation.get("conversations", [])
+    for index, msg in enumerate(turns):
+        text = msg.get("value", "")
+        if msg.get("from") == "human":
+            inputs.append(text)
+            reply = turns[index + 1] if index + 1 < len(turns) else None
+            if reply is not None and reply.get("from") == "gpt" and not is_canned_reply(reply.get("value", "")) \
+                    and len(inputs) <= _POLISHED_ROUNDS:
+                interactions.append(_synthetic_interaction(
+                    "dashscope", config.PARALEGAL_MODEL, False, [{"role": "user", "content": text}],
+                    [{"t": 1.0, "data": _dashscope_text_chunk(text)}]
+                ))
+            messages.append({"role": "user", "content": text})
+        elif msg.get("from") == "gpt":
+            if not is_canned_reply(text):
+                interactions.append(_synthetic_interaction(
+                    "dashscope", config.LAWYER_MODEL, True, list(messages),
+                    _synthetic_chunks(text, _dashscope_text_chunk, chunk_chars, first_chunk_delay, chunk_interval)
+                ))
+            messages.append({"role": "assistant", "content": text})
+    if report_text:
+        to_data = lambda piece: {"has_choice": True, "content": piece, "reasoning_content": None,
+                                 "finish_reason": None, "usage": None}
+        chunks = _synthetic_chunks(report_text, to_data, chunk_chars * 2, first_chunk_delay * 10, chunk_interval)
+        chunks.append({"t": chunks[-1]["t"] if chunks else 0, "data": {
+            "has_choice": False, "content": None, "reasoning_content": None, "finish_reason": None,
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "reasoning_tokens": None},
+        }})
+        interactions.append(_synthetic_interaction("dashscope-compatible", config.CASE_ANALYSIS_MODEL, True,
+                                                   [{"role": "user", "content": ""}], chunks))
+    return Cassette(interactions, {"inputs": inputs}, source)
+
+
+_USER_LABEL = "用户: "
+
+
+def _opening(conversation_text: str) -> Optional[str]:
+    """对话文本中第一条用户消息（各条消息以空行分隔）的前 40 个字符。"""
+    start = conversation_text.find(_USER_LABEL)
+    if start < 0:
+        return None
+    return conversation_text[start + len(_USER_LABEL):].split("\n\n", 1)[0][:40] or None
+
+
+def _load_reports(reports_dir: str):
+    """读取一次 case_analysis_results，按对话内容哈希和首条用户消息开头索引报告正文。
+
+    conversation_hash 与 transcript.CaseTranscript 的 content_hash 一致；界面咨询生成的报告
+    对话中还包含案件类型确认等内容，哈希对不上时再按开头匹配。
+    """
+    by_hash, by_opening = {}, {}
+    for path in sorted(glob.glob(os.path.join(reports_dir, "*.json"))) if os.path.isdir(reports_dir) else []:
+        with open(path, 'r', encoding='utf-8') as f:
+            report = json.load(f)
+        if not report.get("case_analysis"):
+            continue
+        if report.get("conversation_hash"):
+            by_hash.setdefault(report["conversation_hash"], report["case_analysis"])
+        opening = _opening(report.get("conversation") or "")
+        if opening:
+            by_opening.setdefault(opening, report["case_analysis"])
+    return by_hash, by_opening
+
+
+def _find_report(reports, conversation: Dict[str, Any]) -> Optional[str]:
+    by_hash, by_opening = reports
+    transcript = CaseTranscript.from_sharegpt(conversation)
+    if transcript.content_hash in by_hash:
+        return by_hash[transcript.content_hash]
+    opening = _opening(transcript.text)
+    return by_opening.get(opening) if opening else None
+
+
+def build_from_datasets(dataset_dir: str, output_dir: str, reports_dir: str = None,
+                        history_dir: str = None) -> List[str]:
+    written = []
+    reports = _load_reports(reports_dir) if reports_dir else None
+    for index, conversation in enumerate(dataset_writer.iter_conversations(dataset_dir)):
+        report_text = _find_report(reports, conversation) if reports else None
+        source = conversation.get("id") or f"conversation_{index}"
+        cassette = cassette_from_conversation(conversation, source, report_text=report_text)
+        name = f"dataset_{index:04d}.json"
+        cassette.save(os.path.join(output_dir, name))
+        written.append(name)
+
+    # 用户聊天记录只含界面展示的文本：律师回复带有“【律师回复】”前缀；案件类型确认保留在对话中
+    # （律师调用的消息里包含它），其余为固定提示，不对应模型调用
+    for path in sorted(glob.glob(os.path.join(history_dir, "*.json"))) if history_dir else []:
+        with open(path, 'r', encoding='utf-8') as f:
+            history = json.load(f).get("chat_history", [])
+        conversation = {"conversations": []}
+        for user_message, reply in history:
+            if user_message:
+                conversation["conversations"].append({"from": "human", "value": user_message})
+            if reply and reply.startswith("【律师回复】"):
+                conversation["conversations"].append({"from": "gpt", "value": reply[len("【律师回复】"):].strip()})
+            elif reply and reply.startswith("【案件类型确认】"):
+                conversation["conversations"].append({"from": "gpt", "value": reply[len("【案件类型确认】"):].strip()})
+        if conversation["conversations"]:
+            name = f"history_{os.path.splitext(os.path.basename(path))[0]}.json"
+            cassette_from_conversation(conversation, os.path.basename(path)).save(os.path.join(output_dir, name))
+            written.append(name)
+    return written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="模型调用 cassette 工具")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build = subparsers.add_parser("build", help="从已有对话数据构建 cassette")
+    build.add_argument("--datasets", default=os.path.join("..", "conversation_datasets"))
+    build.add_argument("--reports", default=os.path.join("..", "case_analysis_results"))
+    build.add_argument("--histories", default=os.path.join("..", "user_histories"))
+    build.add_argument("--out", default="cassettes")
+    args = parser.parse_args()
+
+    names = build_from_datasets(args.datasets, args.out, args.reports, args.histories)
+    print(f"已生成 {len(names)} 个 cassette：{args.out}")
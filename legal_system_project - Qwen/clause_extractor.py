@@ -0,0 +1,164 @@
+"""合同条款本地预检。
+
+合同分析的提示词要求模型逐项检查一组关键条款（双方信息、期限、工作内容和地点、工作时间、
+劳动报酬、社会保险、劳动保护、解除终止、违约责任、竞业限制、保密）。原先把整份 OCR 文本
+直接交给模型。这里先在本地：
+1. 按“第X条”“一、”“1.”“（一）”等编号把合同切成条款，编号前的部分作为首部（通常含双方信息）
+2. 用预编译的关键词正则把每个条款标注到检查清单的一项或多项
+3. 《劳动合同法》第十七条规定的必备条款一个都没找到时，直接判定为缺失（不依赖模型）
+4. 押金、扣押证件、限制婚育、放弃社保等常见违法约定单独标注为风险条款
+5. 交给模型的文本只删掉纯格式性条款（一式两份、签字生效等），其余条款都保留：
+   命中清单或风险词的条款保留全文，其他条款只截断过长的部分
+
+切分结果不可靠（条款太少）、压缩效果不明显或保留的条款超过长度上限时仍发送全文。
+"""
+import re
+from typing import Dict, List, Optional
+
+# 检查项 -> (是否为必备条款, 关键词正则)
+CHECKLIST = {
+    "合同双方基本信息": (True, r"法定代表人|统一社会信用代码|身份证|住所|通讯地址|注册地址|联系电话|(?:甲方|乙方)\s*(?:[（(](?:用人单位|劳动者)[)）])?\s*[：:]"),
+    "劳动合同期限": (True, r"合同期限|固定期限|无固定期限|以完成一定工作任务|试用期|期满|起至|自\s*\d{4}\s*年"),
+    "工作内容和工作地点": (True, r"工作内容|工作岗位|岗位|职务|工作地点|工作地|工作职责"),
+    "工作时间和休息休假": (True, r"工作时间|工时|标准工时|综合计算工时|不定时工作|休息|休假|加班|年假|带薪"),
+    "劳动报酬": (True, r"劳动报酬|工资|薪资|薪酬|月薪|基本工资|绩效|奖金|计件|发放"),
+    "社会保险": (True, r"社会保险|社保|养老保险|医疗保险|失业保险|工伤保险|生育保险|五险|公积金"),
+    "劳动保护、劳动条件和职业危害防护": (True, r"劳动保护|劳动条件|职业危害|职业病|安全生产|劳动防护|防护用品|安全卫生"),
+    "劳动合同解除或终止条件": (False, r"解除|终止|辞退|辞职|提前三十日|经济补偿"),
+    "违约责任": (False, r"违约|赔偿责任|违约金|赔偿损失"),
+    "竞业限制条款": (False, r"竞业限制|竞业禁止|同业竞争"),
+    "保密条款": (False, r"保密|商业秘密|知识产权"),
+}
+
+_CHECKLIST_PATTERNS = {item: re.compile(pattern) for item, (_, pattern) in CHECKLIST.items()}
+# 常见的违法或显失公平的约定，不论是否命中检查清单都必须原文交给模型
+_RISK_PATTERN = re.compile(
+    r"押金|保证金|风险金|扣押|(?:身份证|毕业证|学位证|资格证)\S{0,4}原件|结婚|婚育|生育|怀孕|自动失效|自动解除|自动终止"
+    r"|放弃\S{0,6}(?:社会保险|社保|公积金|经济补偿|加班费)|(?:不缴纳|不缴|不购买)\S{0,4}(?:社会保险|社保)|自愿放弃"
+    r"|罚款|扣发|克扣|无偿加班|工伤自理|后果自负|概不负责|一概不|不得辞职"
+)
+# 只有格式性内容的条款（份数、生效方式、未尽事宜），未命中清单和风险词时才删去
+_BOILERPLATE_PATTERN = re.compile(
+    r"一式[两二三四]份|各执一份|同等法律效力|签字(?:或|并|、)?盖章(?:之日起|后)生效|未尽事宜|以下无正文|本页无正文"
+)
+_MAX_BOILERPLATE_CHARS = 150
+_CN_NUM = r"[一二三四五六七八九十百零〇两]+"
+# 行首的条款编号：第X章/第X条、一、、1.、1、、（一）、(1)
+_CLAUSE_START_PATTERN = re.compile(
+    rf"(?m)^[ \t　]*(?:第\s*(?:{_CN_NUM}|\d+)\s*[章条]|{_CN_NUM}\s*[、．.]|\d{{1,3}}\s*(?:[、．]|\.(?!\d))|[（(]\s*(?:{_CN_NUM}|\d{{1,2}})\s*[）)])"
+)
+_MIN_CLAUSES = 4
+# 压缩后仍超过原文的该比例时直接发送全文
+_MAX_COMPACT_RATIO = 0.85
+# 未命中检查清单和风险词的条款保留的字符数
+_MAX_UNTAGGED_CLAUSE_CHARS = 200
+
+
+class Clause:
+    def __init__(self, index: int, text: str, label: str):
+        self.index = index
+        self.text = text.strip()
+        self.label = label
+        self.tags = [item for item, pattern in _CHECKLIST_PATTERNS.items() if pattern.search(self.text)]
+        self.risky = bool(_RISK_PATTERN.search(self.text))
+
+    @property
+    def boilerplate(self) -> bool:
+        return (not self.tags and not self.risky and len(self.text) <= _MAX_BOILERPLATE_CHARS
+                and bool(_BOILERPLATE_PATTERN.search(self.text)))
+
+
+class ClauseExtraction:
+    def __init__(self, text: str, clauses: List[Clause]):
+        self.text = text
+        self.clauses = clauses
+        self.located: Dict[str, List[str]] = {item: [] for item in CHECKLIST}
+        for clause in clauses:
+            for item in clause.tags:
+                self.located[item].append(clause.label)
+
+    @property
+    def reliable(self) -> bool:
+        return len(self.clauses) >= _MIN_CLAUSES
+
+    @property
+    def missing_required(self) -> List[str]:
+        """必备条款中一个相关条款都没找到的项。切分不可靠时不下结论。"""
+        if not self.reliable:
+            return []
+        return [item for item, (required, _) in CHECKLIST.items() if required and not self.located[item]]
+
+    @property
+    def absent_optional(self) -> List[str]:
+        if not self.reliable:
+            return []
+        return [item for item, (required, _) in CHECKLIST.items() if not required and not self.located[item]]
+
+    @property
+    def risky_clauses(self) -> List[str]:
+        return [clause.label for clause in self.clauses if clause.risky]
+
+    def compact_text(self, max_chars: int = 15000) -> Optional[str]:
+        """删去格式性条款、截断未标注的过长条款后的合同文本。
+
+        首部、命中清单或风险词的条款不截断；压缩效果不明显、超过 max_chars 或切分不可靠时返回 None。
+        """
+        if not self.reliable:
+            return None
+        kept = []
+        for clause in self.clauses:
+            if clause.boilerplate:
+                continue
+            body = clause.text
+            if clause.label != "首部" and not clause.tags and not clause.risky and len(body) > _MAX_UNTAGGED_CLAUSE_CHARS:
+                body = body[:_MAX_UNTAGGED_CLAUSE_CHARS] + "……"
+            tags = clause.tags + (["风险约定"] if clause.risky else [])
+            kept.append(f"[{clause.label}｜{'、'.join(tags) or '未标注'}]\n{body}")
+        compact = "\n\n".join(kept)
+        if len(compact) > len(self.text) * _MAX_COMPACT_RATIO or len(compact) > max_chars:
+            return None
+        return compact
+
+    def summary(self) -> str:
+        """交给模型的结构化预检摘要。"""
+        lines = [f"共切分出 {len(self.clauses)} 个条款（含首部），各检查项所在条款："]
+        for item, labels in self.located.items():
+            lines.append(f"- {item}：{'、'.join(labels) if labels else '未找到'}")
+        if self.risky_clauses:
+            lines.append(f"- 含押金、扣押证件、限制婚育、放弃社保等可能违法约定的条款：{'、'.join(self.risky_clauses)}")
+        if self.missing_required:
+            lines.append(f"本地预检确认缺失的必备条款：{'、'.join(self.missing_required)}")
+        return "\n".join(lines)
+
+    def missing_note(self) -> str:
+        """展示给用户的即时结果，深度分析开始前就可以给出。"""
+        if not self.missing_required:
+            return ""
+        return (f"📋 **条款预检**：未找到以下必备条款——{'、'.join(self.missing_required)}。"
+                f"（本地预检结果，以深度分析为准）\n\n")
+
+
+def segment_clauses(text: str) -> List[Clause]:
+    """按行首编号切分。条款标签取编号本身，下级编号前加上所属的“第X条”，如“第四条 2.”。"""
+    matches = list(_CLAUSE_START_PATTERN.finditer(text))
+    clauses = []
+    if not matches or matches[0].start() > 0:
+        head = text[:matches[0].start()] if matches else text
+        if head.strip():
+            clauses.append(Clause(0, head, "首部"))
+    article = ""
+    for match, next_match in zip(matches, matches[1:] + [None]):
+        heading = re.sub(r"\s+", "", match.group())
+        if heading.startswith("第"):
+            article = heading if heading.endswith("条") else ""
+            label = heading
+        else:
+            label = f"{article} {heading}" if article else heading
+        body = text[match.start():next_match.start() if next_match else len(text)]
+        if body.strip():
+            clauses.append(Clause(len(clauses) + (0 if clauses and clauses[0].index == 0 else 1), body, label))
+    return clauses
+
+
+def extract(text: str) -> ClauseExtraction:
+    return ClauseExtraction(text, segment_clauses(text or ""))
@@ -33,4 +33,197 @@ CASE_TYPES = {
         "name": "因劳动报酬、工伤医疗费、经济补偿或赔偿金发生的争议",
         "file": "lawyer_prompts/lawyer05.txt"
     }
-}
\ No newline at end of file
+}
+
+# Session State Backend
+# memory: 进程内存储，仅适用于单进程部署
+# server: 连接 state_store.py 启动的共享状态服务，多个应用进程/节点共享同一份会话状态
+STATE_BACKEND = os.getenv("STATE_BACKEND", "memory")
+STATE_SERVER_URL = os.getenv("STATE_SERVER_URL", "http://127.0.0.1:7870")
+
+# 应用监听端口，多进程部署时每个进程使用不同端口，由负载均衡统一转发
+SERVER_PORT = int(os.getenv("SERVER_PORT", "7861"))
+
+# Contract Review Job Queue
+CONTRACT_JOB_DB = os.getenv("CONTRACT_JOB_DB", "contract_jobs/jobs.sqlite3")
+CONTRACT_JOB_DIR = os.getenv("CONTRACT_JOB_DIR", "contract_jobs/files")
+# 随应用启动的 worker 进程数；设为 0 时需单独运行 python contract_jobs.py
+CONTRACT_REVIEW_WORKERS = int(os.getenv("CONTRACT_REVIEW_WORKERS", "2"))
+CONTRACT_JOB_POLL_INTERVAL = 0.2
+# 运行中的任务每隔 HEARTBEAT_INTERVAL 秒更新心跳，超过 HEARTBEAT_TIMEOUT 秒没有心跳视为 worker 崩溃；
+# 空闲的 worker 每隔 SWEEP_INTERVAL 秒检查一次
+CONTRACT_JOB_HEARTBEAT_INTERVAL = 30
+CONTRACT_JOB_HEARTBEAT_TIMEOUT = 300
+CONTRACT_JOB_SWEEP_INTERVAL = 60
+# worker 把流式输出合并后写入任务库：距上次写入超过 FLUSH_INTERVAL 秒或累计 FLUSH_CHARS 个字符时写一次
+CONTRACT_JOB_FLUSH_INTERVAL = 0.3
+CONTRACT_JOB_FLUSH_CHARS = 200
+
+# Case Analysis Report
+# 报告要求总字数在 1000 字以内；三部分生成完毕后提前结束流式输出
+CASE_REPORT_MAX_CHARS = 1000
+
+# Case Analysis Tiers
+# full: 完整推理（最慢、质量最高）；bounded: 限制推理长度；fast: 不推理，直接用对话模型生成
+CASE_ANALYSIS_TIERS = {
+    "full": {"model": CASE_ANALYSIS_MODEL, "extra_body": {}},
+    "bounded": {"model": "qwen-plus-latest", "extra_body": {"enable_thinking": True, "thinking_budget": 2048}},
+    "fast": {"model": LAWYER_MODEL, "extra_body": {}},
+}
+CASE_ANALYSIS_DEFAULT_TIER = os.getenv("CASE_ANALYSIS_DEFAULT_TIER", "full")
+# 对话超过该 token 数时改用 bounded，避免长对话触发过长的推理
+CASE_ANALYSIS_LONG_TRANSCRIPT_TOKENS = 6000
+# 本进程内同时生成中的报告数达到阈值时逐级降级
+CASE_ANALYSIS_LOAD_THRESHOLDS = {"bounded": 4, "fast": 8}
+
+# Embedding Router
+# 意图与案件类型路由使用的本地句向量模型，启动时对示例语句编码一次并建立 FAISS 索引
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "BAAI/bge-small-zh-v1.5")
+ROUTER_ENABLED = os.getenv("ROUTER_ENABLED", "1") == "1"
+# 最近邻相似度低于阈值、或前两名差距过小时，回退到关键词规则
+ROUTER_CONFIDENCE_THRESHOLD = 0.6
+ROUTER_MIN_MARGIN = 0.02
+ROUTER_TOP_K = 5
+ROUTER_LATENCY_BUDGET_MS = 10
+
+# Headless HTTP/SSE API (api.py)
+API_PORT = int(os.getenv("API_PORT", "7862"))
+
+# Chat History Window
+# 聊天记录以服务端为准，客户端只显示最近的若干轮，点击“加载更早的对话”每次多加载一页
+CHAT_HISTORY_WINDOW = 20
+
+# Cancellation
+# 各类调用的典型输出 token 数，调用被取消时据此估算节省的用量
+EXPECTED_COMPLETION_TOKENS = {
+    "legal": 800,
+    "lawyer": 400,
+    "paralegal": 300,
+    "contract": 2000,
+    "case_report": 3000,
+}
+# 通过共享状态后端检查其他进程是否已开始新一轮或重置会话的最小间隔（秒）
+CANCEL_REMOTE_CHECK_INTERVAL = 0.5
+
+# Deadlines
+# 每轮对话从入口开始计算的总时限（秒）；合同审查包含排队、OCR 和长输出，单独设置
+REQUEST_DEADLINE_SECONDS = int(os.getenv("REQUEST_DEADLINE_SECONDS", "150"))
+CONTRACT_REVIEW_DEADLINE_SECONDS = int(os.getenv("CONTRACT_REVIEW_DEADLINE_SECONDS", "420"))
+# 各阶段的预算上限，实际预算还受整轮剩余时间限制
+STAGE_TIMEOUTS = {
+    "extraction": 30,
+    "ocr": 90,
+    "paralegal": 8,
+    "lawyer": 60,
+    "legal": 60,
+    "analysis": 120,
+    "contract_analysis": 240,
+}
+# 流式响应两次分片之间允许的最长间隔（秒），超过即视为连接停滞
+STREAM_IDLE_TIMEOUT = 20
+# 可跳过的阶段（如润色）预算低于该值时直接跳过
+DEADLINE_MIN_STAGE_SECONDS = 2
+# 剩余时间低于该值时，律师调用只保留系统提示词和最近的若干条消息
+DEADLINE_SHRINK_CONTEXT_BELOW = 60
+DEADLINE_SHRINK_KEEP_MESSAGES = 8
+# 剩余时间低于该值时，案例报告改用快速档
+DEADLINE_FAST_TIER_BELOW = 90
+DEADLINE_EXECUTOR_WORKERS = 16
+
+# LLM scheduler
+# 各服务商/模型的调用限额：每分钟请求数（rpm）和每分钟 token 数（tpm），"*" 为该服务商的默认值
+LLM_QUOTAS = {
+    "dashscope": {
+        "*": {"rpm": 600, "tpm": 1000000},
+        "deepseek-r1": {"rpm": 60, "tpm": 200000},
+    },
+    "deepseek": {
+        "*": {"rpm": 120, "tpm": 400000},
+    },
+}
+# 后台和批量请求不能使用的额度比例（为交互请求保留）
+LLM_INTERACTIVE_RESERVE = {"interactive": 0.0, "background": 0.2, "batch": 0.5}
+# 预计排队时间超过该值（秒）时在界面上提示
+SCHEDULER_SHOW_WAIT_ABOVE = 2
+
+# Admission control
+ADMISSION_MAX_CONCURRENT_PER_USER = 2
+ADMISSION_REQUESTS_PER_MINUTE = 20
+ADMISSION_DAILY_TOKEN_BUDGET = int(os.getenv("ADMISSION_DAILY_TOKEN_BUDGET", "300000"))
+# 单进程同时处理的对话轮次上限，超出后按用户轮转排队
+ADMISSION_MAX_ACTIVE_TURNS = int(os.getenv("ADMISSION_MAX_ACTIVE_TURNS", "32"))
+ADMISSION_QUEUE_TIMEOUT = 30
+# 并发名额的最长占用时间（秒），用于回收异常退出的进程遗留的名额
+ADMISSION_SLOT_TTL = 900
+# 打开后并发、频率和额度计数保存在共享状态后端（STATE_BACKEND）中
+ADMISSION_SHARED_STATE = os.getenv("ADMISSION_SHARED_STATE", "0") == "1"
+# 不受准入限制的用户，多个用逗号分隔
+ADMIN_USER_IDS = {user_id.strip() for user_id in os.getenv("ADMIN_USER_IDS", "").split(",") if user_id.strip()}
+# 管理接口的访问令牌，为空时关闭管理接口
+ADMIN_API_TOKEN = os.getenv("ADMIN_API_TOKEN", "")
+
+# Case report prefetch
+# 律师回复仍在输出时，若预测本轮是咨询收尾，就在后台提前生成案例报告
+REPORT_PREFETCH_ENABLED = os.getenv("REPORT_PREFETCH_ENABLED", "1") == "1"
+REPORT_PREFETCH_THRESHOLD = 0.8
+# 典型咨询的用户轮次，用于轮次得分归一化
+REPORT_PREFETCH_EXPECTED_ROUNDS = 12
+# 回复输出到该长度仍没有问句时，“无问句”一项得满分
+REPORT_PREFETCH_MIN_PARTIAL_CHARS = 80
+REPORT_PREFETCH_TTL = 600
+
+# Conversation datasets
+DATASET_DIR = "conversation_datasets"
+# 单个 JSONL 分片的大小上限（字节），超过后写入新分片
+DATASET_SHARD_BYTES = int(os.getenv("DATASET_SHARD_BYTES", str(64 * 1024 * 1024)))
+# 打开后分片写成 .jsonl.gz
+DATASET_COMPRESS = os.getenv("DATASET_COMPRESS", "0") == "1"
+# 后台线程每批最多写入的记录数，以及攒批的最长等待时间（秒）
+DATASET_FLUSH_BATCH = 100
+DATASET_FLUSH_INTERVAL = 2.0
+
+# Dataset export
+EXPORT_DIR = "dataset_exports"
+EXPORT_WORKERS = int(os.getenv("EXPORT_WORKERS", str(os.cpu_count() or 4)))
+# 用户发言的字符 shingle 长度与 MinHash 排列数；LSH 分桶数需整除排列数
+EXPORT_SHINGLE_CHARS = 5
+EXPORT_MINHASH_PERMUTATIONS = 128
+EXPORT_LSH_BANDS = 16
+# MinHash 估计的 Jaccard 相似度达到该值时视为重复咨询
+EXPORT_DEDUP_THRESHOLD = 0.85
+
+# Case analysis search
+SEARCH_INDEX_PATH = os.getenv("SEARCH_INDEX_PATH", "case_search.db")
+
+# Similar case retrieval
+CASE_RETRIEVAL_ENABLED = os.getenv("CASE_RETRIEVAL_ENABLED", "1") == "1"
+CASE_RETRIEVAL_DIR = os.getenv("CASE_RETRIEVAL_DIR", "case_retrieval_index")
+CASE_RETRIEVAL_TOP_K = 3
+# 低于该相似度的既往案例不作为参考
+CASE_RETRIEVAL_MIN_SIMILARITY = 0.75
+# 同类型案例相似度达到该值时以其报告为草稿，改用快速档改写
+CASE_RETRIEVAL_DRAFT_SIMILARITY = 0.92
+# 用于计算检索向量的用户发言最大字符数，以及每个参考案例保留的字符数
+CASE_RETRIEVAL_FACT_CHARS = 1000
+CASE_RETRIEVAL_EXEMPLAR_CHARS = 300
+
+# Batch contract review
+# 文本提取 / OCR 进程数（每个进程各加载一份 OCR 模型）
+BATCH_REVIEW_EXTRACT_WORKERS = int(os.getenv("BATCH_REVIEW_EXTRACT_WORKERS", str(min(4, os.cpu_count() or 1))))
+# 同时进行的深度分析数；实际放行速度仍受 LLM_QUOTAS 和 batch 优先级的保留额度限制
+BATCH_REVIEW_CONCURRENCY = int(os.getenv("BATCH_REVIEW_CONCURRENCY", "16"))
+
+# Bulk report regeneration
+# 同时生成的报告数；实际放行速度仍受 LLM_QUOTAS 和 batch 优先级的保留额度限制
+REGENERATE_REPORTS_CONCURRENCY = int(os.getenv("REGENERATE_REPORTS_CONCURRENCY", "8"))
+
+# Multi-image upload filtering
+# 16x16 差值哈希（256 位）的汉明距离不超过该值时视为重复图片，跳过 OCR
+IMAGE_DUPLICATE_MAX_DISTANCE = int(os.getenv("IMAGE_DUPLICATE_MAX_DISTANCE", "16"))
+# 边缘像素比例（1/4 尺寸）低于该值的图片可能是空白页，经文本检测确认没有文字后跳过。
+# 只有几行签署栏的签署页约为 0.002，阈值需远低于此
+IMAGE_BLANK_EDGE_RATIO = float(os.getenv("IMAGE_BLANK_EDGE_RATIO", "0.0005"))
+
+# Batched OCR
+# 多页图片的文本行按该大小分批送入识别模型；设为 1 时逐页调用 readtext
+OCR_RECOGNITION_BATCH_SIZE = int(os.getenv("OCR_RECOGNITION_BATCH_SIZE", "32"))
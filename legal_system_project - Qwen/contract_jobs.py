@@ -0,0 +1,466 @@
+"""合同审查任务队列。
+
+合同审查（OCR、类型识别、公章检测、DeepSeek 流式分析）耗时很长，不再在 Gradio 事件处理
+函数里直接执行，而是作为任务提交到本地 SQLite 队列中，由独立的 worker 进程池处理：
+
+- 上传文件会被复制到任务目录，任务记录持久化在数据库中，服务重启后仍可继续处理；
+  任务结束（完成、失败或取消）后删除任务目录
+- worker 把分析过程中的每一步输出写成事件，聊天界面按任务编号轮询并流式展示，
+  客户端断线重连后也可以按任务编号重新获取（api.py 的 GET /api/contracts/{job_id}）；
+  流式输出的增量在内存中合并后批量写入，每个任务只使用一个数据库连接
+- worker 运行任务期间定时更新心跳；空闲的 worker 定期把心跳超时的任务（worker 崩溃）放回队列
+- worker 进程数量（config.CONTRACT_REVIEW_WORKERS）与聊天并发相互独立
+- 同一个任务库只启动一个 worker 池：启动时对任务库旁的锁文件加排他锁，app.py、api.py 的多个
+  uvicorn 进程或单独启动的 worker 池中只有先拿到锁的一个会启动
+
+单独启动 worker 池：
+    python contract_jobs.py --workers 4
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Generator, List, Optional
+
+import config
+import deadlines
+import metrics
+
+TERMINAL_STATUSES = ("done", "failed", "cancelled")
+# 本进程持有的 worker 池锁文件，进程退出时随之释放
+_pool_lock = None
+# worker 与界面使用同一个截止时间；界面多等几秒，让 worker 写入自己的超时提示
+_DEADLINE_GRACE_SECONDS = 5
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    file_paths TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    heartbeat REAL,
+    worker TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    deadline_at REAL,
+    user_id TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at);
+CREATE INDEX IF NOT EXISTS idx_jobs_user ON jobs (user_id, created_at);
+CREATE TABLE IF NOT EXISTS job_events (
+    job_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    content TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (job_id, seq)
+);
+"""
+_INSERT_EVENT = ("INSERT INTO job_events (job_id, seq, kind, content, created_at) VALUES "
+                 "(?, (SELECT COALESCE(MAX(seq), 0) + 1 FROM job_events WHERE job_id = ?), ?, ?, ?)")
+
+
+class ContractJobQueue:
+    """基于 SQLite 的持久化任务队列，可被多个应用进程和 worker 进程同时使用。"""
+
+    def __init__(self, db_path: str = None, job_dir: str = None):
+        self.db_path = db_path or config.CONTRACT_JOB_DB
+        self.job_dir = job_dir or config.CONTRACT_JOB_DIR
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        os.makedirs(self.job_dir, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            # 旧版本创建的数据库没有截止时间和用户列，先补齐列再建索引
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+            if columns and "deadline_at" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN deadline_at REAL")
+            if columns and "user_id" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN user_id TEXT")
+            conn.executescript(_SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def submit(self, file_paths: List[str], deadline_at: float = None, user_id: str = None) -> str:
+        """复制上传文件到任务目录并入队，返回任务编号。deadline_at 为整个审查的截止时间（时间戳）。
+
+        user_id 为提交任务的用户，按任务编号重新获取结果时用于校验。
+        """
+        job_id = uuid.uuid4().hex[:16]
+        target_dir = os.path.join(self.job_dir, job_id)
+        os.makedirs(target_dir, exist_ok=True)
+        stored_paths = []
+        for index, path in enumerate(file_paths):
+            # 保留原扩展名，文件类型判断依赖它；加序号避免同名文件互相覆盖
+            target = os.path.join(target_dir, f"{index:03d}_{os.path.basename(path)}")
+            shutil.copyfile(path, target)
+            stored_paths.append(target)
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, status, file_paths, created_at, deadline_at, user_id) "
+                "VALUES (?, 'queued', ?, ?, ?, ?)",
+                (job_id, json.dumps(stored_paths, ensure_ascii=False), time.time(), deadline_at, user_id)
+            )
+        return job_id
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def queue_position(self, job_id: str) -> int:
+        """排在该任务之前、仍在等待的任务数量。"""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND created_at < "
+                "(SELECT created_at FROM jobs WHERE id = ?)", (job_id,)
+            ).fetchone()
+        return row[0]
+
+    def claim(self, worker: str) -> Optional[dict]:
+        """原子地领取最早的排队任务。"""
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT * FROM jobs WHERE status = 'queued' AND cancel_requested = 0 "
+                    "ORDER BY created_at LIMIT 1"
+                ).fetchone()
+                if row is None:
+                    conn.execute("COMMIT")
+                    return None
+                now = time.time()
+                conn.execute(
+                    "UPDATE jobs SET status = 'running', worker = ?, started_at = ?, heartbeat = ?, "
+                    "attempts = attempts + 1 WHERE id = ?",
+                    (worker, now, now, row["id"])
+                )
+                if row["attempts"]:
+                    # 重新执行的任务从头输出：保留上一次的事件，使序号保持递增（已连接的 stream 按序号
+                    # 继续读取），以一条 replace 事件清空上一次的文本
+                    conn.execute(_INSERT_EVENT, (row["id"], row["id"], "replace",
+                                                 f"🔄 **合同审查任务重新开始执行**（编号 {row['id']}）...", now))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        job = dict(row)
+        job["file_paths"] = json.loads(job["file_paths"])
+        return job
+
+    def append_event(self, job_id: str, kind: str, content: str):
+        """kind 为 append（在当前文本末尾追加）或 replace（整体替换当前文本）。"""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(_INSERT_EVENT, (job_id, job_id, kind, content, now))
+            conn.execute("UPDATE jobs SET heartbeat = ? WHERE id = ?", (now, job_id))
+
+    def event_writer(self, job_id: str) -> "JobEventWriter":
+        return JobEventWriter(self.db_path, job_id)
+
+    def heartbeat(self, job_id: str):
+        """长时间没有输出（如 OCR）时由 worker 定时调用，表明任务仍在运行。"""
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET heartbeat = ? WHERE id = ? AND status = 'running'", (time.time(), job_id))
+
+    def finish(self, job_id: str, status: str = "done", error: str = None):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, finished_at = ?, error = ? WHERE id = ?",
+                (status, time.time(), error, job_id)
+            )
+        self._remove_files(job_id)
+
+    def request_cancel(self, job_id: str):
+        """排队中的任务直接取消；运行中的任务由 worker 在下一次输出时检查并停止。"""
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ?", (job_id,))
+            cursor = conn.execute(
+                "UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE id = ? AND status = 'queued'",
+                (time.time(), job_id)
+            )
+        if cursor.rowcount:
+            self._remove_files(job_id)
+
+    def _remove_files(self, job_id: str):
+        # 结束的任务不会再被执行，上传文件的副本不再需要
+        shutil.rmtree(os.path.join(self.job_dir, job_id), ignore_errors=True)
+
+    def requeue_stale(self, timeout: float = None) -> int:
+        """把心跳超时的运行中任务（worker 崩溃或服务重启）放回队列；已请求取消的直接标记为取消。"""
+        timeout = timeout if timeout is not None else config.CONTRACT_JOB_HEARTBEAT_TIMEOUT
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                cancelled = [row["id"] for row in conn.execute(
+                    "SELECT id FROM jobs WHERE status = 'running' AND heartbeat < ? AND cancel_requested = 1",
+                    (now - timeout,)
+                )]
+                conn.executemany(
+                    "UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE id = ?",
+                    [(now, job_id) for job_id in cancelled]
+                )
+                cursor = conn.execute(
+                    "UPDATE jobs SET status = 'queued', worker = NULL WHERE status = 'running' AND heartbeat < ?",
+                    (now - timeout,)
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        for job_id in cancelled:
+            self._remove_files(job_id)
+        return cursor.rowcount
+
+    def remove_finished_files(self) -> int:
+        """删除已结束任务遗留的任务目录（如 worker 在删除前退出），返回删除的数量。"""
+        names = [name for name in os.listdir(self.job_dir) if os.path.isdir(os.path.join(self.job_dir, name))]
+        if not names:
+            return 0
+        with self._connect() as conn:
+            active = {row["id"] for row in conn.execute(
+                f"SELECT id FROM jobs WHERE status NOT IN ({', '.join('?' * len(TERMINAL_STATUSES))})",
+                TERMINAL_STATUSES
+            )}
+        # 刚提交的任务先复制文件再写入数据库，只清理已存在一段时间的目录
+        cutoff = time.time() - config.CONTRACT_JOB_HEARTBEAT_TIMEOUT
+        removed = 0
+        for name in names:
+            path = os.path.join(self.job_dir, name)
+            if name not in active and os.path.getmtime(path) < cutoff:
+                shutil.rmtree(path, ignore_errors=True)
+                removed += 1
+        return removed
+
+    def sweep(self) -> int:
+        """定期维护：放回心跳超时的任务，清理已结束任务的文件。返回放回队列的任务数。"""
+        requeued = self.requeue_stale()
+        self.remove_finished_files()
+        return requeued
+
+    def read_text(self, job_id: str, after_seq: int = 0, text: str = "") -> tuple:
+        """从 after_seq 之后的事件重建展示文本，返回 (text, last_seq)。"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT seq, kind, content FROM job_events WHERE job_id = ? AND seq > ? ORDER BY seq",
+                (job_id, after_seq)
+            ).fetchall()
+        for row in rows:
+            text = text + row["content"] if row["kind"] == "append" else row["content"]
+            after_seq = row["seq"]
+        return text, after_seq
+
+    def stream(self, job_id: str, poll_interval: float = None, deadline_at: float = None) -> Generator[str, None, None]:
+        """按任务编号轮询事件，每当展示文本变化时产出当前完整文本，直到任务结束或超过截止时间。"""
+        poll_interval = poll_interval or config.CONTRACT_JOB_POLL_INTERVAL
+        text, last_seq = "", 0
+        last_position = None
+        while True:
+            job = self.get(job_id)
+            if job is None:
+                yield f"❌ **错误**：找不到合同审查任务 {job_id}。"
+                return
+            if job["status"] == "queued":
+                position = self.queue_position(job_id)
+                if position != last_position:
+                    last_position = position
+                    yield f"⏳ **合同审查任务已提交**（编号 {job_id}），前面还有 {position} 个任务在排队..."
+            new_text, new_seq = self.read_text(job_id, last_seq, text)
+            if new_seq != last_seq:
+                text, last_seq = new_text, new_seq
+                yield text
+            if job["status"] in TERMINAL_STATUSES:
+                # 结束前再读一次，避免遗漏状态更新前写入的最后几条事件
+                new_text, new_seq = self.read_text(job_id, last_seq, text)
+                if new_seq != last_seq:
+                    yield new_text
+                elif job["status"] == "cancelled" and not text:
+                    yield "⚠️ 合同审查任务已取消。"
+                return
+            if deadline_at is not None and time.time() > deadline_at + _DEADLINE_GRACE_SECONDS:
+                # worker 没能在截止时间内结束（例如一直在排队），不再等待
+                self.request_cancel(job_id)
+                metrics.increment("deadline_breaches", stage="contract_review")
+                yield (text + "\n\n" if text else "") + "⚠️ 合同审查超时，请稍后重新上传。"
+                return
+            time.sleep(poll_interval)
+
+
+class JobEventWriter:
+    """worker 写入单个任务事件的连接。
+
+    review_files 每产出一个 token 就是一次输出，逐条写入会让每个 token 都成为一次写事务，
+    与其他 worker 争用同一个数据库文件。这里把连续的 append 合并在内存中，replace 立即写入，
+    append 在距上次写入超过 CONTRACT_JOB_FLUSH_INTERVAL 秒或累计 CONTRACT_JOB_FLUSH_CHARS 个字符时写入；
+    每次写入在同一个事务里更新心跳并读取取消标记（cancel_requested）。
+    """
+
+    def __init__(self, db_path: str, job_id: str):
+        self.job_id = job_id
+        self.cancel_requested = False
+        self._conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+        self._pending = None  # (kind, content)
+        self._last_flush = time.monotonic()
+
+    def write(self, kind: str, content: str):
+        if kind == "replace" or self._pending is None:
+            self._pending = (kind, content)
+        else:
+            self._pending = (self._pending[0], self._pending[1] + content)
+        if (kind == "replace" or len(self._pending[1]) >= config.CONTRACT_JOB_FLUSH_CHARS
+                or time.monotonic() - self._last_flush >= config.CONTRACT_JOB_FLUSH_INTERVAL):
+            self.flush()
+
+    def flush(self):
+        now = time.time()
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            if self._pending is not None:
+                self._conn.execute(_INSERT_EVENT, (self.job_id, self.job_id, *self._pending, now))
+            self._conn.execute("UPDATE jobs SET heartbeat = ? WHERE id = ?", (now, self.job_id))
+            row = self._conn.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (self.job_id,)).fetchone()
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._pending = None
+        self._last_flush = time.monotonic()
+        self.cancel_requested = bool(row and row[0])
+
+    def close(self):
+        self._conn.close()
+
+
+def run_job(queue: ContractJobQueue, analyzer, job: dict):
+    """执行单个任务，把 review_files 产出的展示文本转换为增量事件写入队列。"""
+    job_id = job["id"]
+    previous = ""
+    writer = queue.event_writer(job_id)
+    deadline = deadlines.Deadline(expires_at=job["deadline_at"]) if job.get("deadline_at") else None
+    review = analyzer.review_files(job["file_paths"], deadline)
+    # OCR 等步骤可能长时间没有输出，单独的线程定时更新心跳，避免被当作 worker 崩溃而重新执行
+    stopped = threading.Event()
+
+    def beat():
+        while not stopped.wait(config.CONTRACT_JOB_HEARTBEAT_INTERVAL):
+            queue.heartbeat(job_id)
+
+    threading.Thread(target=beat, name=f"heartbeat-{job_id}", daemon=True).start()
+    try:
+        for text in review:
+            if previous and text.startswith(previous):
+                writer.write("append", text[len(previous):])
+            else:
+                writer.write("replace", text)
+            previous = text
+            # 取消标记在每次写入时读取
+            if writer.cancel_requested:
+                # 关闭生成器会逐层关闭到 DeepSeek 的流式连接
+                review.close()
+                writer.flush()
+                queue.finish(job_id, "cancelled")
+                return
+        writer.flush()
+        queue.finish(job_id, "done")
+    except Exception as e:
+        writer.write("replace", f"❌ **程序发生严重错误**：\n\n`{str(e)}`")
+        queue.finish(job_id, "failed", str(e))
+    finally:
+        stopped.set()
+        writer.close()
+
+
+def worker_loop(db_path: str, job_dir: str, worker_name: str):
+    """worker 进程主循环：领取任务、执行、空闲时休眠，并定期放回其他 worker 崩溃时遗留的任务。"""
+    from services import ContractAnalyzer
+
+    queue = ContractJobQueue(db_path, job_dir)
+    analyzer = ContractAnalyzer()
+    next_sweep = time.monotonic() + config.CONTRACT_JOB_SWEEP_INTERVAL
+    while True:
+        if time.monotonic() >= next_sweep:
+            next_sweep = time.monotonic() + config.CONTRACT_JOB_SWEEP_INTERVAL
+            requeued = queue.sweep()
+            if requeued:
+                print(f"⚠️ 已将 {requeued} 个心跳超时的合同审查任务重新放回队列")
+        job = queue.claim(worker_name)
+        if job is None:
+            time.sleep(config.CONTRACT_JOB_POLL_INTERVAL)
+            continue
+        run_job(queue, analyzer, job)
+
+
+def _acquire_pool_lock(db_path: str) -> bool:
+    """对任务库旁的锁文件加非阻塞排他锁，已被其他进程持有时返回 False。"""
+    global _pool_lock
+    if _pool_lock is not None:
+        return False
+    lock_file = open(f"{db_path}.pool.lock", "a+")
+    try:
+        if os.name == "nt":
+            import msvcrt
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return False
+    _pool_lock = lock_file
+    return True
+
+
+def start_worker_pool(num_workers: int = None, db_path: str = None, job_dir: str = None) -> List[multiprocessing.Process]:
+    """启动 worker 进程池。先把上次异常退出时遗留的运行中任务放回队列。
+
+    同一个任务库已有 worker 池（本进程或其他进程启动）时不再启动，返回空列表。
+    """
+    num_workers = num_workers if num_workers is not None else config.CONTRACT_REVIEW_WORKERS
+    queue = ContractJobQueue(db_path, job_dir)
+    if not _acquire_pool_lock(queue.db_path):
+        print("合同审查 worker 池已由其他进程启动，本进程不再启动")
+        return []
+    requeued = queue.sweep()
+    if requeued:
+        print(f"已将 {requeued} 个未完成的合同审查任务重新放回队列")
+
+    # 使用 spawn，避免把 Gradio 等父进程中的线程状态 fork 到 worker 中
+    context = multiprocessing.get_context("spawn")
+    processes = []
+    for index in range(num_workers):
+        name = f"contract-worker-{os.getpid()}-{index}"
+        process = context.Process(target=worker_loop, args=(queue.db_path, queue.job_dir, name),
+                                  name=name, daemon=True)
+        process.start()
+        processes.append(process)
+    return processes
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="启动合同审查 worker 进程池")
+    parser.add_argument("--workers", type=int, default=config.CONTRACT_REVIEW_WORKERS)
+    args = parser.parse_args()
+
+    workers = start_worker_pool(args.workers)
+    print(f"合同审查 worker 已启动：{len(workers)} 个进程")
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        pass
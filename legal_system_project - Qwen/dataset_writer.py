@@ -0,0 +1,218 @@
+"""对话数据集的流式分片写入。
+
+原先每次咨询结束都在 conversation_datasets/ 下写一个带缩进的 JSON 文件，且每个文件都完整
+包含几 KB 的系统提示词；文件名只精确到秒，并发时会互相覆盖。这里改为：
+
+- 追加写入 JSONL 分片（每行一条 ShareGPT 记录），分片超过 DATASET_SHARD_BYTES 后换新文件，
+  DATASET_COMPRESS 打开时写成 .jsonl.gz
+- 系统提示词只在旁表 prompts.jsonl 中保存一次，记录里通过 prompt_id（内容哈希）引用
+- 记录编号由时间戳和随机数组成，多进程同时写入也不会冲突；分片文件名包含进程号
+- append() 只把记录放进内存队列，后台线程按批写入并刷新到磁盘，不阻塞聊天流程
+
+读取时 iter_conversations() 同时兼容旧的 JSON 文件和新的分片，并把系统提示词还原到记录中。
+"""
+import atexit
+import glob
+import gzip
+import hashlib
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional
+
+import config
+
+PROMPTS_FILE = "prompts.jsonl"
+SHARD_PATTERN = "shard-*.jsonl*"
+
+
+def prompt_id(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()[:16]
+
+
+def new_record_id() -> str:
+    """按时间排序、跨进程不冲突的记录编号。"""
+    return f"{datetime.now().strftime('%Y%m%d%H%M%S%f')}-{uuid.uuid4().hex[:12]}"
+
+
+class DatasetWriter:
+    def __init__(self, directory: str = None, shard_bytes: int = None, compress: bool = None,
+                 batch_size: int = None, flush_interval: float = None):
+        self.directory = directory or config.DATASET_DIR
+        self.shard_bytes = shard_bytes or config.DATASET_SHARD_BYTES
+        self.compress = config.DATASET_COMPRESS if compress is None else compress
+        self.batch_size = batch_size or config.DATASET_FLUSH_BATCH
+        self.flush_interval = flush_interval or config.DATASET_FLUSH_INTERVAL
+        os.makedirs(self.directory, exist_ok=True)
+        self._queue: "queue.Queue" = queue.Queue()
+        self._known_prompts = self._load_prompt_ids()
+        self._shard = None
+        self._shard_path = None
+        self._shard_seq = 0
+        self._shard_prefix = f"shard-{datetime.now().strftime('%Y%m%d%H%M%S')}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="dataset-writer", daemon=True)
+        self._thread.start()
+
+    def _load_prompt_ids(self) -> set:
+        ids = set()
+        path = os.path.join(self.directory, PROMPTS_FILE)
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        ids.add(json.loads(line)["prompt_id"])
+        return ids
+
+    def append(self, conversations: List[Dict[str, str]], system_prompt: str = None, **meta) -> str:
+        """加入一条 ShareGPT 记录，返回记录编号。实际写入在后台线程中进行。"""
+        if self._closed:
+            raise RuntimeError("数据集写入器已关闭")
+        record = {"id": new_record_id(), "created_at": time.time(), **meta, "conversations": conversations}
+        self._queue.put((record, system_prompt))
+        return record["id"]
+
+    def flush(self, timeout: float = None):
+        """等待此前加入的记录全部写入磁盘。"""
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait(timeout)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join(timeout=30)
+
+    def _run(self):
+        while True:
+            batch, waiters, stop = [], [], False
+            item = self._queue.get()
+            batch_ends = time.monotonic() + self.flush_interval
+            while True:
+                if item is None:
+                    stop = True
+                elif isinstance(item, threading.Event):
+                    waiters.append(item)
+                else:
+                    batch.append(item)
+                if stop or waiters or len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self._queue.get(timeout=max(0.0, batch_ends - time.monotonic()))
+                except queue.Empty:
+                    break
+            try:
+                if batch:
+                    self._write_batch(batch)
+            except Exception as e:
+                print(f"⚠️ 写入对话数据集失败（{len(batch)} 条记录丢失）: {e}")
+            for waiter in waiters:
+                waiter.set()
+            if stop:
+                if self._shard is not None:
+                    self._shard.close()
+                return
+
+    def _write_batch(self, batch):
+        new_prompts = []
+        lines = []
+        for record, system_prompt in batch:
+            if system_prompt:
+                pid = prompt_id(system_prompt)
+                if pid not in self._known_prompts:
+                    self._known_prompts.add(pid)
+                    new_prompts.append({"prompt_id": pid, "text": system_prompt})
+                record["prompt_id"] = pid
+            lines.append(json.dumps(record, ensure_ascii=False) + "\n")
+        # 先写提示词旁表，保证分片中的每个 prompt_id 都能解析
+        if new_prompts:
+            with open(os.path.join(self.directory, PROMPTS_FILE), 'a', encoding='utf-8') as f:
+                f.writelines(json.dumps(p, ensure_ascii=False) + "\n" for p in new_prompts)
+                f.flush()
+                os.fsync(f.fileno())
+        shard = self._current_shard()
+        shard.writelines(lines)
+        shard.flush()
+        if os.path.getsize(self._shard_path) >= self.shard_bytes:
+            shard.close()
+            self._shard = None
+
+    def _current_shard(self):
+        if self._shard is None:
+            self._shard_seq += 1
+            suffix = ".jsonl.gz" if self.compress else ".jsonl"
+            self._shard_path = os.path.join(self.directory, f"{self._shard_prefix}-{self._shard_seq:05d}{suffix}")
+            if self.compress:
+                self._shard = gzip.open(self._shard_path, 'at', encoding='utf-8')
+            else:
+                self._shard = open(self._shard_path, 'a', encoding='utf-8')
+        return self._shard
+
+
+def load_prompts(directory: str) -> Dict[str, str]:
+    prompts = {}
+    path = os.path.join(directory, PROMPTS_FILE)
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    prompts[entry["prompt_id"]] = entry["text"]
+    return prompts
+
+
+def _read_lines(path: str) -> Iterator[str]:
+    opener = gzip.open if path.endswith(".gz") else open
+    try:
+        with opener(path, 'rt', encoding='utf-8') as f:
+            yield from f
+    except EOFError:
+        # 仍在写入的压缩分片末尾可能不完整
+        return
+
+
+def iter_shard_records(directory: str) -> Iterator[Dict]:
+    """逐条读取分片中的原始记录（system prompt 仍以 prompt_id 表示）。"""
+    for path in sorted(glob.glob(os.path.join(directory, SHARD_PATTERN))):
+        for line in _read_lines(path):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                # 进程异常退出时最后一行可能只写了一半
+                continue
+
+
+def iter_conversations(directory: str = None) -> Iterator[Dict]:
+    """读取全部 ShareGPT 对话：旧版 JSON 文件与新版分片，系统提示词已还原。"""
+    directory = directory or config.DATASET_DIR
+    for path in sorted(glob.glob(os.path.join(directory, "*.json"))):
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        yield from data if isinstance(data, list) else [data]
+    prompts = load_prompts(directory)
+    for record in iter_shard_records(directory):
+        pid = record.pop("prompt_id", None)
+        if pid is not None:
+            record["system_prompt"] = prompts.get(pid, "")
+        yield record
+
+
+_default_writer: Optional[DatasetWriter] = None
+_default_lock = threading.Lock()
+
+
+def get_writer() -> DatasetWriter:
+    global _default_writer
+    with _default_lock:
+        if _default_writer is None:
+            _default_writer = DatasetWriter()
+            atexit.register(_default_writer.close)
+        return _default_writer
@@ -0,0 +1,187 @@
+"""请求截止时间与分阶段超时。
+
+每轮对话（或一次合同审查）在入口处创建一个 Deadline，之后的各个阶段（文本提取、OCR、
+法律助理润色、律师回复、案例报告）从中领取各自的预算：阶段预算取 config.STAGE_TIMEOUTS
+与整轮剩余时间中较小的一个。
+
+阶段超时后各自降级，而不是让整个请求挂住：
+- 法律助理润色：跳过，直接使用用户原文
+- 律师回复：剩余时间不足时只带最近的对话；流式输出停滞时截断
+- 案例报告：剩余时间不足时改用快速档；超时截断时按已完成的部分保存
+- OCR / 文本提取：跳过超时的图片，或返回超时提示
+
+流式阶段超时后，调用方在自己的线程中关闭上游连接（Upstream），读取上游的后台线程随即退出，
+不会一直阻塞在停滞的连接上。
+
+所有超时和降级都记入 metrics（deadline_breaches / deadline_degradations），
+各阶段耗时记入 stage_seconds 分布，便于观察尾延迟。
+"""
+import inspect
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Callable, Iterable, Iterator
+
+import config
+import metrics
+
+
+class DeadlineExceeded(Exception):
+    def __init__(self, stage: str):
+        super().__init__(f"{stage} 阶段超时")
+        self.stage = stage
+
+
+class Deadline:
+    """以墙上时间表示的截止时间，可以写入任务队列在进程之间传递。"""
+
+    def __init__(self, seconds: float = None, expires_at: float = None):
+        if expires_at is None:
+            expires_at = time.time() + (seconds if seconds is not None else config.REQUEST_DEADLINE_SECONDS)
+        self.expires_at = expires_at
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.time())
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def budget(self, stage: str) -> float:
+        return min(config.STAGE_TIMEOUTS[stage], self.remaining())
+
+    def can_afford(self, stage: str) -> bool:
+        """可跳过的阶段在预算低于最小值时直接跳过，不值得发起调用。"""
+        return self.budget(stage) >= config.DEADLINE_MIN_STAGE_SECONDS
+
+
+def record_breach(stage: str):
+    metrics.increment("deadline_breaches", stage=stage)
+
+
+def record_degradation(stage: str, action: str):
+    metrics.increment("deadline_degradations", stage=stage, action=action)
+
+
+# 非流式调用（润色、OCR、文本提取）在线程池中执行，调用方只等待到预算用完
+_executor = ThreadPoolExecutor(max_workers=config.DEADLINE_EXECUTOR_WORKERS, thread_name_prefix="deadline")
+
+
+def call_within(fn: Callable, timeout: float, stage: str, *args, **kwargs):
+    """在 timeout 秒内执行 fn，超时抛出 DeadlineExceeded。
+
+    超时的调用无法强制终止，会在后台线程中自行结束，结果被丢弃。
+    """
+    started = time.monotonic()
+    future = _executor.submit(fn, *args, **kwargs)
+    try:
+        return future.result(timeout=max(timeout, 0))
+    except FutureTimeoutError:
+        record_breach(stage)
+        raise DeadlineExceeded(stage)
+    finally:
+        metrics.observe("stage_seconds", time.monotonic() - started, stage=stage)
+
+
+class Upstream:
+    """上游 HTTP 流的关闭句柄。
+
+    流式生成器内部建立连接后用 attach 登记关闭函数（如 OpenAI Stream.close）；iter_within 超时
+    或调用方提前停止时调用 close，在调用方线程中直接关闭连接，使阻塞在读取上的后台线程立即退出。
+    close 之后才建立的连接在登记时立即关闭。
+    """
+
+    def __init__(self):
+        self._close = None
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def attach(self, close: Callable[[], None]):
+        with self._lock:
+            closed = self._closed
+            if not closed:
+                self._close = close
+        if closed:
+            _quietly(close)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            close, self._close = self._close, None
+        if close is not None:
+            _quietly(close)
+
+
+def _quietly(close: Callable[[], None]):
+    try:
+        close()
+    except Exception as e:
+        print(f"⚠️ 关闭上游连接失败: {e}")
+
+
+_END = object()
+
+
+def iter_within(stream: Iterable, timeout: float, stage: str, idle_timeout: float = None,
+                close: Callable[[], None] = None) -> Iterator:
+    """带超时地迭代上游流式响应。
+
+    timeout 为整个阶段的预算，idle_timeout 为两次分片之间允许的最长间隔（防止流式连接停滞）。
+    上游由后台线程读取；超时或调用方提前停止时，后台线程还没有结束的话，调用 close（通常是
+    Upstream.close）关闭上游连接。未传入 close 时，stream 不是生成器（如 OpenAI Stream）则调用
+    它自己的 close；生成器正在后台线程中执行，无法从其他线程关闭，只能等它读到下一个分片。
+    """
+    idle_timeout = idle_timeout if idle_timeout is not None else config.STREAM_IDLE_TIMEOUT
+    if close is None and not inspect.isgenerator(stream):
+        close = getattr(stream, "close", None)
+    chunks = queue.Queue()
+    stop = threading.Event()
+    finished = threading.Event()
+
+    def pump():
+        iterator = iter(stream)
+        try:
+            for chunk in iterator:
+                if stop.is_set():
+                    break
+                chunks.put(chunk)
+        except BaseException as e:
+            chunks.put(e)
+        finally:
+            close_iterator = getattr(iterator, "close", None)
+            if close_iterator is not None:
+                close_iterator()
+            finished.set()
+            chunks.put(_END)
+
+    started = time.monotonic()
+    ends_at = started + max(timeout, 0)
+    threading.Thread(target=pump, name=f"stream-{stage}", daemon=True).start()
+    try:
+        while True:
+            wait = min(ends_at - time.monotonic(), idle_timeout)
+            try:
+                item = chunks.get(timeout=max(wait, 0))
+            except queue.Empty:
+                record_breach(stage)
+                raise DeadlineExceeded(stage)
+            if item is _END:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        if close is not None and not finished.is_set():
+            _quietly(close)
+        metrics.observe("stage_seconds", time.monotonic() - started, stage=stage)
+
+
+def shrink_messages(messages: list, keep_last: int = None) -> list:
+    """保留系统提示词和最近的若干条消息，缩短律师调用的上下文。"""
+    keep_last = keep_last or config.DEADLINE_SHRINK_KEEP_MESSAGES
+    if len(messages) <= keep_last + 1:
+        return messages
+    head = messages[:1] if messages and messages[0].get("role") == "system" else []
+    return head + messages[-keep_last:]
@@ -0,0 +1,35 @@
+"""本地句向量模型。
+
+基于 sentence-transformers，进程内只加载一次；输出已归一化的 float32 向量，
+可直接用 FAISS 内积索引计算余弦相似度。
+"""
+import threading
+from typing import List
+
+import numpy as np
+
+import config
+
+_encoder = None
+_encoder_lock = threading.Lock()
+
+
+def get_encoder():
+    global _encoder
+    if _encoder is None:
+        with _encoder_lock:
+            if _encoder is None:
+                from sentence_transformers import SentenceTransformer
+                _encoder = SentenceTransformer(config.EMBEDDING_MODEL, device="cpu")
+    return _encoder
+
+
+def encode(texts: List[str], batch_size: int = 32) -> np.ndarray:
+    vectors = get_encoder().encode(
+        texts,
+        batch_size=batch_size,
+        normalize_embeddings=True,
+        convert_to_numpy=True,
+        show_progress_bar=False,
+    )
+    return np.ascontiguousarray(vectors, dtype=np.float32)
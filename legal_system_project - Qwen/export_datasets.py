@@ -0,0 +1,368 @@
+"""把咨询对话和案例报告批量导出为列式数据（Parquet / Arrow），用于构建训练集和评测集。
+
+- 并行扫描：conversation_datasets/（旧版 JSON 文件与 JSONL 分片）和 case_analysis_results/*.json
+  在进程池中解析，主进程按文件顺序依次接收结果并分批写出
+- 行格式：每轮对话一行，附带所属咨询的案件类型、系统提示词 ID 以及报告三部分的正文
+- 去重：按用户发言的字符 shingle 计算 MinHash，用 LSH 分桶找候选，估计相似度达到
+  EXPORT_DEDUP_THRESHOLD 的咨询只保留最先出现的一条（被丢弃的一条可以补全保留项缺失的字段）
+- 增量：输出目录中的 manifest.json 记录已处理的文件（分片记录已处理的行数）和已保留咨询的
+  MinHash，下次运行只处理新增内容，并与历史数据一起去重；每次运行写出一组新的 part 文件
+
+已导出的 JSON 文件视为不可变；分片只会追加，因此按行数续读。
+
+    python export_datasets.py --out dataset_exports --format parquet --workers 8
+"""
+import argparse
+import glob
+import json
+import os
+import re
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import numpy as np
+
+import config
+import dataset_writer
+from report_parser import SECTION_TITLES
+from transcript import role_label
+
+MANIFEST_FILE = "manifest.json"
+SIGNATURES_FILE = "minhash.npy"
+SECTION_COLUMNS = {"案情分析": "section_analysis", "当前应对方案": "section_response_plan",
+                   "维权与赔偿方案": "section_remedies"}
+_TURN_SPLIT_PATTERN = re.compile(r'\n\n(?=(?:用户|律师): )')
+_MERSENNE_PRIME = (1 << 31) - 1
+
+
+# ---- MinHash / LSH ----
+
+def _permutations(num_perm: int):
+    rng = np.random.RandomState(20250815)
+    a = rng.randint(1, _MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+    b = rng.randint(0, _MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+    return a, b
+
+
+def minhash(text: str, num_perm: int = None, shingle_chars: int = None) -> np.ndarray:
+    num_perm = num_perm or config.EXPORT_MINHASH_PERMUTATIONS
+    shingle_chars = shingle_chars or config.EXPORT_SHINGLE_CHARS
+    text = re.sub(r'\s+', '', text)
+    shingles = {text[i:i + shingle_chars] for i in range(max(1, len(text) - shingle_chars + 1))}
+    hashes = np.fromiter((zlib.crc32(s.encode('utf-8')) & _MERSENNE_PRIME for s in shingles),
+                         dtype=np.uint64, count=len(shingles))
+    a, b = _permutations(num_perm)
+    # a、x 均小于 2^31，乘积不会溢出 uint64
+    return ((np.outer(hashes, a) + b) % _MERSENNE_PRIME).min(axis=0).astype(np.uint32)
+
+
+class MinHashLSH:
+    def __init__(self, bands: int = None, threshold: float = None):
+        self.bands = bands or config.EXPORT_LSH_BANDS
+        self.threshold = threshold or config.EXPORT_DEDUP_THRESHOLD
+        self.ids: List[str] = []
+        self.signatures: List[np.ndarray] = []
+        self._buckets: Dict[tuple, List[int]] = {}
+
+    def _band_keys(self, signature: np.ndarray):
+        rows = len(signature) // self.bands
+        for band in range(self.bands):
+            yield band, signature[band * rows:(band + 1) * rows].tobytes()
+
+    def find_duplicate(self, signature: np.ndarray) -> Optional[str]:
+        candidates = set()
+        for key in self._band_keys(signature):
+            candidates.update(self._buckets.get(key, ()))
+        for index in sorted(candidates):
+            if np.mean(self.signatures[index] == signature) >= self.threshold:
+                return self.ids[index]
+        return None
+
+    def add(self, consultation_id: str, signature: np.ndarray):
+        index = len(self.ids)
+        self.ids.append(consultation_id)
+        self.signatures.append(signature)
+        for key in self._band_keys(signature):
+            self._buckets.setdefault(key, []).append(index)
+
+
+# ---- 解析（在 worker 进程中执行） ----
+
+def _case_type_name(case_type) -> Optional[str]:
+    if case_type in config.CASE_TYPES:
+        return config.CASE_TYPES[case_type]["name"]
+    return case_type or None
+
+
+def _consultation(consultation_id, source, created_at, turns, case_type=None, system_prompt=None,
+                  prompt_id=None, sections=None, analysis_tier=None):
+    if system_prompt and not prompt_id:
+        prompt_id = dataset_writer.prompt_id(system_prompt)
+    user_text = "\n".join(text for role, text in turns if role == "human")
+    return {
+        "consultation_id": consultation_id,
+        "source": source,
+        "created_at": created_at,
+        "case_type": _case_type_name(case_type),
+        "prompt_id": prompt_id,
+        "system_prompt": system_prompt,
+        "sections": {title: (sections or {}).get(title) for title in SECTION_TITLES},
+        "analysis_tier": analysis_tier,
+        "turns": turns,
+        "signature": minhash(user_text) if user_text else None,
+    }
+
+
+def _from_sharegpt(record, consultation_id, source, created_at):
+    turns = [("human" if m.get("from") == "human" else "gpt", m.get("value", ""))
+             for m in record.get("conversations", [])]
+    return _consultation(consultation_id, source, record.get("created_at", created_at), turns,
+                         record.get("case_type"), record.get("system_prompt"), record.get("prompt_id"))
+
+
+def _from_report(report, consultation_id, source, created_at):
+    turns = []
+    for part in _TURN_SPLIT_PATTERN.split(report.get("conversation") or ""):
+        label, _, text = part.partition(": ")
+        turns.append(("human" if label == role_label("user") else "gpt", text.strip()))
+    return _consultation(consultation_id, source, created_at, turns, report.get("case_type"),
+                         sections=report.get("analysis_sections"), analysis_tier=report.get("analysis_tier"))
+
+
+_prompt_cache: Dict[str, Dict[str, str]] = {}
+
+
+def _shard_prompts(directory: str) -> Dict[str, str]:
+    # 每个 worker 进程只读取一次提示词旁表
+    if directory not in _prompt_cache:
+        _prompt_cache[directory] = dataset_writer.load_prompts(directory)
+    return _prompt_cache[directory]
+
+
+def scan_file(task) -> dict:
+    """解析一个文件。task 为 (类型, 路径, 跳过的分片行数)；返回解析出的咨询和分片已读行数。"""
+    kind, path, skip = task
+    source = os.path.basename(path)
+    created_at = os.path.getmtime(path)
+    consultations = []
+    lines = 0
+    try:
+        if kind == "shard":
+            prompts = _shard_prompts(os.path.dirname(path))
+            for line in dataset_writer._read_lines(path):
+                lines += 1
+                if lines <= skip or not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # 仍在写入的最后一行，下次运行再读
+                    lines -= 1
+                    break
+                record["system_prompt"] = prompts.get(record.get("prompt_id"))
+                consultations.append(_from_sharegpt(record, record["id"], source, created_at))
+            return {"consultations": consultations, "lines": lines}
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        stem = os.path.splitext(source)[0]
+        if kind == "report":
+            consultations = [_from_report(data, stem, source, created_at)]
+        else:
+            records = data if isinstance(data, list) else [data]
+            consultations = [_from_sharegpt(record, f"{stem}#{i}", source, created_at) for i, record in enumerate(records)]
+    except Exception as e:
+        print(f"⚠️ 解析失败，已跳过 {path}: {e}")
+    return {"consultations": consultations, "lines": lines}
+
+
+# ---- 增量状态与写出 ----
+
+class _PartWriter:
+    """把行按批写入一个 part 文件（Parquet 或 Arrow IPC）。"""
+
+    def __init__(self, path: str, fmt: str):
+        import pyarrow as pa
+        self._pa = pa
+        self.path = path
+        self.fmt = fmt
+        self.rows = 0
+        self._writer = None
+
+    def write(self, rows: List[dict]):
+        if not rows:
+            return
+        pa = self._pa
+        table = pa.Table.from_pylist(rows, schema=_row_schema(pa))
+        if self._writer is None:
+            if self.fmt == "parquet":
+                import pyarrow.parquet as pq
+                self._writer = pq.ParquetWriter(self.path, table.schema, compression="zstd")
+            else:
+                self._writer = pa.ipc.new_file(self.path, table.schema)
+        self._writer.write_table(table)
+        self.rows += len(rows)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+
+def _row_schema(pa):
+    fields = [
+        ("consultation_id", pa.string()), ("source", pa.string()), ("created_at", pa.float64()),
+        ("case_type", pa.dictionary(pa.int16(), pa.string())), ("prompt_id", pa.dictionary(pa.int32(), pa.string())),
+        ("turn_index", pa.int32()), ("role", pa.dictionary(pa.int8(), pa.string())), ("text", pa.string()),
+    ]
+    fields += [(column, pa.string()) for column in SECTION_COLUMNS.values()]
+    fields.append(("analysis_tier", pa.dictionary(pa.int8(), pa.string())))
+    return pa.schema(fields)
+
+
+def _rows(consultation) -> List[dict]:
+    sections = {SECTION_COLUMNS[title]: text for title, text in consultation["sections"].items()}
+    return [{
+        "consultation_id": consultation["consultation_id"],
+        "source": consultation["source"],
+        "created_at": consultation["created_at"],
+        "case_type": consultation["case_type"],
+        "prompt_id": consultation["prompt_id"],
+        "turn_index": index,
+        "role": role,
+        "text": text,
+        **sections,
+        "analysis_tier": consultation["analysis_tier"],
+    } for index, (role, text) in enumerate(consultation["turns"])]
+
+
+def _merge_missing(kept, duplicate):
+    for key in ("case_type", "prompt_id", "system_prompt", "analysis_tier"):
+        if not kept[key] and duplicate[key]:
+            kept[key] = duplicate[key]
+    for title, text in duplicate["sections"].items():
+        if not kept["sections"].get(title) and text:
+            kept["sections"][title] = text
+
+
+def _load_state(out_dir: str):
+    manifest = {"files": {}, "ids": [], "prompts": []}
+    path = os.path.join(out_dir, MANIFEST_FILE)
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    lsh = MinHashLSH()
+    signatures_path = os.path.join(out_dir, SIGNATURES_FILE)
+    if manifest["ids"] and os.path.exists(signatures_path):
+        for consultation_id, signature in zip(manifest["ids"], np.load(signatures_path)):
+            lsh.add(consultation_id, signature)
+    return manifest, lsh
+
+
+def _save_state(out_dir: str, manifest: dict, lsh: MinHashLSH):
+    manifest["ids"] = lsh.ids
+    if lsh.signatures:
+        np.save(os.path.join(out_dir, SIGNATURES_FILE), np.stack(lsh.signatures))
+    temp_path = os.path.join(out_dir, f"{MANIFEST_FILE}.tmp")
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(temp_path, os.path.join(out_dir, MANIFEST_FILE))
+
+
+def _pending_tasks(manifest, datasets_dir: str, reports_dir: str):
+    """返回本次需要处理的 (任务, manifest 条目)。报告排在前面，使带报告的咨询优先被保留。"""
+    tasks = []
+    sources = [("report", path) for path in sorted(glob.glob(os.path.join(reports_dir, "*.json")))]
+    sources += [("dataset", path) for path in sorted(glob.glob(os.path.join(datasets_dir, "*.json")))]
+    sources += [("shard", path) for path in sorted(glob.glob(os.path.join(datasets_dir, dataset_writer.SHARD_PATTERN)))]
+    for kind, path in sources:
+        key = os.path.abspath(path)
+        previous = manifest["files"].get(key)
+        if kind != "shard":
+            if previous is None:
+                tasks.append(((kind, path, 0), {}))
+            continue
+        size = os.path.getsize(path)
+        if previous is None or previous.get("size") != size:
+            tasks.append(((kind, path, (previous or {}).get("lines", 0)), {"size": size}))
+    return tasks
+
+
+def export(datasets_dir: str, reports_dir: str, out_dir: str, fmt: str = "parquet",
+           workers: int = None, batch_consultations: int = 500) -> dict:
+    os.makedirs(out_dir, exist_ok=True)
+    manifest, lsh = _load_state(out_dir)
+    tasks = _pending_tasks(manifest, datasets_dir, reports_dir)
+    stats = {"files": len(tasks), "consultations": 0, "duplicates": 0, "rows": 0}
+    if not tasks:
+        return stats
+
+    run_id = datetime.now().strftime('%Y%m%d_%H%M%S')
+    extension = "parquet" if fmt == "parquet" else "arrow"
+    writer = _PartWriter(os.path.join(out_dir, f"turns-{run_id}.{extension}"), fmt)
+    known_prompts = set(manifest["prompts"])
+    new_prompts = []
+    pending: Dict[str, dict] = {}
+
+    def flush():
+        rows = [row for consultation in pending.values() for row in _rows(consultation)]
+        writer.write(rows)
+        for consultation in pending.values():
+            if consultation["prompt_id"] and consultation["prompt_id"] not in known_prompts and consultation["system_prompt"]:
+                known_prompts.add(consultation["prompt_id"])
+                new_prompts.append({"prompt_id": consultation["prompt_id"], "text": consultation["system_prompt"]})
+        pending.clear()
+
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers or config.EXPORT_WORKERS) as pool:
+        results = pool.map(scan_file, [task for task, _ in tasks], chunksize=8)
+        for (task, entry), result in zip(tasks, results):
+            for consultation in result["consultations"]:
+                stats["consultations"] += 1
+                signature = consultation.pop("signature")
+                duplicate_of = lsh.find_duplicate(signature) if signature is not None else None
+                if duplicate_of is not None:
+                    stats["duplicates"] += 1
+                    if duplicate_of in pending:
+                        _merge_missing(pending[duplicate_of], consultation)
+                    continue
+                if signature is not None:
+                    lsh.add(consultation["consultation_id"], signature)
+                pending[consultation["consultation_id"]] = consultation
+            if len(pending) >= batch_consultations:
+                flush()
+            kind, path, _ = task
+            if kind == "shard":
+                entry["lines"] = result["lines"]
+            manifest["files"][os.path.abspath(path)] = entry
+    flush()
+    writer.close()
+
+    if new_prompts:
+        import pyarrow as pa
+        table = pa.Table.from_pylist(new_prompts)
+        if fmt == "parquet":
+            import pyarrow.parquet as pq
+            pq.write_table(table, os.path.join(out_dir, f"prompts-{run_id}.parquet"))
+        else:
+            with pa.ipc.new_file(os.path.join(out_dir, f"prompts-{run_id}.arrow"), table.schema) as f:
+                f.write_table(table)
+    manifest["prompts"] = sorted(known_prompts)
+    _save_state(out_dir, manifest, lsh)
+    stats["rows"] = writer.rows
+    stats["seconds"] = round(time.perf_counter() - started, 2)
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="导出咨询对话和案例报告为列式数据")
+    parser.add_argument("--datasets", default=config.DATASET_DIR)
+    parser.add_argument("--reports", default="case_analysis_results")
+    parser.add_argument("--out", default=config.EXPORT_DIR)
+    parser.add_argument("--format", choices=["parquet", "arrow"], default="parquet")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    result = export(args.datasets, args.reports, args.out, args.format, args.workers)
+    print(json.dumps(result, ensure_ascii=False))
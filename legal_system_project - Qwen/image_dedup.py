@@ -0,0 +1,86 @@
+"""多图上传的 OCR 前筛选：跳过重复和空白的图片。
+
+手机上传合同时，同一页拍了两次、连拍的几乎相同的照片都很常见，而 OCR 是最耗 CPU 的环节。
+这里先把每张图片缩小后计算感知哈希（16x16 差值哈希，256 位）：
+- 与此前保留的某张图片哈希距离不超过 IMAGE_DUPLICATE_MAX_DISTANCE 时视为重复，不再识别
+- 边缘像素比例低于 IMAGE_BLANK_EDGE_RATIO 的图片（空白页、拍到桌面等）可能是空白页；传入 OCR Reader 时
+  再运行一次文本检测，确实没有文本框才视为空白，不再识别。只有“甲方（盖章）/ 日期：”几行字的签署页
+  边缘比例也很低，不能只凭边缘比例跳过
+
+只覆盖“整张几乎相同”的情况；同一页拍了几张互相重叠的照片时，各自仍会识别，
+重叠部分在文本层面由 text_normalizer 合并。无法解码的图片照常交给 OCR，由其报告错误。
+"""
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+import config
+
+_HASH_SIZE = 16
+# 宽高比相差超过该比例的图片不比较哈希（横拍和竖拍的同一页也不算重复）
+_MAX_ASPECT_DIFF = 0.15
+
+
+def _load_gray(path: str) -> Optional[np.ndarray]:
+    data = np.fromfile(path, dtype=np.uint8)
+    # 只用于计算哈希和边缘比例，按 1/4 尺寸解码即可
+    return cv2.imdecode(data, cv2.IMREAD_REDUCED_GRAYSCALE_4)
+
+
+def difference_hash(gray: np.ndarray) -> np.ndarray:
+    resized = cv2.resize(gray, (_HASH_SIZE + 1, _HASH_SIZE), interpolation=cv2.INTER_AREA)
+    return (resized[:, 1:] > resized[:, :-1]).flatten()
+
+
+def edge_ratio(gray: np.ndarray) -> float:
+    edges = cv2.Canny(cv2.GaussianBlur(gray, (3, 3), 0), 50, 150)
+    return float(np.count_nonzero(edges)) / max(edges.size, 1)
+
+
+def has_text(reader, path: str) -> bool:
+    """用 Reader 的文本检测模型判断图片上是否有文本框。检测失败时按有文本处理。"""
+    try:
+        image = cv2.imdecode(np.fromfile(path, dtype=np.uint8), cv2.IMREAD_COLOR)
+        horizontal_list, free_list = reader.detect(image)
+    except Exception as e:
+        print(f"\n⚠️ 空白页检测失败 [{path}]: {str(e)}")
+        return True
+    return bool(horizontal_list[0] or free_list[0])
+
+
+def select_images(paths: List[str], reader=None) -> Tuple[List[str], List[Dict]]:
+    """返回 (需要识别的图片, 跳过的图片)。跳过项为 {"path", "reason": "duplicate" | "blank", "duplicate_of"}。
+
+    传入 reader 时，边缘比例过低的图片经文本检测确认没有文字后才作为空白页跳过。
+    """
+    kept, skipped = [], []
+    fingerprints = []  # (path, hash, aspect)
+    for path in paths:
+        try:
+            gray = _load_gray(path)
+        except Exception:
+            gray = None
+        if gray is None or gray.size == 0:
+            kept.append(path)
+            continue
+
+        if edge_ratio(gray) < config.IMAGE_BLANK_EDGE_RATIO and (reader is None or not has_text(reader, path)):
+            skipped.append({"path": path, "reason": "blank", "duplicate_of": None})
+            continue
+
+        bits = difference_hash(gray)
+        aspect = gray.shape[1] / gray.shape[0]
+        duplicate_of = None
+        for other_path, other_bits, other_aspect in fingerprints:
+            if abs(aspect - other_aspect) / other_aspect > _MAX_ASPECT_DIFF:
+                continue
+            if np.count_nonzero(bits != other_bits) <= config.IMAGE_DUPLICATE_MAX_DISTANCE:
+                duplicate_of = other_path
+                break
+        if duplicate_of:
+            skipped.append({"path": path, "reason": "duplicate", "duplicate_of": duplicate_of})
+            continue
+        fingerprints.append((path, bits, aspect))
+        kept.append(path)
+    return kept, skipped
@@ -0,0 +1,54 @@
+"""进程内运行指标：计数器和数值分布（延迟、排队时间等）。
+
+指标名可以带标签，例如 increment("cancelled_calls", kind="lawyer")，
+snapshot() 返回当前所有指标，HTTP 接口的 /api/metrics 直接输出它（需要管理员令牌）。
+"""
+import threading
+from collections import defaultdict, deque
+
+# 每个分布只保留最近的若干个观测值，用于计算分位数
+_MAX_OBSERVATIONS = 2000
+
+_lock = threading.Lock()
+_counters = defaultdict(float)
+_observations = defaultdict(lambda: deque(maxlen=_MAX_OBSERVATIONS))
+
+
+def _key(name, labels):
+    if not labels:
+        return name
+    return name + "{" + ",".join(f"{k}={labels[k]}" for k in sorted(labels)) + "}"
+
+
+def increment(name: str, value: float = 1, **labels):
+    with _lock:
+        _counters[_key(name, labels)] += value
+
+
+def observe(name: str, value: float, **labels):
+    with _lock:
+        _observations[_key(name, labels)].append(value)
+
+
+def _percentile(values, pct):
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def snapshot() -> dict:
+    with _lock:
+        counters = dict(_counters)
+        observations = {key: sorted(values) for key, values in _observations.items() if values}
+    return {
+        "counters": counters,
+        "distributions": {
+            key: {
+                "count": len(values),
+                "p50": _percentile(values, 50),
+                "p95": _percentile(values, 95),
+                "p99": _percentile(values, 99),
+                "max": values[-1],
+            }
+            for key, values in observations.items()
+        },
+    }
@@ -0,0 +1,189 @@
+"""批量重新生成案例报告。
+
+修改报告提示词或更换 CASE_ANALYSIS_MODEL / 分析档位后，用新版本为 conversation_datasets/ 中
+保存的全部咨询重新生成报告：
+- 报告版本号由提示词模板（去掉其中的当前时间）和所用档位的模型配置计算，配置不变版本号就不变
+- 对话内容按哈希去重：同一段对话只生成一次；该版本下已有结果的对话直接跳过，中断后重新运行即可续跑
+- 线程池限制并发，每次调用按 batch 优先级经调度器排队，不占用为在线聊天保留的额度
+- 结果写在数据集旁边：conversation_datasets/reports/<版本号>/<对话哈希>.json，格式与
+  case_analysis_results/ 相同；index.jsonl 记录数据集记录与对话哈希的对应关系
+- 运行中定期输出吞吐量和失败率，结束时追加一条运行记录到 runs.jsonl
+
+不使用相似案例检索，避免新报告直接复用旧版本的结论。
+
+    python regenerate_reports.py --tier full --concurrency 8
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from typing import Dict, List
+
+import config
+import dataset_writer
+from report_parser import CaseReportSectionParser
+from transcript import CaseTranscript
+
+_TIMESTAMP_PATTERN = re.compile(r'\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}')
+
+
+def report_version(generator, tier: str) -> str:
+    """提示词模板与模型配置的哈希。"""
+    template = _TIMESTAMP_PATTERN.sub("<time>", generator.build_case_analysis_prompt("<conversation>"))
+    tier_config = json.dumps(config.CASE_ANALYSIS_TIERS[tier], sort_keys=True)
+    return hashlib.sha256(f"{template}\x00{tier}\x00{tier_config}".encode('utf-8')).hexdigest()[:12]
+
+
+def collect_inputs(dataset_dir: str, limit: int = None) -> List[Dict]:
+    """按对话内容哈希去重后的待处理对话，保留每段对话对应的全部数据集记录。"""
+    inputs: Dict[str, Dict] = {}
+    for index, record in enumerate(dataset_writer.iter_conversations(dataset_dir)):
+        transcript = CaseTranscript.from_sharegpt(record)
+        if not transcript.text:
+            continue
+        source = record.get("id") or f"conversation_{index}"
+        entry = inputs.setdefault(transcript.content_hash, {
+            "content_hash": transcript.content_hash,
+            "conversation": transcript.text,
+            "transcript_tokens": transcript.token_count,
+            "case_type": config.CASE_TYPES.get(record.get("case_type"), {}).get("name", "未知类型"),
+            "sources": [],
+        })
+        entry["sources"].append(source)
+        if limit and len(inputs) >= limit:
+            break
+    return list(inputs.values())
+
+
+def _write_json(path: str, data: Dict):
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(temp_path, path)
+
+
+class _Progress:
+    def __init__(self, total: int):
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self.tokens = 0
+        self.started = time.time()
+        self._lock = threading.Lock()
+
+    def record(self, ok: bool, tokens: int):
+        with self._lock:
+            self.done += 1
+            self.failed += 0 if ok else 1
+            self.tokens += tokens
+            if self.done % 10 == 0 or self.done == self.total:
+                print(self.line())
+
+    def line(self) -> str:
+        elapsed = max(time.time() - self.started, 1e-6)
+        return (f"进度 {self.done}/{self.total}，约 {self.done / elapsed * 3600:.0f} 份/小时，"
+                f"失败率 {self.failed / max(self.done, 1):.1%}，已用 token {self.tokens}")
+
+    def summary(self) -> Dict:
+        elapsed = time.time() - self.started
+        return {
+            "processed": self.done,
+            "failed": self.failed,
+            "error_rate": round(self.failed / self.done, 4) if self.done else 0.0,
+            "tokens": self.tokens,
+            "seconds": round(elapsed, 1),
+            "reports_per_hour": round(self.done / elapsed * 3600, 1) if elapsed > 0 else None,
+        }
+
+
+def regenerate_one(generator, item: Dict, tier: str, version: str, output_path: str) -> Dict:
+    stats = {}
+    parser = CaseReportSectionParser()
+    error = None
+    try:
+        for delta in generator.generate_case_analysis_stream(
+            item["conversation"], tier=tier, transcript_tokens=item["transcript_tokens"],
+            stats=stats, case_type=item["case_type"], priority="batch"
+        ):
+            parser.feed(delta)
+            if parser.should_stop():
+                break
+    except Exception as e:
+        error = str(e)
+    parser.finish()
+    tokens = (stats.get("prompt_tokens") or 0) + (stats.get("completion_tokens") or 0)
+    if error is not None or not parser.complete:
+        return {"ok": False, "error": error or "报告结构不完整", "tokens": tokens}
+    _write_json(output_path, {
+        "timestamp": datetime.now().strftime('%Y%m%d_%H%M%S'),
+        "case_type": item["case_type"],
+        "conversation": item["conversation"],
+        "conversation_hash": item["content_hash"],
+        "conversation_tokens": item["transcript_tokens"],
+        "case_analysis": parser.report_text,
+        "analysis_sections": parser.sections,
+        "status": "complete",
+        "analysis_tier": stats.get("tier"),
+        "analysis_model": stats.get("model"),
+        "report_version": version,
+        "usage": {key: stats.get(key) for key in ("prompt_tokens", "completion_tokens", "reasoning_tokens")},
+    })
+    return {"ok": True, "error": None, "tokens": tokens}
+
+
+def run(dataset_dir: str, tier: str, concurrency: int = None, limit: int = None, dry_run: bool = False) -> Dict:
+    from services import CaseAnalysisGenerator
+
+    generator = CaseAnalysisGenerator()
+    version = report_version(generator, tier)
+    out_dir = os.path.join(dataset_dir, "reports", version)
+    os.makedirs(out_dir, exist_ok=True)
+
+    inputs = collect_inputs(dataset_dir, limit)
+    pending = [item for item in inputs if not os.path.exists(os.path.join(out_dir, f"{item['content_hash']}.json"))]
+    print(f"报告版本 {version}（{tier} / {config.CASE_ANALYSIS_TIERS[tier]['model']}）："
+          f"去重后 {len(inputs)} 段对话，已有结果 {len(inputs) - len(pending)} 段，本次生成 {len(pending)} 段")
+
+    with open(os.path.join(out_dir, "index.jsonl"), 'w', encoding='utf-8') as f:
+        for item in inputs:
+            f.write(json.dumps({"content_hash": item["content_hash"], "sources": item["sources"]}, ensure_ascii=False) + "\n")
+    if dry_run or not pending:
+        return {"version": version, "pending": len(pending)}
+
+    progress = _Progress(len(pending))
+    failures = []
+    with ThreadPoolExecutor(max_workers=concurrency or config.REGENERATE_REPORTS_CONCURRENCY) as pool:
+        futures = {
+            pool.submit(regenerate_one, generator, item, tier, version,
+                        os.path.join(out_dir, f"{item['content_hash']}.json")): item
+            for item in pending
+        }
+        for future in as_completed(futures):
+            result = future.result()
+            progress.record(result["ok"], result["tokens"])
+            if not result["ok"]:
+                failures.append({"content_hash": futures[future]["content_hash"], "error": result["error"]})
+
+    summary = {"version": version, "tier": tier, "finished_at": datetime.now().isoformat(),
+               **progress.summary(), "failures": failures[:50]}
+    with open(os.path.join(out_dir, "runs.jsonl"), 'a', encoding='utf-8') as f:
+        f.write(json.dumps(summary, ensure_ascii=False) + "\n")
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="批量重新生成案例报告")
+    parser.add_argument("--datasets", default=config.DATASET_DIR)
+    parser.add_argument("--tier", default=config.CASE_ANALYSIS_DEFAULT_TIER, choices=list(config.CASE_ANALYSIS_TIERS))
+    parser.add_argument("--concurrency", type=int, default=None)
+    parser.add_argument("--limit", type=int, default=None, help="最多处理的（去重后）对话数")
+    parser.add_argument("--dry-run", action="store_true", help="只统计待生成的数量")
+    args = parser.parse_args()
+
+    result = run(args.datasets, args.tier, args.concurrency, args.limit, args.dry_run)
+    print(json.dumps({k: v for k, v in result.items() if k != "failures"}, ensure_ascii=False))
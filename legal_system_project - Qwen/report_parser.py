@@ -0,0 +1,104 @@
+"""案例分析报告的流式分段解析。
+
+报告固定由【案情分析】【当前应对方案】【维权与赔偿方案】三部分组成。解析器随模型输出逐块
+识别段落边界，每完成一个部分就立即交给界面和存储；三部分都完成后即可提前结束生成。
+"""
+import re
+from typing import List, Tuple
+
+import config
+
+SECTION_TITLES = ("案情分析", "当前应对方案", "维权与赔偿方案")
+
+_HEADER_PATTERN = re.compile(r'【(案情分析|当前应对方案|维权与赔偿方案)】')
+# 标题最长为“【维权与赔偿方案】”，扫描时回退这么多字符，避免漏掉跨 chunk 的标题
+_MAX_HEADER_LENGTH = max(len(title) for title in SECTION_TITLES) + 2
+# 模型常在标题两侧加 Markdown 加粗，段落内容里去掉这些残留
+_MARKUP_STRIP = " \n\t*#"
+
+
+class CaseReportSectionParser:
+    """增量解析报告文本，feed() 返回本次新完成的 (标题, 内容) 列表。"""
+
+    def __init__(self, max_chars: int = None):
+        self.max_chars = max_chars or config.CASE_REPORT_MAX_CHARS
+        self.buffer = ""
+        self.sections = {}
+        self._current_title = None
+        self._current_start = 0
+        self._scan_pos = 0
+        self._report_end = None
+
+    @property
+    def complete(self) -> bool:
+        return all(title in self.sections for title in SECTION_TITLES)
+
+    @property
+    def report_text(self) -> str:
+        """报告正文；提前结束时截止到最后一个部分的结尾。"""
+        end = self._report_end if self._report_end is not None else len(self.buffer)
+        return self.buffer[:end].strip()
+
+    def _complete_current(self, end: int) -> List[Tuple[str, str]]:
+        title = self._current_title
+        self._current_title = None
+        content = self.buffer[self._current_start:end].strip(_MARKUP_STRIP)
+        if not content or title in self.sections:
+            return []
+        self.sections[title] = content
+        if self.complete:
+            self._report_end = end
+        return [(title, content)]
+
+    def feed(self, chunk: str) -> List[Tuple[str, str]]:
+        if not chunk or self._report_end is not None:
+            return []
+        self.buffer += chunk
+        completed = []
+
+        for match in _HEADER_PATTERN.finditer(self.buffer, max(self._scan_pos - _MAX_HEADER_LENGTH, self._current_start)):
+            if self._current_title is not None:
+                completed.extend(self._complete_current(match.start()))
+            self._current_title = match.group(1)
+            self._current_start = match.end()
+            self._scan_pos = match.end()
+        self._scan_pos = max(self._scan_pos, len(self.buffer))
+
+        # 最后一个部分后面不会再出现标题：按格式要求每部分只有一个自然段，遇到空行即视为完成
+        if self._current_title is not None and len(self.sections) == len(SECTION_TITLES) - 1:
+            body = self.buffer[self._current_start:]
+            stripped = body.lstrip(_MARKUP_STRIP)
+            blank_line = stripped.find("\n\n")
+            if blank_line > 0:
+                completed.extend(self._complete_current(len(self.buffer) - len(stripped) + blank_line))
+        return completed
+
+    def finish(self) -> List[Tuple[str, str]]:
+        """生成结束（或中断）时调用，收尾最后一个未闭合的部分。"""
+        if self._current_title is None or self._report_end is not None:
+            return []
+        return self._complete_current(len(self.buffer))
+
+    def should_stop(self) -> bool:
+        """三部分齐全，或输出已远超字数上限时，可以停止生成。"""
+        return self.complete or len(self.buffer) > self.max_chars * 2
+
+
+_MARKDOWN_PATTERN = re.compile(r'[*#|]|^\s*-\s', re.MULTILINE)
+
+
+def check_report_structure(text: str, max_chars: int = None) -> dict:
+    """检查报告是否符合提示词中的格式要求，供离线评测使用。"""
+    max_chars = max_chars or config.CASE_REPORT_MAX_CHARS
+    parser = CaseReportSectionParser(max_chars)
+    parser.feed(text)
+    parser.finish()
+    checks = {
+        "has_all_sections": parser.complete,
+        "section_order": [m.group(1) for m in _HEADER_PATTERN.finditer(text)] == list(SECTION_TITLES),
+        "plain_text": not _MARKDOWN_PATTERN.search(text),
+        "within_length": len(text) <= max_chars,
+        "second_person": "您" in text,
+    }
+    checks["compliant"] = all(checks.values())
+    return checks
@@ -0,0 +1,201 @@
+"""案例报告的预测式预生成。
+
+原流程在律师回复全部输出后，才根据“回复中没有问号”判断咨询结束，再从零开始生成报告。
+这里在律师回复仍在流式输出时就估计本轮是否是收尾：
+- 对话轮次：轮次越多越可能结束
+- 当前已输出的回复中是否出现问句：出现问句说明律师还在提问，直接判定为未结束
+- 案件类型清单覆盖率：用户已经提供了多少关键事实（入职时间、工资、证据、诉求等）
+- 收尾用语：律师提示词要求结束时总结已收集的信息并道别（“关键信息都梳理了”“祝您一切顺利”）
+
+判定可能结束时，后台立即用截至用户最新一条消息的对话开始生成报告。律师回复结束后：
+- 确实结束：直接使用（或继续等待）已预生成的报告
+- 对话继续：取消预生成，下一轮满足条件时再以新的对话内容重新生成
+
+律师的收尾回复通常不包含新的案件事实，预生成的报告不包含这一条回复。
+"""
+import threading
+import time
+from typing import Dict, List, Optional
+
+import cancellation
+import config
+import deadlines
+import metrics
+from transcript import CaseTranscript, role_label
+
+COMMON_CHECKLIST = {
+    "用人单位": ["公司", "单位", "老板", "企业"],
+    "入职时间": ["入职", "开始上班", "开始工作", "进公司"],
+    "工作岗位": ["岗位", "职位", "负责", "工作内容", "做的是"],
+    "工资待遇": ["工资", "薪资", "月薪", "底薪", "收入"],
+    "劳动合同": ["合同", "协议"],
+    "社会保险": ["社保", "五险", "保险", "公积金"],
+    "证据材料": ["证据", "聊天记录", "转账", "打卡", "截图", "录音", "工资条", "流水", "通知书"],
+    "用户诉求": ["希望", "想要", "要求", "赔偿", "补偿", "诉求"],
+}
+
+CASE_TYPE_CHECKLISTS = {
+    "1": {"管理从属": ["考勤", "打卡", "管理", "规章", "排班"], "报酬支付": ["发放", "转账", "现金", "发工资"]},
+    "2": {"合同变更或解除": ["变更", "解除", "终止", "续签", "调岗", "降薪"]},
+    "3": {"离职方式": ["辞退", "开除", "辞职", "离职", "解雇", "劝退"], "离职时间": ["最后一天", "通知", "离职时间", "哪天"]},
+    "4": {"工作时间与休假": ["加班", "工时", "休息", "休假", "年假"], "劳动保护": ["培训", "防护", "福利", "职业病"]},
+    "5": {"争议金额": ["拖欠", "克扣", "未发", "没发", "医疗费", "赔偿金", "补偿金", "工伤"]},
+}
+
+
+# 律师收尾时的常见用语。律师每条回复只问一个问题且通常放在末尾，仅凭“暂时没有问号”区分度不高
+CLOSING_CUES = [
+    "关键信息都", "都梳理", "都聊到", "理清楚", "理得差不多", "完整记录", "完全理解",
+    "基本了解", "完成了关键信息", "随时可以", "祝您", "祝你", "再见",
+]
+
+
+def user_text(transcript: CaseTranscript) -> str:
+    """只取用户说的话，避免律师的提问本身被当作已覆盖的事实。"""
+    prefix = role_label('user') + ": "
+    return "\n".join(part for part in transcript.parts if part.startswith(prefix))
+
+
+def checklist_coverage(text: str, case_type: Optional[str]) -> float:
+    checklist = dict(COMMON_CHECKLIST)
+    checklist.update(CASE_TYPE_CHECKLISTS.get(case_type or "", {}))
+    covered = sum(1 for keywords in checklist.values() if any(keyword in text for keyword in keywords))
+    return covered / len(checklist)
+
+
+class EndingPredictor:
+    """估计当前这条律师回复是否是咨询的收尾。"""
+
+    def __init__(self, threshold: float = None, expected_rounds: int = None, min_partial_chars: int = None):
+        self.threshold = threshold if threshold is not None else config.REPORT_PREFETCH_THRESHOLD
+        self.expected_rounds = expected_rounds or config.REPORT_PREFETCH_EXPECTED_ROUNDS
+        self.min_partial_chars = min_partial_chars or config.REPORT_PREFETCH_MIN_PARTIAL_CHARS
+
+    def score(self, rounds: int, partial_reply: str, coverage: float) -> float:
+        if '？' in partial_reply or '?' in partial_reply:
+            return 0.0
+        round_score = min(1.0, rounds / self.expected_rounds)
+        # 输出得越长仍没有问句，越像总结性的收尾
+        partial_score = min(1.0, len(partial_reply) / self.min_partial_chars)
+        cue_score = 1.0 if any(cue in partial_reply for cue in CLOSING_CUES) else 0.0
+        return 0.2 * round_score + 0.3 * coverage + 0.1 * partial_score + 0.4 * cue_score
+
+    def likely(self, rounds: int, partial_reply: str, coverage: float) -> bool:
+        return self.score(rounds, partial_reply, coverage) >= self.threshold
+
+
+class PrefetchedReport:
+    """在后台线程中生成的报告，stream() 可以从头重放已生成的内容并继续等待后续输出。"""
+
+    def __init__(self, key: str, conversation_content: str, transcript_tokens: int, source_factory,
+                 parent_token: Optional[cancellation.CancellationToken] = None):
+        self.key = key
+        self.conversation_content = conversation_content
+        self.transcript_tokens = transcript_tokens
+        self.started_at = time.time()
+        self.stats: Dict = {}
+        # 预生成只服务于启动它的那一轮：该轮被取消（重新开始、再次发送、页面断开）时一起停止
+        self.token = cancellation.CancellationToken(parent=parent_token)
+        # 取消时直接关闭报告的流式连接，后台线程不必等到下一个分片才退出
+        self.upstream = deadlines.Upstream()
+        self.chunks: List[str] = []
+        self.done = False
+        self.error: Optional[Exception] = None
+        self._cond = threading.Condition()
+        self._source = source_factory(self.stats, self.token, self.upstream)
+        threading.Thread(target=self._run, name="report-prefetch", daemon=True).start()
+
+    def _run(self):
+        try:
+            for delta in self._source:
+                with self._cond:
+                    self.chunks.append(delta)
+                    self._cond.notify_all()
+        except Exception as e:
+            self.error = e
+        finally:
+            with self._cond:
+                self.done = True
+                self._cond.notify_all()
+
+    def cancel(self, reason: str = "discarded"):
+        self.token.cancel(reason)
+        self.upstream.close()
+
+    def stream(self):
+        index = 0
+        try:
+            while True:
+                with self._cond:
+                    while index >= len(self.chunks) and not self.done:
+                        self._cond.wait(timeout=0.5)
+                    batch = self.chunks[index:]
+                    index = len(self.chunks)
+                    if not batch:
+                        if self.error is not None:
+                            raise self.error
+                        return
+                yield from batch
+        finally:
+            # 调用方不再需要后续内容（如报告已完整）时停止生成
+            if not self.done:
+                self.cancel("consumer_closed")
+
+
+class ReportPrefetcher:
+    """按用户保存至多一份预生成的报告。"""
+
+    def __init__(self, analyzer):
+        self.analyzer = analyzer
+        self._reports: Dict[str, PrefetchedReport] = {}
+        self._lock = threading.Lock()
+
+    def start(self, user_id: str, key: str, conversation_content: str, transcript_tokens: int = 0, deadline=None,
+              case_type: str = None, cancel_token: Optional[cancellation.CancellationToken] = None):
+        def source_factory(stats, token, upstream):
+            return self.analyzer.generate_case_analysis_stream(
+                conversation_content, transcript_tokens=transcript_tokens,
+                stats=stats, cancel_token=token, deadline=deadline, case_type=case_type, upstream=upstream
+            )
+
+        with self._lock:
+            self._expire_stale()
+            existing = self._reports.get(user_id)
+            if existing is not None and existing.key == key:
+                return existing
+            report = PrefetchedReport(key, conversation_content, transcript_tokens, source_factory, cancel_token)
+            self._reports[user_id] = report
+        if existing is not None:
+            existing.cancel("refreshed")
+            metrics.increment("report_prefetch", outcome="refreshed")
+        metrics.increment("report_prefetch", outcome="started")
+        return report
+
+    def take(self, user_id: str, key: str) -> Optional[PrefetchedReport]:
+        """取出与当前对话内容一致的预生成报告；内容不一致时丢弃。"""
+        with self._lock:
+            report = self._reports.pop(user_id, None)
+        if report is None:
+            return None
+        if report.key != key or (report.done and report.error is not None):
+            report.cancel()
+            metrics.increment("report_prefetch", outcome="discarded")
+            return None
+        metrics.increment("report_prefetch", outcome="used")
+        metrics.observe("report_prefetch_head_start_seconds", time.time() - report.started_at)
+        return report
+
+    def discard(self, user_id: str):
+        """丢弃并停止该用户的预生成报告（对话继续、重新开始或页面断开时）。"""
+        with self._lock:
+            report = self._reports.pop(user_id, None)
+        if report is not None:
+            report.cancel()
+            metrics.increment("report_prefetch", outcome="discarded")
+
+    def _expire_stale(self):
+        # 调用方持有 self._lock；用户离开后（或后续请求落在其他进程上）遗留的报告按超时丢弃
+        now = time.time()
+        for user_id in [u for u, r in self._reports.items() if now - r.started_at > config.REPORT_PREFETCH_TTL]:
+            self._reports.pop(user_id).cancel("expired")
+            metrics.increment("report_prefetch", outcome="expired")
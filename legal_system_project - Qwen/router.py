@@ -0,0 +1,224 @@
+"""意图与案件类型路由。
+
+两级路由：
+1. 关键词快速通道：只保留含义明确、几乎不会误判的关键词（如“合同审查”、数字 1-5），命中即返回
+2. 向量最近邻：启动时用本地句向量模型把示例语句编码一次，建立 FAISS 内积索引；
+   用户输入编码后检索最相近的示例，按标签聚合相似度，低于置信度阈值时不给出结论。
+   未安装 FAISS 时用 numpy 直接计算内积（示例语句只有几十条，结果相同）
+
+向量路由不可用（未安装 sentence-transformers 或模型加载失败）时，create_*_router 返回 None，
+调用方继续使用 app.py 中原有的关键词规则。
+"""
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+import config
+
+INTENT_EXEMPLARS = {
+    "contract_review": [
+        "帮我审查一下劳动合同",
+        "我想让你看看这份合同有没有问题",
+        "公司让我签的合同条款合理吗，帮我检查一下",
+        "我要上传合同文件做合规分析",
+        "这份竞业限制协议能签吗，帮我看看条款",
+        "实习三方协议里面有没有坑",
+        "劳务派遣合同帮我审核一下",
+        "入职前想先检查一下合同内容",
+    ],
+    "legal_knowledge": [
+        "我想了解劳动法的相关法律规定",
+        "什么是无固定期限劳动合同",
+        "经济补偿金在法律上是怎么规定的",
+        "试用期最长可以约定多久",
+        "法律对加班时间有什么限制",
+        "竞业限制的法律规定是什么",
+        "婚姻法里夫妻共同财产怎么认定",
+        "消费者权益保护法有哪些规定",
+        "劳动仲裁的时效是多久",
+    ],
+    "case_strategy": [
+        "公司突然辞退了我，我该怎么办",
+        "老板拖欠我三个月工资不发",
+        "我在工作中受伤了，公司不给报工伤",
+        "公司不给我交社保，我想维权",
+        "我被公司无故开除了，想要赔偿",
+        "天天加班却没有加班费，怎么办",
+        "公司让我主动离职，不给补偿",
+        "我干了两年没签劳动合同，现在被辞退了",
+        "项目结束后公司就不让我来上班了",
+        "我想申请劳动仲裁，帮我分析一下我的情况",
+    ],
+}
+
+CASE_TYPE_EXEMPLARS = {
+    "1": [
+        "我和公司之间到底算不算劳动关系",
+        "没签合同也没交社保，能证明我是公司员工吗",
+        "我是外卖骑手，和平台是不是劳动关系",
+        "公司说我是外包人员不是正式员工",
+    ],
+    "2": [
+        "公司一直不和我签劳动合同",
+        "公司单方面调岗降薪，变更了合同内容",
+        "合同到期公司不续签了",
+        "公司要求我签新的劳动合同，条件变差了",
+    ],
+    "3": [
+        "公司突然辞退了我",
+        "我被开除了，公司说我违反规章制度",
+        "我想辞职但是公司不放人",
+        "公司逼我自己写离职申请",
+        "试用期被公司解雇了",
+    ],
+    "4": [
+        "公司不给我交社保",
+        "每天加班到很晚，周末也不让休息",
+        "年假公司不让休也不给钱",
+        "工作环境有职业危害，公司没有任何防护",
+        "公司让我参加培训然后要我签服务期",
+    ],
+    "5": [
+        "公司拖欠工资好几个月了",
+        "我工伤住院，医疗费公司不管",
+        "离职后公司不给经济补偿金",
+        "加班费一直没有发",
+        "公司克扣我的绩效工资和奖金",
+    ],
+}
+
+INTENT_FAST_PATH = {
+    "contract_review": ["合同审查", "审查合同", "分析合同", "检查合同", "合同合规", "合同条款"],
+    "legal_knowledge": ["法律知识", "法律咨询", "法律规定", "法律条文", "法律概念", "普法"],
+    "case_strategy": ["案件咨询", "案件策略", "我的案子", "劳动仲裁申请", "帮我分析"],
+}
+
+CASE_TYPE_FAST_PATH = {
+    "1": ["确认劳动关系", "是否存在劳动关系", "认定劳动关系"],
+    "2": ["合同变更", "合同解除", "合同终止", "不签合同", "未签合同"],
+    "3": ["辞退", "除名", "被开除", "解雇"],
+    "4": ["年假", "社会保险", "劳动保护"],
+    "5": ["工资拖欠", "拖欠工资", "工伤", "医疗费", "经济补偿"],
+}
+
+
+class RouteResult:
+    def __init__(self, label: Optional[str], confidence: float, source: str):
+        self.label = label
+        self.confidence = confidence
+        # fast_path / embedding / below_threshold
+        self.source = source
+
+    def __repr__(self):
+        return f"RouteResult(label={self.label!r}, confidence={self.confidence:.3f}, source={self.source!r})"
+
+
+def keyword_fast_path(keyword_map: Dict[str, List[str]], exact_labels: List[str] = None) -> Callable[[str], Optional[str]]:
+    """构建快速通道：输入恰好是某个标签（如 "1"）或包含明确关键词时直接返回该标签。"""
+    exact_labels = exact_labels or []
+
+    def match(text: str) -> Optional[str]:
+        stripped = text.strip()
+        if stripped in exact_labels:
+            return stripped
+        for label, keywords in keyword_map.items():
+            if any(keyword in stripped for keyword in keywords):
+                return label
+        return None
+
+    return match
+
+
+class _InnerProductIndex:
+    """未安装 FAISS 时使用的暴力内积检索，接口与 faiss.IndexFlatIP 的 add / search 相同。"""
+
+    def __init__(self, dimension: int):
+        self.vectors = np.zeros((0, dimension), dtype=np.float32)
+
+    def add(self, vectors: np.ndarray):
+        self.vectors = np.vstack([self.vectors, vectors])
+
+    def search(self, queries: np.ndarray, k: int):
+        similarities = queries @ self.vectors.T
+        neighbors = np.argsort(-similarities, axis=1, kind="stable")[:, :k]
+        return np.take_along_axis(similarities, neighbors, axis=1), neighbors
+
+
+def _flat_ip_index(dimension: int):
+    try:
+        import faiss
+    except ImportError:
+        return _InnerProductIndex(dimension)
+    return faiss.IndexFlatIP(dimension)
+
+
+class EmbeddingRouter:
+    """示例语句最近邻路由器。encode 为句向量函数（输出已归一化），默认使用 embeddings.encode。"""
+
+    def __init__(self, exemplars: Dict[str, List[str]], fast_path: Callable[[str], Optional[str]] = None,
+                 threshold: float = None, min_margin: float = None, top_k: int = None,
+                 encode: Callable[[List[str]], np.ndarray] = None):
+        if encode is None:
+            import embeddings
+            encode = embeddings.encode
+
+        self._encode = encode
+        self.fast_path = fast_path
+        self.threshold = threshold if threshold is not None else config.ROUTER_CONFIDENCE_THRESHOLD
+        self.min_margin = min_margin if min_margin is not None else config.ROUTER_MIN_MARGIN
+        self.labels = [label for label, texts in exemplars.items() for _ in texts]
+        vectors = self._encode([text for texts in exemplars.values() for text in texts])
+        self.index = _flat_ip_index(vectors.shape[1])
+        self.index.add(vectors)
+        self.top_k = min(top_k or config.ROUTER_TOP_K, len(self.labels))
+
+    def route_batch(self, texts: List[str]) -> List[RouteResult]:
+        results: List[Optional[RouteResult]] = [None] * len(texts)
+        pending = []
+        for i, text in enumerate(texts):
+            label = self.fast_path(text) if self.fast_path else None
+            if label is not None:
+                results[i] = RouteResult(label, 1.0, "fast_path")
+            else:
+                pending.append(i)
+
+        if pending:
+            # 所有未命中快速通道的输入一次性编码、一次性检索
+            similarities, neighbors = self.index.search(self._encode([texts[i] for i in pending]), self.top_k)
+            for row, i in enumerate(pending):
+                label_scores = {}
+                for similarity, neighbor in zip(similarities[row], neighbors[row]):
+                    if neighbor < 0:
+                        continue
+                    label = self.labels[neighbor]
+                    label_scores[label] = max(label_scores.get(label, -1.0), float(similarity))
+                ranked = sorted(label_scores.items(), key=lambda item: item[1], reverse=True)
+                best_label, best_score = ranked[0]
+                margin = best_score - ranked[1][1] if len(ranked) > 1 else best_score
+                if best_score >= self.threshold and margin >= self.min_margin:
+                    results[i] = RouteResult(best_label, best_score, "embedding")
+                else:
+                    results[i] = RouteResult(None, best_score, "below_threshold")
+        return results
+
+    def route(self, text: str) -> RouteResult:
+        return self.route_batch([text])[0]
+
+
+def _create_router(name, exemplars, fast_path):
+    if not config.ROUTER_ENABLED:
+        return None
+    try:
+        return EmbeddingRouter(exemplars, fast_path)
+    except Exception as e:
+        print(f"⚠️ {name}向量路由初始化失败，使用关键词规则: {e}")
+        return None
+
+
+def create_intent_router() -> Optional[EmbeddingRouter]:
+    return _create_router("意图", INTENT_EXEMPLARS, keyword_fast_path(INTENT_FAST_PATH))
+
+
+def create_case_type_router() -> Optional[EmbeddingRouter]:
+    return _create_router("案件类型", CASE_TYPE_EXEMPLARS,
+                          keyword_fast_path(CASE_TYPE_FAST_PATH, exact_labels=list(CASE_TYPE_EXEMPLARS)))
@@ -0,0 +1,203 @@
+"""大模型调用调度器：按优先级排队，并按服务商/模型的限额（RPM/TPM）统一放行。
+
+聊天回复、法律助理润色、合同分析、案例报告和批量任务共用同一份 API 限额。调度器为每个
+服务商/模型维护两个令牌桶（请求数、token 数），桶的状态保存在共享状态后端中，
+多个应用进程和合同审查 worker 使用 HTTP 状态后端时会共享同一份限额。
+
+优先级：
+- interactive：用户正在等待的聊天回复、润色
+- background：合同分析、案例报告
+- batch：离线批量任务
+
+同一进程内按优先级排队，只有队首的请求尝试取令牌；跨进程时，后台和批量请求不能动用
+为交互请求保留的那部分额度（config.LLM_INTERACTIVE_RESERVE），从而保证突发的合同上传
+不会挤占在线聊天。
+
+每次放行时记录排队时间（llm_queue_seconds），estimate_wait() 给界面提供预计等待时间。
+"""
+import heapq
+import itertools
+import threading
+import time
+from typing import Dict, Optional
+
+import config
+import deadlines
+import metrics
+import state_store
+
+PRIORITIES = {"interactive": 0, "background": 1, "batch": 2}
+
+
+def quota_for(provider: str, model: str) -> Dict[str, float]:
+    quotas = config.LLM_QUOTAS.get(provider, {})
+    return quotas.get(model) or quotas.get("*") or {"rpm": float("inf"), "tpm": float("inf")}
+
+
+def _refill(state: Optional[dict], quota: Dict[str, float], now: float) -> dict:
+    """按经过的时间补充令牌，桶容量为一分钟的额度。"""
+    if not state:
+        return {"requests": quota["rpm"], "tokens": quota["tpm"], "updated_at": now}
+    elapsed = max(0.0, now - state["updated_at"])
+    return {
+        "requests": min(quota["rpm"], state["requests"] + elapsed * quota["rpm"] / 60),
+        "tokens": min(quota["tpm"], state["tokens"] + elapsed * quota["tpm"] / 60),
+        "updated_at": now,
+    }
+
+
+def _wait_needed(state: dict, quota: Dict[str, float], tokens: float, reserve: float, requests: int = 1) -> float:
+    """桶中令牌（扣除保留额度后）不足时，还需等待的秒数；0 表示可以立即放行。"""
+    need_requests = requests + reserve * quota["rpm"] - state["requests"]
+    need_tokens = min(tokens, quota["tpm"]) + reserve * quota["tpm"] - state["tokens"]
+    wait = 0.0
+    if need_requests > 0:
+        wait = max(wait, need_requests / (quota["rpm"] / 60))
+    if need_tokens > 0:
+        wait = max(wait, need_tokens / (quota["tpm"] / 60))
+    return wait
+
+
+class QuotaWaitCancelled(Exception):
+    """排队期间本轮对话被取消。"""
+
+
+class Ticket:
+    """一次已放行的调用。调用结束后用实际 token 数结算，多退少补。"""
+
+    def __init__(self, scheduler: "LLMScheduler", provider: str, model: str, tokens: float, waited: float):
+        self.scheduler = scheduler
+        self.provider = provider
+        self.model = model
+        self.tokens = tokens
+        self.waited = waited
+        self._settled = False
+
+    def settle(self, actual_tokens: float):
+        if self._settled:
+            return
+        self._settled = True
+        self.scheduler.adjust(self.provider, self.model, self.tokens - actual_tokens)
+
+
+class LLMScheduler:
+    def __init__(self, backend: state_store.StateBackend = None):
+        self.backend = backend or state_store.create_backend()
+        self._cond = threading.Condition()
+        self._waiting: Dict[str, list] = {}
+        self._seq = itertools.count()
+
+    @staticmethod
+    def _key(provider, model):
+        return f"quota:{provider}:{model}"
+
+    def _try_take(self, provider: str, model: str, tokens: float, priority: str) -> float:
+        quota = quota_for(provider, model)
+        if quota["rpm"] == float("inf"):
+            return 0.0
+        reserve = config.LLM_INTERACTIVE_RESERVE.get(priority, 0.0)
+        outcome = {}
+
+        def take(state):
+            now = time.time()
+            state = _refill(state, quota, now)
+            wait = _wait_needed(state, quota, tokens, reserve)
+            if wait <= 0:
+                state["requests"] -= 1
+                state["tokens"] -= min(tokens, quota["tpm"])
+            # update 发生冲突时会重试，以最后一次执行的结果为准
+            outcome["wait"] = wait
+            return state
+
+        self.backend.update(self._key(provider, model), take)
+        return outcome["wait"]
+
+    def adjust(self, provider: str, model: str, tokens: float):
+        """退回（正数）或补扣（负数）token。"""
+        quota = quota_for(provider, model)
+        if quota["tpm"] == float("inf") or not tokens:
+            return
+
+        def apply(state):
+            state = _refill(state, quota, time.time())
+            state["tokens"] = min(quota["tpm"], state["tokens"] + tokens)
+            return state
+
+        try:
+            self.backend.update(self._key(provider, model), apply)
+        except Exception as e:
+            print(f"⚠️ 调用额度结算失败: {e}")
+
+    def acquire(self, provider: str, model: str, tokens: float, priority: str = "interactive",
+                timeout: float = None, cancel_token=None, stage: str = None) -> Ticket:
+        """阻塞直到放行。等待超过 timeout 时抛出 DeadlineExceeded，本轮被取消时抛出 QuotaWaitCancelled。"""
+        key = self._key(provider, model)
+        entry = (PRIORITIES[priority], next(self._seq))
+        started = time.monotonic()
+        ends_at = started + timeout if timeout is not None else None
+        with self._cond:
+            heapq.heappush(self._waiting.setdefault(key, []), entry)
+        try:
+            while True:
+                with self._cond:
+                    while self._waiting[key][0] != entry:
+                        self._cond.wait(timeout=0.5)
+                        self._check_abort(ends_at, cancel_token, stage)
+                wait = self._try_take(provider, model, tokens, priority)
+                if wait <= 0:
+                    break
+                self._check_abort(ends_at, cancel_token, stage, wait)
+                time.sleep(min(wait, 0.5))
+        finally:
+            with self._cond:
+                queue = self._waiting[key]
+                queue.remove(entry)
+                heapq.heapify(queue)
+                self._cond.notify_all()
+        waited = time.monotonic() - started
+        metrics.observe("llm_queue_seconds", waited, provider=provider, priority=priority)
+        return Ticket(self, provider, model, tokens, waited)
+
+    @staticmethod
+    def _check_abort(ends_at, cancel_token, stage, wait: float = 0.0):
+        if cancel_token is not None and cancel_token.cancelled:
+            raise QuotaWaitCancelled()
+        if ends_at is not None and time.monotonic() + wait > ends_at:
+            # 预计等待会超出预算时尽早放弃，把剩余时间留给降级方案
+            stage = stage or "queue"
+            deadlines.record_breach(stage)
+            raise deadlines.DeadlineExceeded(stage)
+
+    def estimate_wait(self, provider: str, model: str, tokens: float, priority: str = "interactive") -> float:
+        """预计等待秒数：当前桶的缺口加上本进程内排在前面的请求。"""
+        quota = quota_for(provider, model)
+        if quota["rpm"] == float("inf"):
+            return 0.0
+        try:
+            record = self.backend.get(self._key(provider, model))
+        except Exception:
+            return 0.0
+        state = _refill(record.data if record else None, quota, time.time())
+        with self._cond:
+            ahead = sum(1 for p, _ in self._waiting.get(self._key(provider, model), []) if p <= PRIORITIES[priority])
+        reserve = config.LLM_INTERACTIVE_RESERVE.get(priority, 0.0)
+        return _wait_needed(state, quota, tokens * (ahead + 1), reserve, requests=ahead + 1)
+
+
+_default_scheduler: Optional[LLMScheduler] = None
+_default_lock = threading.Lock()
+
+
+def get_scheduler() -> LLMScheduler:
+    global _default_scheduler
+    with _default_lock:
+        if _default_scheduler is None:
+            _default_scheduler = LLMScheduler()
+        return _default_scheduler
+
+
+def wait_notice(seconds: float) -> Optional[str]:
+    """预计等待超过阈值时返回展示给用户的提示，否则返回 None。"""
+    if seconds < config.SCHEDULER_SHOW_WAIT_ABOVE:
+        return None
+    return f"⏳ 当前咨询人数较多，预计需要等待约 {int(seconds + 0.5)} 秒..."
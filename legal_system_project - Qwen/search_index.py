@@ -0,0 +1,287 @@
+"""案例分析报告的全文检索与分面统计（SQLite FTS5）。
+
+case_analysis_results/ 中每份报告在保存时同步写入索引（save_case_analysis_result），
+也可以用 sync() 增量补录其他进程写入或历史遗留的文件（按文件修改时间判断是否需要更新）。
+
+中文分词采用二元切分：连续的汉字切成重叠的两字词，末尾再补上最后一个字（“经济补偿” → 经济 济补
+补偿 偿），使每个汉字的位置上都有一个以它开头的词；字母和数字按词保留并转为小写。查询词按同样方式
+切分后作为短语匹配，不依赖外部分词词典。查询词以单个汉字结尾时（“2倍”“倍”），最后一个词按前缀匹配。
+
+分面：案件类型、报告月份；过滤条件：案件类型、起止日期、报告所属用户。
+
+    python search_index.py sync
+    python search_index.py search "经济补偿 2N" --date-from 2025-07-01 --date-to 2025-07-31
+"""
+import argparse
+import glob
+import json
+import os
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import config
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS analyses (
+    rowid INTEGER PRIMARY KEY,
+    report_id TEXT NOT NULL UNIQUE,
+    path TEXT NOT NULL,
+    case_type TEXT,
+    report_date TEXT,
+    status TEXT,
+    mtime REAL NOT NULL,
+    conversation TEXT NOT NULL,
+    analysis TEXT NOT NULL,
+    user_id TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_analyses_facets ON analyses (case_type, report_date);
+CREATE INDEX IF NOT EXISTS idx_analyses_user ON analyses (user_id, report_date);
+CREATE VIRTUAL TABLE IF NOT EXISTS analyses_fts USING fts5(conversation, analysis, tokenize = 'unicode61');
+"""
+
+_CJK_RUN_PATTERN = re.compile(r'[㐀-鿿]+')
+_WORD_PATTERN = re.compile(r'[㐀-鿿]+|[0-9A-Za-z]+')
+_SNIPPET_RADIUS = 40
+# 分词方式的版本号（保存在 PRAGMA user_version 中），变化后打开索引时按已保存的原文重建全文索引
+_TOKENIZER_VERSION = 1
+
+
+def _word_tokens(word: str, last: bool = False) -> List[str]:
+    """一段连续汉字或字母数字的词。查询词的最后一段汉字不补末字，由文档中后续的词接上。"""
+    if not _CJK_RUN_PATTERN.fullmatch(word):
+        return [word.lower()]
+    tokens = [word[i:i + 2] for i in range(len(word) - 1)]
+    if not last or len(word) == 1:
+        tokens.append(word[-1])
+    return tokens
+
+
+def bigram_tokens(text: str) -> List[str]:
+    tokens = []
+    for word in _WORD_PATTERN.findall(text or ""):
+        tokens.extend(_word_tokens(word))
+    return tokens
+
+
+def build_match_query(query: str) -> Optional[str]:
+    """把用户输入转换为 FTS5 查询：空格分隔的每个词都必须出现。"""
+    clauses = []
+    for term in query.split():
+        words = _WORD_PATTERN.findall(term)
+        if not words:
+            continue
+        tokens = []
+        for position, word in enumerate(words):
+            tokens.extend(_word_tokens(word, last=position == len(words) - 1))
+        phrase = f'"{" ".join(tokens)}"'
+        # 以单个汉字结尾时，文档中对应位置是以该字开头的两字词（“2倍工资” → 2 倍工 工资 资）
+        if len(words[-1]) == 1 and _CJK_RUN_PATTERN.fullmatch(words[-1]):
+            phrase += " *"
+        clauses.append(phrase)
+    return " AND ".join(clauses) if clauses else None
+
+
+def _report_date(report_id: str, analysis_data: Dict) -> Optional[str]:
+    # 文件名形如 case_analysis_20250815_110425
+    timestamp = analysis_data.get("timestamp") or report_id[-15:]
+    try:
+        return datetime.strptime(timestamp, "%Y%m%d_%H%M%S").strftime("%Y-%m-%d")
+    except ValueError:
+        return None
+
+
+def _analysis_text(analysis_data: Dict) -> str:
+    sections = analysis_data.get("analysis_sections") or {}
+    if sections:
+        return "\n\n".join(f"【{title}】{text}" for title, text in sections.items())
+    return analysis_data.get("case_analysis") or ""
+
+
+def _snippet(text: str, query: str) -> str:
+    """取第一个命中词附近的原文。"""
+    positions = [text.find(term) for term in query.split() if term and text.find(term) >= 0]
+    if not positions:
+        positions = [text.lower().find(term.lower()) for term in query.split() if text.lower().find(term.lower()) >= 0]
+    start = max(0, min(positions) - _SNIPPET_RADIUS) if positions else 0
+    snippet = text[start:start + 2 * _SNIPPET_RADIUS + 20].replace("\n", " ")
+    return ("…" if start > 0 else "") + snippet + ("…" if start + len(snippet) < len(text) else "")
+
+
+class CaseSearchIndex:
+    def __init__(self, db_path: str = None):
+        self.db_path = db_path or config.SEARCH_INDEX_PATH
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        self._write_lock = threading.Lock()
+        with self._connect() as conn:
+            # 旧版本创建的索引没有用户列：先补齐列再建索引，并清空修改时间，下次 sync 时重新读取报告中的用户
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(analyses)")}
+            if columns and "user_id" not in columns:
+                conn.execute("ALTER TABLE analyses ADD COLUMN user_id TEXT")
+                conn.execute("UPDATE analyses SET mtime = 0")
+            conn.executescript(_SCHEMA)
+            if conn.execute("PRAGMA user_version").fetchone()[0] < _TOKENIZER_VERSION:
+                self._rebuild_fts(conn)
+
+    @staticmethod
+    def _rebuild_fts(conn):
+        """按 analyses 表中保存的原文重新分词，写入全文索引。"""
+        conn.execute("DELETE FROM analyses_fts")
+        for row in conn.execute("SELECT rowid, conversation, analysis FROM analyses").fetchall():
+            conn.execute(
+                "INSERT INTO analyses_fts (rowid, conversation, analysis) VALUES (?, ?, ?)",
+                (row["rowid"], " ".join(bigram_tokens(row["conversation"])), " ".join(bigram_tokens(row["analysis"])))
+            )
+        conn.execute(f"PRAGMA user_version = {_TOKENIZER_VERSION}")
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        try:
+            yield conn
+            conn.commit()
+        finally:
+            conn.close()
+
+    def upsert(self, path: str, analysis_data: Dict, mtime: float = None):
+        """写入或更新一份报告的索引，报告 ID 为文件名（不含扩展名）。"""
+        report_id = os.path.splitext(os.path.basename(path))[0]
+        conversation = analysis_data.get("conversation") or ""
+        analysis = _analysis_text(analysis_data)
+        mtime = mtime if mtime is not None else (os.path.getmtime(path) if os.path.exists(path) else 0.0)
+        with self._write_lock, self._connect() as conn:
+            row = conn.execute("SELECT rowid FROM analyses WHERE report_id = ?", (report_id,)).fetchone()
+            values = (report_id, os.path.abspath(path), analysis_data.get("case_type"),
+                      _report_date(report_id, analysis_data), analysis_data.get("status", "complete"),
+                      mtime, conversation, analysis, analysis_data.get("user_id"))
+            if row is None:
+                rowid = conn.execute(
+                    "INSERT INTO analyses (report_id, path, case_type, report_date, status, mtime, conversation, analysis, "
+                    "user_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", values
+                ).lastrowid
+            else:
+                rowid = row["rowid"]
+                conn.execute(
+                    "UPDATE analyses SET report_id = ?, path = ?, case_type = ?, report_date = ?, status = ?, mtime = ?, "
+                    "conversation = ?, analysis = ?, user_id = ? WHERE rowid = ?", (*values, rowid)
+                )
+                conn.execute("DELETE FROM analyses_fts WHERE rowid = ?", (rowid,))
+            conn.execute(
+                "INSERT INTO analyses_fts (rowid, conversation, analysis) VALUES (?, ?, ?)",
+                (rowid, " ".join(bigram_tokens(conversation)), " ".join(bigram_tokens(analysis)))
+            )
+
+    def sync(self, directory: str = "case_analysis_results") -> int:
+        """补录目录中新增或修改过的报告，返回更新的数量。"""
+        with self._connect() as conn:
+            indexed = {row["path"]: row["mtime"] for row in conn.execute("SELECT path, mtime FROM analyses")}
+        updated = 0
+        for path in sorted(glob.glob(os.path.join(directory, "*.json"))):
+            mtime = os.path.getmtime(path)
+            if indexed.get(os.path.abspath(path)) == mtime:
+                continue
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self.upsert(path, json.load(f), mtime)
+                updated += 1
+            except (OSError, ValueError) as e:
+                print(f"⚠️ 索引报告失败 {path}: {e}")
+        return updated
+
+    def search(self, query: str = "", case_type: str = None, date_from: str = None, date_to: str = None,
+               page: int = 1, page_size: int = 20, user_id: str = None) -> Dict:
+        """分页检索。query 为空时按过滤条件列出全部报告；日期格式为 YYYY-MM-DD。
+
+        传入 user_id 时只检索该用户的报告，结果和分面都不含其他用户的内容。
+        """
+        page, page_size = max(page, 1), min(max(page_size, 1), 100)
+        conditions, params = [], []
+        if user_id is not None:
+            conditions.append("a.user_id = ?")
+            params.append(user_id)
+        match = build_match_query(query or "")
+        if match:
+            conditions.append("a.rowid IN (SELECT rowid FROM analyses_fts WHERE analyses_fts MATCH ?)")
+            params.append(match)
+        if date_from:
+            conditions.append("a.report_date >= ?")
+            params.append(date_from)
+        if date_to:
+            conditions.append("a.report_date <= ?")
+            params.append(date_to)
+        # 分面统计不受自身过滤条件影响，便于界面上切换案件类型
+        facet_where = " AND ".join(conditions) or "1"
+        if case_type:
+            conditions.append("a.case_type = ?")
+            where, where_params = " AND ".join(conditions), params + [case_type]
+        else:
+            where, where_params = facet_where, params
+
+        with self._connect() as conn:
+            total = conn.execute(f"SELECT COUNT(*) FROM analyses a WHERE {where}", where_params).fetchone()[0]
+            rows = conn.execute(
+                f"SELECT a.report_id, a.case_type, a.report_date, a.status, a.conversation, a.analysis "
+                f"FROM analyses a WHERE {where} ORDER BY a.report_date DESC, a.report_id DESC LIMIT ? OFFSET ?",
+                (*where_params, page_size, (page - 1) * page_size)
+            ).fetchall()
+            case_types = conn.execute(
+                f"SELECT a.case_type, COUNT(*) FROM analyses a WHERE {facet_where} GROUP BY a.case_type ORDER BY 2 DESC",
+                params
+            ).fetchall()
+            months = conn.execute(
+                f"SELECT substr(a.report_date, 1, 7), COUNT(*) FROM analyses a WHERE {where} GROUP BY 1 ORDER BY 1 DESC",
+                where_params
+            ).fetchall()
+
+        items = [{
+            "id": row["report_id"],
+            "case_type": row["case_type"],
+            "date": row["report_date"],
+            "status": row["status"],
+            "snippet": _snippet(row["analysis"] + "\n" + row["conversation"], query or ""),
+        } for row in rows]
+        return {
+            "total": total, "page": page, "page_size": page_size, "items": items,
+            "facets": {
+                "case_type": [{"value": value, "count": count} for value, count in case_types],
+                "month": [{"value": value, "count": count} for value, count in months],
+            },
+        }
+
+
+_default_index: Optional[CaseSearchIndex] = None
+_default_lock = threading.Lock()
+
+
+def get_index() -> CaseSearchIndex:
+    global _default_index
+    with _default_lock:
+        if _default_index is None:
+            _default_index = CaseSearchIndex()
+        return _default_index
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="案例分析报告检索")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    sync_parser = subparsers.add_parser("sync", help="补录新增或修改过的报告")
+    sync_parser.add_argument("--dir", default="case_analysis_results")
+    search_parser = subparsers.add_parser("search", help="检索报告")
+    search_parser.add_argument("query", nargs="?", default="")
+    search_parser.add_argument("--case-type")
+    search_parser.add_argument("--date-from")
+    search_parser.add_argument("--date-to")
+    search_parser.add_argument("--page", type=int, default=1)
+    args = parser.parse_args()
+
+    index = get_index()
+    if args.command == "sync":
+        print(f"已更新 {index.sync(args.dir)} 份报告的索引")
+    else:
+        print(json.dumps(index.search(args.query, args.case_type, args.date_from, args.date_to, args.page),
+                         ensure_ascii=False, indent=2))
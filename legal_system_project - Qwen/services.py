@@ -2,12 +2,36 @@ from openai import OpenAI
 from typing import Dict, Any, Generator, List, Optional
 import utils
 import config
+import batch_ocr
+import clause_extractor
+import image_dedup
+import text_normalizer
 import prompts
+from transcript import CaseTranscript, estimate_tokens
+import cancellation
+import deadlines
+import scheduler
+import metrics
 import dashscope
 from dashscope import Generation
 import os
+import threading
 from datetime import datetime
 
+def _openai_delta_text(chunk):
+    if chunk.choices and chunk.choices[0].delta and chunk.choices[0].delta.content:
+        return chunk.choices[0].delta.content
+    return ""
+
+def detect_seal(text: str, file_paths: Optional[List[str]] = None) -> bool:
+    """文本中有盖章字样且图片中检测到红色圆形印章时，认为合同已盖章。"""
+    if not utils.detect_seal_in_text(text):
+        return False
+    for p in file_paths or []:
+        if p.lower().endswith(('.png','.jpg','.jpeg','.bmp','.tiff')) and utils.detect_seal_in_image(p):
+            return True
+    return False
+
 class ContractAnalyzer:
     def __init__(self):
         self.client = OpenAI(
@@ -15,35 +39,98 @@ class ContractAnalyzer:
             base_url="https://api.deepseek.com"
         )
 
-    def extract_texts_from_multiple_images(self, image_paths: List[str]) -> str:
-        reader = utils.easyocr.Reader(['ch_sim', 'en'])
+        self._ocr_reader = None
+
+    @property
+    def ocr_reader(self):
+        """EasyOCR 模型加载较慢，同一个分析器（如任务 worker 进程）内复用同一个 Reader。"""
+        if self._ocr_reader is None:
+            self._ocr_reader = utils.easyocr.Reader(['ch_sim', 'en'])
+        return self._ocr_reader
+
+    def extract_texts_from_multiple_images(
+        self,
+        image_paths: List[str],
+        ocr_deadline: Optional[deadlines.Deadline] = None,
+        skipped: Optional[List[Dict[str, Any]]] = None
+    ) -> str:
+        """识别多张图片，重复和空白的图片不识别。OCR_RECOGNITION_BATCH_SIZE 大于 1 时由 batch_ocr
+        跨页批量识别，否则逐张调用 readtext。
+
+        传入 ocr_deadline 时，OCR 阶段预算用完后跳过剩余图片。跳过的图片连同原因
+        （duplicate / blank / timeout）记入 skipped。
+        """
+        reader = self.ocr_reader
+        image_paths, filtered = image_dedup.select_images(image_paths, reader)
+        for item in filtered:
+            metrics.increment("ocr_images_skipped", reason=item["reason"])
+        if skipped is not None:
+            skipped.extend(filtered)
+        if config.OCR_RECOGNITION_BATCH_SIZE > 1:
+            return self._read_images_batched(reader, image_paths, ocr_deadline, skipped)
         all_text = []
-        for path in image_paths:
+        for index, path in enumerate(image_paths):
             try:
-                text = utils._extract_from_image(path, reader)
+                if ocr_deadline is None:
+                    text = utils._extract_from_image(path, reader)
+                else:
+                    text = deadlines.call_within(utils._extract_from_image, ocr_deadline.remaining(), "ocr", path, reader)
                 all_text.append(text)
+            except deadlines.DeadlineExceeded:
+                # 超时的识别仍在后台运行，不能再并发使用同一个 Reader，剩余图片全部跳过
+                deadlines.record_degradation("ocr", "skip_images")
+                if skipped is not None:
+                    skipped.extend({"path": p, "reason": "timeout", "duplicate_of": None} for p in image_paths[index:])
+                break
             except Exception as e:
                 print(f"\n⚠️ 图片处理失败 [{path}]: {str(e)}")
-        return "\n\n".join(all_text)
+        return text_normalizer.PAGE_BREAK.join(all_text)
+
+    def _read_images_batched(
+        self,
+        reader,
+        image_paths: List[str],
+        ocr_deadline: Optional[deadlines.Deadline],
+        skipped: Optional[List[Dict[str, Any]]]
+    ) -> str:
+        """batch_ocr 逐页检测、跨页合并识别；超时后保留已完成的页面，其余记入 skipped。"""
+        if ocr_deadline is None:
+            call = None
+        else:
+            def call(fn, *args):
+                return deadlines.call_within(fn, ocr_deadline.remaining(), "ocr", *args)
+        texts = []
+        try:
+            batch_ocr.read_pages(reader, image_paths, call=call, texts=texts)
+        except deadlines.DeadlineExceeded:
+            deadlines.record_degradation("ocr", "skip_images")
+            if skipped is not None:
+                skipped.extend({"path": path, "reason": "timeout", "duplicate_of": None}
+                               for path, text in zip(image_paths, texts) if text is None)
+        return text_normalizer.PAGE_BREAK.join(text for text in texts if text is not None)
 
     def analyze_contract_stream(
         self,
         text: str,
         contract_type: str,
-        file_paths: Optional[List[str]] = None
+        file_paths: Optional[List[str]] = None,
+        deadline: Optional[deadlines.Deadline] = None,
+        priority: str = "background",
+        has_seal: Optional[bool] = None,
+        clauses: Optional[clause_extractor.ClauseExtraction] = None,
+        upstream: Optional[deadlines.Upstream] = None
     ) -> Generator[str, None, Dict[str, Any]]:
+        """has_seal / clauses 为空时在这里做公章检测和条款预检；调用方已经算过时直接传入结果。
+        传入 upstream 时登记 DeepSeek 流式连接的关闭函数，调用方超时后可以直接关闭连接。"""
         if not text.strip():
             raise ValueError("合同文本内容为空")
 
-        has_seal_text = utils.detect_seal_in_text(text)
-        has_seal_image = False
-        if file_paths:
-            for p in file_paths:
-                if p.lower().endswith(('.png','.jpg','.jpeg','.bmp','.tiff')) and utils.detect_seal_in_image(p):
-                    has_seal_image = True
-                    break
+        if clauses is None:
+            clauses = clause_extractor.extract(text)
 
-        seal_note = "（检测到公章）" if has_seal_text and has_seal_image else "（未检测到公章）"
+        if has_seal is None:
+            has_seal = detect_seal(text, file_paths)
+        seal_note = "（检测到公章）" if has_seal else "（未检测到公章）"
 
         system_prompt = f"""你是一位专业的劳动法律师，负责分析劳动合同的合规性。
 该合同初步识别为：{contract_type} {seal_note}
@@ -66,33 +153,129 @@ class ContractAnalyzer:
    - 违约责任
    - 竞业限制条款（如有）
    - 保密条款（如有）
+"""
+        if clauses.reliable:
+            system_prompt += f"""
+本地条款预检结果（按编号切分合同并用关键词定位各检查项）：
+{clauses.summary()}
+预检确认缺失的必备条款请直接列为问题；其余检查项以下方给出的合同条款为准，并逐条检查其中的违法或不合理约定。
 """
 
+        compact_text = clauses.compact_text()
+        if compact_text:
+            # 每段前标注条款编号和对应的检查项；只删去了格式性条款，过长的条款截断
+            user_prompt = f"请分析以下劳动合同（已按条款整理，省略了份数、生效方式等格式性条款）：\n{compact_text}"
+        else:
+            user_prompt = f"请分析以下劳动合同：\n{text[:15000]}"
+        metrics.observe("contract_prompt_chars", len(user_prompt), compacted=str(bool(compact_text)).lower())
+        prompt_tokens = estimate_tokens(system_prompt + user_prompt)
+        # 合同分析属于后台任务，按调度器的优先级和 DeepSeek 限额排队
+        ticket = scheduler.get_scheduler().acquire(
+            "deepseek", config.CONTRACT_ANALYSIS_MODEL, prompt_tokens + config.EXPECTED_COMPLETION_TOKENS["contract"],
+            priority, timeout=deadline.budget("contract_analysis") if deadline else None, stage="contract_analysis"
+        )
+        collected_content = []
         try:
             stream = self.client.chat.completions.create(
                 model=config.CONTRACT_ANALYSIS_MODEL,
                 messages=[
                     {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": f"请分析以下劳动合同：\n{text[:15000]}"}
+                    {"role": "user", "content": user_prompt}
                 ],
                 temperature=0.3,
                 max_tokens=2000,
                 stream=True
             )
+            if upstream is not None:
+                upstream.attach(stream.close)
 
-            collected_content = []
-            for chunk in stream:
-                if not chunk.choices:
-                    continue
-                delta = chunk.choices[0].delta
-                if delta and delta.content:
-                    collected_content.append(delta.content)
-                    yield delta.content
+            try:
+                for chunk in stream:
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta
+                    if delta and delta.content:
+                        collected_content.append(delta.content)
+                        yield delta.content
+            finally:
+                # 任务被取消时生成器会被提前关闭，同时关闭上游 HTTP 流
+                stream.close()
 
             return {"metadata": {"complete_response": "".join(collected_content)}}
 
         except Exception as e:
             raise RuntimeError(f"分析过程中出错: {str(e)}")
+        finally:
+            ticket.settle(prompt_tokens + estimate_tokens("".join(collected_content)))
+
+    def review_files(
+        self,
+        file_paths: List[str],
+        deadline: Optional[deadlines.Deadline] = None
+    ) -> Generator[str, None, None]:
+        """完整的合同审查流程：文本提取、类型识别、公章检测与深度分析，逐步产出当前的展示文本。
+
+        各阶段的超时预算从 deadline 中领取（默认从现在开始计算合同审查的总时限）。
+        """
+        deadline = deadline or deadlines.Deadline(config.CONTRACT_REVIEW_DEADLINE_SECONDS)
+        if deadline.expired:
+            deadlines.record_breach("contract_queue")
+            yield "❌ **错误**：合同审查任务排队超时，请稍后重新上传。"
+            return
+
+        yield "⏳ **正在提取文本...**"
+        skipped_images = []
+        try:
+            if len(file_paths) > 1:
+                ocr_deadline = deadlines.Deadline(deadline.budget("ocr"))
+                text = self.extract_texts_from_multiple_images(file_paths, ocr_deadline, skipped_images)
+            elif file_paths[0].lower().endswith(('.png', '.jpg', '.jpeg', '.bmp', '.tiff', '.webp')):
+                text = deadlines.call_within(utils._extract_from_image, deadline.budget("ocr"), "ocr",
+                                             file_paths[0], self.ocr_reader)
+            else:
+                text = deadlines.call_within(utils.extract_text_from_file, deadline.budget("extraction"),
+                                             "extraction", file_paths[0])
+        except deadlines.DeadlineExceeded as e:
+            yield f"❌ **错误**：文件识别超时（{e.stage}），请尝试上传更清晰或更小的文件。"
+            return
+
+        normalized = text_normalizer.normalize(text)
+        text = normalized.text
+        metrics.observe("contract_text_chars_removed", normalized.removed_chars)
+        if not text.strip():
+            yield "❌ **错误**：未能从文件中提取到任何文本。"
+            return
+
+        skipped_note = ""
+        duplicates = [f"{os.path.basename(item['path'])}（与 {os.path.basename(item['duplicate_of'])} 相同）"
+                      for item in skipped_images if item["reason"] == "duplicate"]
+        blanks = [os.path.basename(item["path"]) for item in skipped_images if item["reason"] == "blank"]
+        timed_out = [os.path.basename(item["path"]) for item in skipped_images if item["reason"] == "timeout"]
+        if duplicates:
+            skipped_note += f"ℹ️ 以下图片与已上传的图片重复，未重复识别：{'、'.join(duplicates)}\n\n"
+        if blanks:
+            skipped_note += f"ℹ️ 以下图片为空白页，已跳过：{'、'.join(blanks)}\n\n"
+        if timed_out:
+            skipped_note += f"⚠️ 识别超时，以下图片未参与分析：{'、'.join(timed_out)}\n\n"
+
+        # 多标签结果一并交给模型，比单一的首个命中类型更准确
+        contract_type = utils.describe_contract_types(utils.rank_contract_types(text))
+        clauses = clause_extractor.extract(text)
+        header = f"{skipped_note}📌 **初步识别的合同类型**：{contract_type}\n\n{clauses.missing_note()}---\n\n"
+        yield f"{header}⏳ **正在进行深度分析，请稍候...**"
+
+        full_response = header
+        upstream = deadlines.Upstream()
+        try:
+            for chunk in deadlines.iter_within(self.analyze_contract_stream(text, contract_type, file_paths, deadline,
+                                                                            clauses=clauses, upstream=upstream),
+                                               deadline.budget("contract_analysis"), "contract_analysis",
+                                               close=upstream.close):
+                full_response += chunk
+                yield full_response
+        except deadlines.DeadlineExceeded:
+            deadlines.record_degradation("contract_analysis", "truncate")
+            yield full_response + "\n\n⚠️ 分析超时，以上为已生成的部分。"
 
 class LawyerPromptLoader:
     """律师提示词加载器"""
@@ -118,32 +301,62 @@ class LawyerPromptLoader:
             return prompts.DEFAULT_LAWYER_SYSTEM_PROMPT
 
 class CaseAnalysisGenerator:
-    def __init__(self):
+    def __init__(self, retriever=None):
+        # 可选的相似案例索引（case_retrieval.CaseRetrievalIndex），命中时复用既往报告
+        self.retriever = retriever
         self.client = OpenAI(
             api_key=config.DASHSCOPE_API_KEY,
             base_url="https://dashscope.aliyuncs.com/compatible-mode/v1"
         )
+        # 当前进程内正在生成的报告数，作为选择分析档位的负载信号
+        self._in_flight = 0
+        self._in_flight_lock = threading.Lock()
+
+    def select_tier(self, transcript_tokens: int = 0) -> str:
+        """按当前负载和对话长度选择分析档位：高峰期宁可快速出报告，也不要超时。"""
+        thresholds = config.CASE_ANALYSIS_LOAD_THRESHOLDS
+        if self._in_flight >= thresholds["fast"]:
+            return "fast"
+        if self._in_flight >= thresholds["bounded"] or transcript_tokens >= config.CASE_ANALYSIS_LONG_TRANSCRIPT_TOKENS:
+            return "bounded" if config.CASE_ANALYSIS_DEFAULT_TIER == "full" else config.CASE_ANALYSIS_DEFAULT_TIER
+        return config.CASE_ANALYSIS_DEFAULT_TIER
 
     def extract_conversation_content(self, conversation_data):
         if not conversation_data:
             return ""
-        
-        if isinstance(conversation_data, list) and len(conversation_data) > 0:
-            conversation_data = conversation_data[0]
-        
-        if not isinstance(conversation_data, dict) or 'conversations' not in conversation_data:
+        return CaseTranscript.from_sharegpt(conversation_data).text
+
+    def build_case_analysis_prompt(self, conversation_content: str, retrieval=None) -> str:
+        return self._case_analysis_instructions() + self._reference_cases(retrieval) + f"""
+---
+**对话内容：**
+{conversation_content}
+---
+"""
+
+    @staticmethod
+    def _reference_cases(retrieval) -> str:
+        if retrieval is None or retrieval.mode == "none":
             return ""
-        
-        conversation_text = ""
-        for conv in conversation_data['conversations']:
-            role = "用户" if conv['from'] == 'human' else "律师"
-            content = conv['value']
-            conversation_text += f"{role}: {content}\n\n"
-        
-        return conversation_text.strip()
+        notice = "其中的当事人、单位、金额、日期等具体事实均属于其他案件，不得照搬，一律以本案对话内容为准。"
+        if retrieval.draft is not None:
+            return f"""
+**参考草稿：**
+以下是一份事实高度相似的既往案例报告。请以它为草稿，逐段对照本案对话内容修改，保留适用的法律分析，改写所有与本案不符之处。{notice}
+
+{retrieval.draft.draft()}
+"""
+        exemplars = "\n\n".join(f"参考案例{i}：\n{case.exemplar()}" for i, case in enumerate(retrieval.cases, 1))
+        return f"""
+**相似案例（节选，仅供参考）：**
+{notice}
+
+{exemplars}
+"""
 
-    def generate_case_analysis(self, conversation_content: str) -> str:
-        prompt = f"""
+    @staticmethod
+    def _case_analysis_instructions() -> str:
+        return f"""
 你是一位资深的劳动法律师。你的任务是根据下方提供的“对话内容”，直接为你的当事人撰写一份专业的法律分析与后续行动建议。
 目前北京时间为：{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
 
@@ -166,41 +379,141 @@ class CaseAnalysisGenerator:
 
 **【维权与赔偿方案】**
 （在此处向您的当事人详细阐述维权路径和步骤，说明可能获得的赔偿项目和金额计算方式，并给出证据收集与保全的建议。）
-
----
-**对话内容：**
-{conversation_content}
----
 """
-        
+
+    def generate_case_analysis(self, conversation_content: str, tier: Optional[str] = None) -> str:
         try:
-            completion = self.client.chat.completions.create(
-                model=config.CASE_ANALYSIS_MODEL,
-                messages=[
-                    {'role': 'user', 'content': prompt}
-                ]
-            )
-            return completion.choices[0].message.content
+            return "".join(self.generate_case_analysis_stream(conversation_content, tier))
         except Exception as e:
             print(f"生成案例分析时出错: {e}")
             return "生成分析失败"
 
+    def generate_case_analysis_stream(
+        self,
+        conversation_content: str,
+        tier: Optional[str] = None,
+        transcript_tokens: int = 0,
+        stats: Optional[Dict[str, Any]] = None,
+        cancel_token=None,
+        deadline: Optional[deadlines.Deadline] = None,
+        case_type: Optional[str] = None,
+        priority: str = "background",
+        upstream: Optional[deadlines.Upstream] = None
+    ) -> Generator[str, None, None]:
+        """流式生成报告正文，只产出 content 增量（推理模型的 reasoning_content 不输出）。
+
+        tier 为空时按 select_tier 自动选择；传入 stats 字典时会填入档位、模型和 token 用量；
+        cancel_token 被取消时停止生成；报告按 priority（默认后台）排队，等待不超过 deadline 中的分析预算。
+        调用方提前停止迭代时会关闭上游 HTTP 流，不再为多余的输出付费；传入 upstream 时登记该流的关闭函数，
+        在其他线程中迭代本生成器的调用方（deadlines.iter_within）超时后可以直接关闭连接。
+        配置了相似案例索引时先检索：命中的既往报告作为参考案例放进提示词；同类型且高度相似时
+        以其为草稿，未指定档位时改用快速档改写。
+        """
+        retrieval = None
+        if self.retriever is not None:
+            try:
+                retrieval = self.retriever.lookup(conversation_content, case_type)
+            except Exception as e:
+                print(f"⚠️ 相似案例检索失败: {e}")
+        if retrieval is not None and retrieval.draft is not None and tier is None:
+            tier = "fast"
+        tier = tier or self.select_tier(transcript_tokens)
+        tier_config = config.CASE_ANALYSIS_TIERS[tier]
+        if stats is not None:
+            stats.update({"tier": tier, "model": tier_config["model"]})
+            if retrieval is not None:
+                stats["retrieval"] = retrieval.summary()
+        if retrieval is not None:
+            metrics.increment("case_retrieval", mode=retrieval.mode)
+        prompt = self.build_case_analysis_prompt(conversation_content, retrieval)
+        prompt_tokens = estimate_tokens(prompt)
+        ticket = scheduler.get_scheduler().acquire(
+            "dashscope", tier_config["model"], prompt_tokens + config.EXPECTED_COMPLETION_TOKENS["case_report"],
+            priority, timeout=deadline.budget("analysis") if deadline else None,
+            cancel_token=cancel_token, stage="analysis"
+        )
+        usage = {}
+
+        with self._in_flight_lock:
+            self._in_flight += 1
+        try:
+            try:
+                stream = self.client.chat.completions.create(
+                    model=tier_config["model"],
+                    messages=[
+                        {'role': 'user', 'content': prompt}
+                    ],
+                    stream=True,
+                    stream_options={"include_usage": True},
+                    extra_body=tier_config["extra_body"] or None
+                )
+            except Exception as e:
+                raise RuntimeError(f"生成案例分析时出错: {str(e)}")
+            if upstream is not None:
+                upstream.attach(stream.close)
+
+            try:
+                for chunk in cancellation.cancellable(stream, cancel_token, "case_report", _openai_delta_text):
+                    if getattr(chunk, "usage", None):
+                        usage["prompt_tokens"] = chunk.usage.prompt_tokens
+                        usage["completion_tokens"] = chunk.usage.completion_tokens
+                        details = getattr(chunk.usage, "completion_tokens_details", None)
+                        usage["reasoning_tokens"] = getattr(details, "reasoning_tokens", None) if details else None
+                        if stats is not None:
+                            stats.update(usage)
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta
+                    if delta and delta.content:
+                        yield delta.content
+            finally:
+                stream.close()
+        finally:
+            with self._in_flight_lock:
+                self._in_flight -= 1
+            # 有实际用量时按实际结算，否则（如中途取消）按已知的输入估算
+            ticket.settle(usage.get("prompt_tokens", 0) + usage.get("completion_tokens", 0) or prompt_tokens)
+
 class ParalegalAssistant:
     def __init__(self):
         dashscope.api_key = config.DASHSCOPE_API_KEY
 
-    def polish_user_input(self, user_input):
+    def polish_user_input(self, user_input, cancel_token=None, deadline=None):
+        # 本轮已被取消时不再调用模型，直接返回原文
+        if cancel_token is not None and cancel_token.cancelled:
+            cancellation.record_cancellation("paralegal")
+            return user_input
+        # 润色只是锦上添花，时间不够时直接跳过
+        deadline = deadline or deadlines.Deadline()
+        if not deadline.can_afford("paralegal"):
+            deadlines.record_degradation("paralegal", "skip")
+            return user_input
         try:
             messages = [
                 {'role': 'system', 'content': prompts.PARALEGAL_SYSTEM_PROMPT},
                 {'role': 'user', 'content': user_input}
             ]
             
-            response = Generation.call(
-                model=config.PARALEGAL_MODEL,
-                messages=messages,
-                result_format='message'
-            )
+            prompt_tokens = estimate_tokens(prompts.PARALEGAL_SYSTEM_PROMPT + user_input)
+            try:
+                ticket = scheduler.get_scheduler().acquire(
+                    "dashscope", config.PARALEGAL_MODEL, prompt_tokens + config.EXPECTED_COMPLETION_TOKENS["paralegal"],
+                    "interactive", timeout=deadline.budget("paralegal"), cancel_token=cancel_token, stage="paralegal"
+                )
+                response = None
+                try:
+                    response = deadlines.call_within(
+                        Generation.call, deadline.budget("paralegal"), "paralegal",
+                        model=config.PARALEGAL_MODEL,
+                        messages=messages,
+                        result_format='message'
+                    )
+                finally:
+                    polished = response.output.choices[0].message.content if response is not None and response.status_code == 200 else ""
+                    ticket.settle(prompt_tokens + estimate_tokens(polished))
+            except (deadlines.DeadlineExceeded, scheduler.QuotaWaitCancelled):
+                deadlines.record_degradation("paralegal", "skip")
+                return user_input
             
             if response.status_code == 200:
                 return response.output.choices[0].message.content
@@ -0,0 +1,288 @@
+"""会话状态存储后端。
+
+应用进程本身不持有权威的会话状态：每个用户的状态以带版本号的记录形式保存在后端中，
+写入时做乐观并发校验（expected_version 必须等于后端当前版本），这样多个 Gradio/uvicorn
+进程、甚至多台机器就可以同时对外服务而不会丢失用户的咨询进度。
+
+- InProcessStateBackend：进程内实现，适用于单进程部署
+- StateServer / HTTPStateBackend：本地共享状态服务及其客户端，多个进程通过 HTTP 访问同一份状态
+
+启动共享状态服务：
+    python state_store.py --host 127.0.0.1 --port 7870
+"""
+import abc
+import argparse
+import copy
+import json
+import random
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Optional
+
+import config
+
+
+class VersionConflictError(Exception):
+    """写入时的 expected_version 与后端当前版本不一致。"""
+
+    def __init__(self, key: str, expected_version: int, current_version: int):
+        super().__init__(f"会话 {key} 版本冲突：期望 {expected_version}，实际 {current_version}")
+        self.key = key
+        self.expected_version = expected_version
+        self.current_version = current_version
+
+
+class StateBackendError(Exception):
+    """后端不可用，或返回了无法识别的响应（如代理返回的 5xx 错误页）。"""
+
+
+class SessionRecord:
+    """一条带版本号的会话记录。version 从 1 开始，0 表示记录不存在。"""
+
+    def __init__(self, key: str, version: int, data: Dict[str, Any], updated_at: float):
+        self.key = key
+        self.version = version
+        self.data = data
+        self.updated_at = updated_at
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "key": self.key,
+            "version": self.version,
+            "data": self.data,
+            "updated_at": self.updated_at,
+        }
+
+    @classmethod
+    def from_dict(cls, payload: Dict[str, Any]) -> "SessionRecord":
+        return cls(payload["key"], payload["version"], payload["data"], payload["updated_at"])
+
+
+class StateBackend(abc.ABC):
+    """状态后端接口。"""
+
+    @abc.abstractmethod
+    def get(self, key: str) -> Optional[SessionRecord]:
+        pass
+
+    @abc.abstractmethod
+    def get_version(self, key: str) -> int:
+        """只返回版本号（不存在时为 0），用于廉价地校验本地缓存是否过期。"""
+
+    @abc.abstractmethod
+    def put(self, key: str, data: Dict[str, Any], expected_version: int) -> SessionRecord:
+        """写入记录。expected_version 为 0 表示只允许新建；版本不一致时抛出 VersionConflictError。"""
+
+    @abc.abstractmethod
+    def delete(self, key: str) -> bool:
+        pass
+
+    def update(self, key: str, fn: Callable[[Optional[Dict[str, Any]]], Dict[str, Any]],
+               retries: int = 50) -> SessionRecord:
+        """读-改-写，发生版本冲突时随机退避后重新读取并重试。"""
+        for attempt in range(retries):
+            record = self.get(key)
+            data = fn(copy.deepcopy(record.data) if record else None)
+            try:
+                return self.put(key, data, record.version if record else 0)
+            except VersionConflictError:
+                time.sleep(random.uniform(0, 0.002 * (attempt + 1)))
+        raise RuntimeError(f"会话 {key} 更新冲突次数过多")
+
+
+class InProcessStateBackend(StateBackend):
+    """进程内实现。数据经过 JSON 往返，保证与远程后端的语义一致（调用方拿到的都是副本）。"""
+
+    def __init__(self):
+        self._records: Dict[str, SessionRecord] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            record = self._records.get(key)
+            if record is None:
+                return None
+            return SessionRecord(key, record.version, json.loads(json.dumps(record.data)), record.updated_at)
+
+    def get_version(self, key):
+        with self._lock:
+            record = self._records.get(key)
+            return record.version if record else 0
+
+    def put(self, key, data, expected_version):
+        payload = json.loads(json.dumps(data, ensure_ascii=False))
+        with self._lock:
+            current = self._records.get(key)
+            current_version = current.version if current else 0
+            if current_version != expected_version:
+                raise VersionConflictError(key, expected_version, current_version)
+            record = SessionRecord(key, current_version + 1, payload, time.time())
+            self._records[key] = record
+            return SessionRecord(key, record.version, json.loads(json.dumps(payload)), record.updated_at)
+
+    def delete(self, key):
+        with self._lock:
+            return self._records.pop(key, None) is not None
+
+
+class _StateRequestHandler(BaseHTTPRequestHandler):
+    """GET/PUT/DELETE /records/<key>，GET /versions/<key>。"""
+
+    def _key(self, prefix):
+        return urllib.parse.unquote(self.path[len(prefix):])
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        backend = self.server.backend
+        if self.path.startswith("/versions/"):
+            self._send_json(200, {"version": backend.get_version(self._key("/versions/"))})
+        elif self.path.startswith("/records/"):
+            record = backend.get(self._key("/records/"))
+            if record is None:
+                self._send_json(404, {"error": "not found"})
+            else:
+                self._send_json(200, record.to_dict())
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_PUT(self):
+        if not self.path.startswith("/records/"):
+            self._send_json(404, {"error": "not found"})
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length).decode("utf-8"))
+        try:
+            record = self.server.backend.put(self._key("/records/"), payload["data"], payload["expected_version"])
+            self._send_json(200, record.to_dict())
+        except VersionConflictError as e:
+            self._send_json(409, {"error": str(e), "current_version": e.current_version})
+
+    def do_DELETE(self):
+        if not self.path.startswith("/records/"):
+            self._send_json(404, {"error": "not found"})
+            return
+        deleted = self.server.backend.delete(self._key("/records/"))
+        self._send_json(200 if deleted else 404, {"deleted": deleted})
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StateServer(ThreadingHTTPServer):
+    """本地共享状态服务，内部使用 InProcessStateBackend 保存所有记录。"""
+
+    daemon_threads = True
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 7870):
+        super().__init__((host, port), _StateRequestHandler)
+        self.backend = InProcessStateBackend()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start_in_thread(self) -> threading.Thread:
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+
+class HTTPStateBackend(StateBackend):
+    """StateServer 的客户端，每个应用进程各持有一个。
+
+    连接失败、非预期的状态码或无法解析的响应都抛出 StateBackendError。
+    """
+
+    def __init__(self, base_url: str, timeout: float = 5.0):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+
+    def _request(self, method, path, payload=None, expected=(200,)):
+        """返回 (状态码, 响应 JSON)，状态码不在 expected 中时抛出 StateBackendError。"""
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8") if payload is not None else None
+        req = urllib.request.Request(self.base_url + path, data=data, method=method,
+                                     headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+                status, body = resp.status, resp.read()
+        except urllib.error.HTTPError as e:
+            status, body = e.code, e.read()
+        except (urllib.error.URLError, OSError) as e:
+            raise StateBackendError(f"{method} {path} 失败：{e}") from e
+        if status not in expected:
+            raise StateBackendError(f"{method} {path} 返回 HTTP {status}：{body[:200]!r}")
+        try:
+            return status, json.loads(body.decode("utf-8") or "{}")
+        except ValueError as e:
+            raise StateBackendError(f"{method} {path} 返回了无法解析的响应：{body[:200]!r}") from e
+
+    @staticmethod
+    def _quote(key):
+        return urllib.parse.quote(key, safe="")
+
+    def get(self, key):
+        status, payload = self._request("GET", f"/records/{self._quote(key)}", expected=(200, 404))
+        if status == 404:
+            return None
+        return self._record(payload)
+
+    def get_version(self, key):
+        _, payload = self._request("GET", f"/versions/{self._quote(key)}")
+        try:
+            return int(payload["version"])
+        except (KeyError, TypeError, ValueError) as e:
+            raise StateBackendError(f"版本号响应格式错误：{payload!r}") from e
+
+    def put(self, key, data, expected_version):
+        status, payload = self._request("PUT", f"/records/{self._quote(key)}",
+                                        {"data": data, "expected_version": expected_version}, expected=(200, 409))
+        if status == 409:
+            raise VersionConflictError(key, expected_version, payload.get("current_version"))
+        return self._record(payload)
+
+    def delete(self, key):
+        status, _ = self._request("DELETE", f"/records/{self._quote(key)}", expected=(200, 404))
+        return status == 200
+
+    @staticmethod
+    def _record(payload):
+        try:
+            return SessionRecord.from_dict(payload)
+        except (KeyError, TypeError) as e:
+            raise StateBackendError(f"会话记录响应格式错误：{str(payload)[:200]}") from e
+
+
+def create_backend(kind: Optional[str] = None) -> StateBackend:
+    """根据 config.STATE_BACKEND 创建后端实例。"""
+    kind = kind or config.STATE_BACKEND
+    if kind == "memory":
+        return InProcessStateBackend()
+    if kind == "server":
+        return HTTPStateBackend(config.STATE_SERVER_URL)
+    raise ValueError(f"未知的状态后端类型: {kind}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="启动共享会话状态服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=7870)
+    args = parser.parse_args()
+
+    server = StateServer(args.host, args.port)
+    print(f"共享状态服务已启动：{server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
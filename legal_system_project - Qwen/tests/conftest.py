@@ -0,0 +1,66 @@
+"""测试公共设置。
+
+模块都是项目根目录下的平铺模块，测试时把根目录加入 sys.path。config 在导入时读取环境变量，
+这里先关闭需要下载模型的向量路由、相似案例检索和报告预生成，并把任务库等文件放到临时目录。
+"""
+import os
+import sys
+import tempfile
+from types import SimpleNamespace
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+_WORK_DIR = tempfile.mkdtemp(prefix="legal_tests_")
+for _name, _value in {
+    "STATE_BACKEND": "memory",
+    "ROUTER_ENABLED": "0",
+    "CASE_RETRIEVAL_ENABLED": "0",
+    "REPORT_PREFETCH_ENABLED": "0",
+    "CONTRACT_REVIEW_WORKERS": "0",
+    "CONTRACT_JOB_DB": os.path.join(_WORK_DIR, "jobs.sqlite3"),
+    "CONTRACT_JOB_DIR": os.path.join(_WORK_DIR, "files"),
+    "SEARCH_INDEX_PATH": os.path.join(_WORK_DIR, "case_search.db"),
+}.items():
+    os.environ.setdefault(_name, _value)
+
+
+def fake_dashscope_stream(*chunks):
+    """DashScope Generation.call(stream=True, incremental_output=True) 的返回值。"""
+    return iter(
+        SimpleNamespace(status_code=200, output=SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=chunk))]))
+        for chunk in chunks
+    )
+
+
+@pytest.fixture
+def app_module(tmp_path, monkeypatch):
+    """导入 app.py，模型调用替换为固定回复；历史记录等文件写到临时目录。"""
+    for name in ("gradio", "dashscope", "openai", "pandas"):
+        pytest.importorskip(name)
+    import app
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(app, "state_backend", app.state_store.InProcessStateBackend())
+    monkeypatch.setattr(app, "user_states", {})
+    monkeypatch.setattr(app, "user_chat_histories", {})
+    monkeypatch.setattr(app.paralegal, "polish_user_input", lambda message, *args, **kwargs: message)
+
+    calls = []
+
+    def call(model, messages, **kwargs):
+        calls.append({"model": model, "messages": [dict(m) for m in messages]})
+        return fake_dashscope_stream("请问您在公司", f"工作了多久？（第{len(calls)}次回复）")
+
+    monkeypatch.setattr(app.Generation, "call", call)
+    app.model_calls = calls
+    return app
+
+
+@pytest.fixture
+def ui_request():
+    """Gradio 请求对象中 get_user_id_from_request 用到的部分。"""
+    return SimpleNamespace(headers={"user-agent": "pytest-browser"}, client=SimpleNamespace(host="127.0.0.1"))
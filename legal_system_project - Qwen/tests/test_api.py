@@ -0,0 +1,92 @@
+import json
+import os
+
+import pytest
+
+import config
+
+
+@pytest.fixture
+def client(app_module):
+    pytest.importorskip("sse_starlette")
+    from fastapi.testclient import TestClient
+
+    import api
+
+    return TestClient(api.api)
+
+
+def _save_report(report_id, user_id, conversation="公司突然辞退了我"):
+    os.makedirs("case_analysis_results", exist_ok=True)
+    with open(os.path.join("case_analysis_results", f"{report_id}.json"), 'w', encoding='utf-8') as f:
+        json.dump({"timestamp": report_id[-15:], "user_id": user_id, "case_type": "劳动合同解除",
+                   "conversation": conversation, "status": "complete"}, f, ensure_ascii=False)
+
+
+def _user_id(token):
+    import api
+
+    return api._user_id_from_token(token)
+
+
+def test_case_reports_require_owner(client):
+    _save_report("case_analysis_20250801_100000", _user_id("alice"))
+    _save_report("case_analysis_20250802_100000", _user_id("bob"))
+
+    assert client.get("/api/case-reports").status_code == 401
+    listed = client.get("/api/case-reports", headers={"X-Session-Token": "alice"}).json()
+    assert [item["id"] for item in listed["items"]] == ["case_analysis_20250801_100000"]
+    assert listed["total"] == 1
+
+    own = client.get("/api/case-reports/case_analysis_20250801_100000", headers={"X-Session-Token": "alice"})
+    assert own.status_code == 200 and own.json()["user_id"] == _user_id("alice")
+    other = client.get("/api/case-reports/case_analysis_20250802_100000", headers={"X-Session-Token": "alice"})
+    assert other.status_code == 404
+
+
+def test_admin_token_lists_all_reports(client, monkeypatch):
+    _save_report("case_analysis_20250801_100000", _user_id("alice"))
+    _save_report("case_analysis_20250802_100000", _user_id("bob"))
+
+    # 未配置管理员令牌时，任何令牌都不能当作管理员
+    assert client.get("/api/case-reports", headers={"X-Admin-Token": ""}).status_code == 401
+    monkeypatch.setattr(config, "ADMIN_API_TOKEN", "secret")
+    assert client.get("/api/case-reports", headers={"X-Admin-Token": "wrong"}).status_code == 401
+    listed = client.get("/api/case-reports", headers={"X-Admin-Token": "secret"}).json()
+    assert listed["total"] == 2
+    assert client.get("/api/case-reports/case_analysis_20250802_100000",
+                      headers={"X-Admin-Token": "secret"}).status_code == 200
+
+
+def test_search_only_returns_callers_reports(client, monkeypatch, tmp_path):
+    import search_index
+
+    monkeypatch.setattr(search_index, "_default_index", search_index.CaseSearchIndex(str(tmp_path / "search.db")))
+    _save_report("case_analysis_20250801_100000", _user_id("alice"), "公司拖欠工资三个月")
+    _save_report("case_analysis_20250802_100000", _user_id("bob"), "公司拖欠工资半年")
+    search_index.get_index().sync("case_analysis_results")
+
+    assert client.get("/api/case-reports/search", params={"q": "工资"}).status_code == 401
+    result = client.get("/api/case-reports/search", params={"q": "工资"}, headers={"X-Session-Token": "alice"}).json()
+    assert [item["id"] for item in result["items"]] == ["case_analysis_20250801_100000"]
+    assert "半年" not in json.dumps(result, ensure_ascii=False)
+
+
+def test_metrics_require_admin_token(client, monkeypatch):
+    assert client.get("/api/metrics").status_code == 403
+    monkeypatch.setattr(config, "ADMIN_API_TOKEN", "secret")
+    assert client.get("/api/metrics", headers={"X-Admin-Token": "wrong"}).status_code == 403
+    assert client.get("/api/metrics", headers={"X-Admin-Token": "secret"}).status_code == 200
+
+
+def test_lifespan_starts_contract_workers(app_module, monkeypatch):
+    pytest.importorskip("sse_starlette")
+    from fastapi.testclient import TestClient
+
+    import api
+
+    started = []
+    monkeypatch.setattr(config, "CONTRACT_REVIEW_WORKERS", 2)
+    monkeypatch.setattr(api.contract_jobs, "start_worker_pool", lambda num_workers: started.append(num_workers) or [])
+    with TestClient(api.api):
+        assert started == [2]
@@ -0,0 +1,94 @@
+import config
+
+CASE_MESSAGES = [
+    "公司突然辞退了我，我该怎么办？",
+    "我在公司工作了三年，签了劳动合同",
+    "公司没有提前通知，也没有说明理由",
+    "离职时没有给任何补偿",
+]
+
+
+def test_case_consultation_advances_every_ui_turn(app_module, ui_request):
+    app = app_module
+    app.initialize_user_session_with_prompt(ui_request)
+
+    for round_number, message in enumerate(CASE_MESSAGES, start=1):
+        snapshots = list(app.unified_chat_with_clear(message, config.CHAT_HISTORY_WINDOW, ui_request))
+        assert snapshots
+
+        _, state = app.get_or_create_user_state(ui_request)
+        assert state.current_mode == "case_strategy"
+        assert state.user_input_round == round_number
+        # 系统提示词 + 每轮一问一答
+        assert len(state.case_conversation_history) == 1 + 2 * round_number
+
+    # 第一轮只确认案件类型，之后每轮调用一次律师模型，且带上了之前的全部对话
+    assert len(app.model_calls) == len(CASE_MESSAGES) - 1
+    last_messages = [m["content"] for m in app.model_calls[-1]["messages"]]
+    assert CASE_MESSAGES[1] in last_messages and CASE_MESSAGES[-1] in last_messages
+
+
+def test_state_survives_reload_from_backend(app_module, ui_request):
+    """另一个副本写入后，本进程的缓存按版本号重新加载，继续在最新状态上推进。"""
+    app = app_module
+    for message in CASE_MESSAGES[:2]:
+        list(app.unified_chat_with_clear(message, config.CHAT_HISTORY_WINDOW, ui_request))
+    app.user_states.clear()
+
+    list(app.unified_chat_with_clear(CASE_MESSAGES[2], config.CHAT_HISTORY_WINDOW, ui_request))
+    _, state = app.get_or_create_user_state(ui_request)
+    assert state.user_input_round == 3
+    assert len(state.case_conversation_history) == 7
+
+
+def test_api_turns_persist_history(app_module):
+    """API 调用不传 history，最终保存的应是本轮最后产出的完整历史。"""
+    app = app_module
+    for message in CASE_MESSAGES[:3]:
+        snapshots = list(app.unified_chat(message, None, None, user_id="api-user"))
+        history, state = app.load_user_chat_history("api-user")
+        assert history is not None
+        assert [list(turn) for turn in history] == [list(turn) for turn in snapshots[-1]]
+
+    assert [turn[0] for turn in history] == CASE_MESSAGES[:3]
+    assert state.user_input_round == 3
+    # 第三轮的律师调用带上了第二轮的内容
+    assert CASE_MESSAGES[1] in [m["content"] for m in app.model_calls[-1]["messages"]]
+
+
+def test_conflicting_saves_keep_both_turns(app_module):
+    """同一用户的两个请求基于同一版本并发完成时，后保存的一方合并而不是丢弃本轮。"""
+    app = app_module
+    app.save_user_chat_history("busy-user", [["你好", "您好"]], app.SystemState())
+    _, first = app.load_user_chat_history("busy-user")
+    _, second = app.load_user_chat_history("busy-user")
+
+    assert app.save_user_chat_history("busy-user", [["你好", "您好"], ["问题一", "回答一"]], first)
+    second.user_input_round = 2
+    assert app.save_user_chat_history("busy-user", [["你好", "您好"], ["问题二", "回答二"]], second)
+
+    history, state = app.load_user_chat_history("busy-user")
+    assert [turn[0] for turn in history] == ["你好", "问题一", "问题二"]
+    assert state.user_input_round == 2 and state.version == second.version == 3
+
+
+def test_api_turns_reuse_cached_state(app_module, monkeypatch):
+    """API 调用不传 history 时，后端版本未变就直接使用本进程缓存的状态和历史，不重新解析。"""
+    app = app_module
+    parsed = []
+    from_dict = app.SystemState.from_dict
+    monkeypatch.setattr(app.SystemState, "from_dict",
+                        classmethod(lambda cls, data: parsed.append(data) or from_dict(data)))
+
+    for message in CASE_MESSAGES[:3]:
+        snapshots = list(app.unified_chat(message, None, None, user_id="cached-user"))
+    assert parsed == []
+    assert [turn[0] for turn in snapshots[-1]] == CASE_MESSAGES[:3]
+
+    # 其他副本写入了新版本：重新加载
+    record = app.state_backend.get("cached-user")
+    data = dict(record.data, chat_history=record.data["chat_history"] + [["其他副本", "回复"]])
+    app.state_backend.put("cached-user", data, expected_version=record.version)
+    snapshots = list(app.unified_chat(CASE_MESSAGES[3], None, None, user_id="cached-user"))
+    assert parsed
+    assert [turn[0] for turn in snapshots[-1]] == CASE_MESSAGES[:3] + ["其他副本", CASE_MESSAGES[3]]
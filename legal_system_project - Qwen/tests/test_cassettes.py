@@ -0,0 +1,107 @@
+import json
+import os
+
+import cassettes
+import config
+from benchmarks.replay_scenarios import run_scenario
+from transcript import CaseTranscript
+
+CONFIRMATION = ("您好！我是您的专业劳动法律师，很高兴为您提供法律咨询服务。我了解您的案件类型是：劳动合同解除\n\n"
+                "现在让我们开始详细了解您的具体情况。")
+USER_MESSAGES = [
+    "我在公司工作了三年，签了劳动合同",
+    "公司没有提前通知，也没有说明理由",
+    "离职时没有给任何补偿",
+    "我每个月工资八千元",
+    "公司说我绩效不合格",
+    "我有绩效考核的记录",
+]
+LAWYER_REPLIES = [f"明白了，请问第{i}个问题您能补充一下吗？" for i in range(1, len(USER_MESSAGES) + 1)]
+
+
+def _conversation():
+    turns = [{"from": "human", "value": "公司突然辞退了我，我该怎么办？"}, {"from": "gpt", "value": CONFIRMATION}]
+    for message, reply in zip(USER_MESSAGES, LAWYER_REPLIES):
+        turns += [{"from": "human", "value": message}, {"from": "gpt", "value": reply}]
+    return {"system_prompt": "系统提示", "conversations": turns}
+
+
+def test_canned_replies_have_no_model_calls():
+    cassette = cassettes.cassette_from_conversation(_conversation(), "sample")
+
+    models = [interaction["model"] for interaction in cassette.interactions]
+    # 第一轮只确认案件类型；之后前五轮先润色再调用律师，第六轮不再润色
+    assert models == [config.PARALEGAL_MODEL, config.LAWYER_MODEL] * 5 + [config.LAWYER_MODEL]
+    assert len(cassette.scenario["inputs"]) == 1 + len(USER_MESSAGES)
+    # 律师调用的消息里包含案件类型确认：系统提示、第一条消息、确认、本轮消息
+    assert cassette.interactions[1]["request"]["message_count"] == 4
+
+
+def test_retry_prompt_has_no_model_calls():
+    conversation = {"conversations": [
+        {"from": "human", "value": "你好"},
+        {"from": "gpt", "value": "抱歉，我暂时无法对你的描述进行案件类型判断，请您重新描述您的情况。"},
+        {"from": "human", "value": "我被辞退了"},
+        {"from": "gpt", "value": CONFIRMATION},
+        {"from": "human", "value": USER_MESSAGES[0]},
+        {"from": "gpt", "value": LAWYER_REPLIES[0]},
+    ]}
+    cassette = cassettes.cassette_from_conversation(conversation, "retry")
+    assert [i["model"] for i in cassette.interactions] == [config.PARALEGAL_MODEL, config.LAWYER_MODEL]
+
+
+def test_replay_reproduces_every_lawyer_reply(app_module, tmp_path, monkeypatch):
+    app = app_module
+    # 润色和律师调用都由 cassette 回放
+    monkeypatch.setattr(app.paralegal, "polish_user_input",
+                        type(app.paralegal).polish_user_input.__get__(app.paralegal))
+    path = str(tmp_path / "sample.json")
+    cassettes.cassette_from_conversation(_conversation(), "sample").save(path)
+
+    player = cassettes.replaying(path)
+    replies = []
+    with player:
+        app.reset_system(user_id="replay-user")
+        for message in player.cassette.scenario["inputs"]:
+            snapshots = list(app.unified_chat(message, None, None, user_id="replay-user"))
+            replies.append(snapshots[-1][-1][1])
+
+    assert player.misses == 0
+    assert len(player._used) == len(player.cassette.interactions)
+    assert replies[0].startswith("【案件类型确认】")
+    for reply, expected in zip(replies[1:], LAWYER_REPLIES):
+        assert expected in reply
+
+    _, totals, misses = run_scenario(app, path, realtime=False, speed=1.0)
+    assert misses == 0 and len(totals) == 1 + len(USER_MESSAGES)
+
+
+def test_build_matches_reports_in_one_pass(tmp_path, monkeypatch):
+    datasets, reports, out = tmp_path / "datasets", tmp_path / "reports", tmp_path / "out"
+    for directory in (datasets, reports, out):
+        directory.mkdir()
+    regenerated = _conversation()
+    consulted = {"conversations": [{"from": "human", "value": "公司拖欠了我三个月的工资"},
+                                   {"from": "gpt", "value": LAWYER_REPLIES[0]}]}
+    unmatched = {"conversations": [{"from": "human", "value": "加班费怎么算"}, {"from": "gpt", "value": LAWYER_REPLIES[1]}]}
+    (datasets / "data.json").write_text(json.dumps([regenerated, consulted, unmatched], ensure_ascii=False), encoding="utf-8")
+
+    # regenerate_reports 生成的报告按内容哈希匹配；界面咨询的报告对话不同，按首条用户消息开头匹配
+    transcript = CaseTranscript.from_sharegpt(regenerated)
+    (reports / "a.json").write_text(json.dumps({"conversation_hash": transcript.content_hash, "conversation": "",
+                                                "case_analysis": "报告一"}, ensure_ascii=False), encoding="utf-8")
+    (reports / "b.json").write_text(json.dumps({"conversation_hash": "other",
+                                                "conversation": "用户: 公司拖欠了我三个月的工资\n\n律师: 【案件类型确认】...",
+                                                "case_analysis": "报告二"}, ensure_ascii=False), encoding="utf-8")
+
+    loads, report_texts = [], []
+    original_load, original_build = json.load, cassettes.cassette_from_conversation
+    monkeypatch.setattr(json, "load", lambda f, **kwargs: loads.append(f.name) or original_load(f, **kwargs))
+    monkeypatch.setattr(cassettes, "cassette_from_conversation",
+                        lambda *args, **kwargs: report_texts.append(kwargs.get("report_text"))
+                        or original_build(*args, **kwargs))
+    cassettes.build_from_datasets(str(datasets), str(out), str(reports))
+
+    # 每个报告文件只读取一次，与对话数量无关
+    assert sorted(os.path.basename(name) for name in loads) == ["a.json", "b.json", "data.json"]
+    assert report_texts == ["报告一", "报告二", None]
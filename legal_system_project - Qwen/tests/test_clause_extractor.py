@@ -0,0 +1,83 @@
+import clause_extractor
+
+_NUMBERS = "一二三四五六七八九十"
+_HEADER = "甲方（用人单位）：某某科技有限公司  法定代表人：张三\n乙方（劳动者）：李四  身份证号码：110101199001011234\n"
+
+
+def build_contract(clauses):
+    body = "\n".join(f"第{_NUMBERS[i] if i < 10 else '十' + _NUMBERS[i - 10]}条 {clause}" for i, clause in enumerate(clauses))
+    return _HEADER + body
+
+
+STANDARD_CLAUSES = [
+    "合同期限\n本合同为固定期限劳动合同，自2024年1月1日起至2026年12月31日止，试用期三个月。",
+    "工作内容和工作地点\n乙方在销售岗位工作，工作地点为北京市朝阳区。",
+    "工作时间\n实行标准工时制，每日工作八小时，每周休息两天。",
+    "劳动报酬\n乙方月工资8000元，于每月十日前支付。",
+    "社会保险\n甲方依法为乙方缴纳社会保险。",
+    "劳动保护\n甲方为乙方提供符合国家规定的劳动条件和劳动防护用品。",
+]
+
+
+def test_missing_required_items_are_reported():
+    extraction = clause_extractor.extract(build_contract(STANDARD_CLAUSES[:4] + ["其他\n双方应诚实守信。"]))
+    assert extraction.missing_required == ["社会保险", "劳动保护、劳动条件和职业危害防护"]
+    assert "社会保险" in extraction.missing_note()
+
+
+def test_compact_text_keeps_untagged_and_risky_clauses():
+    culture = "企业文化\n" + "乙方应认同并践行公司的价值观，积极参加公司组织的团队建设活动。" * 60
+    clauses = STANDARD_CLAUSES + [
+        culture,
+        "入职\n乙方入职时须向甲方缴纳押金2000元。",
+        "其他约定\n乙方在合同期内不得结婚生育，否则本合同自动失效。",
+        "附则\n本合同一式两份，双方各执一份，具有同等法律效力。",
+    ]
+    text = build_contract(clauses)
+    extraction = clause_extractor.extract(text)
+    compact = extraction.compact_text()
+
+    assert compact is not None and len(compact) < len(text)
+    assert "乙方入职时须向甲方缴纳押金2000元" in compact
+    assert "乙方在合同期内不得结婚生育，否则本合同自动失效" in compact
+    # 未命中任何检查项的条款截断后仍然保留
+    assert "[第七条｜未标注]\n第七条 企业文化" in compact
+    # 只删去纯格式性条款
+    assert "一式两份" not in compact
+    assert extraction.risky_clauses == ["第八条", "第九条"]
+    assert "第八条、第九条" in extraction.summary()
+
+
+def test_long_tagged_clauses_are_not_truncated():
+    non_compete = "竞业限制\n" + "乙方离职后两年内不得在与甲方有竞争关系的单位任职。" * 40 + "违反本条的，甲方有权罚款十万元。"
+    culture = "企业文化\n" + "乙方应认同并践行公司的价值观，积极参加公司组织的团队建设活动。" * 60
+    text = build_contract(STANDARD_CLAUSES + [non_compete, culture])
+    compact = clause_extractor.extract(text).compact_text()
+
+    assert compact is not None
+    assert non_compete.index("罚款") > 800
+    assert "违反本条的，甲方有权罚款十万元。" in compact
+
+
+def test_compact_text_over_limit_falls_back_to_full_text():
+    culture = "企业文化\n" + "乙方应认同并践行公司的价值观，积极参加公司组织的团队建设活动。" * 60
+    extraction = clause_extractor.extract(build_contract(STANDARD_CLAUSES + [culture]))
+    assert extraction.compact_text() is not None
+    assert extraction.compact_text(max_chars=200) is None
+
+
+def test_boilerplate_with_risk_terms_is_kept():
+    clause = clause_extractor.Clause(1, "第十条 本合同一式两份，乙方放弃缴纳社会保险，签字盖章后生效。", "第十条")
+    assert clause.risky and not clause.boilerplate
+
+
+def test_decimal_numbers_do_not_start_clauses():
+    clauses = clause_extractor.segment_clauses("第一条 加班\n工作日加班按\n1.5倍支付加班费。\n第二条 休假")
+    assert [clause.label for clause in clauses] == ["第一条", "第二条"]
+
+
+def test_short_segmentation_is_not_compacted():
+    extraction = clause_extractor.extract("劳动合同\n工资每月8000元。")
+    assert not extraction.reliable
+    assert extraction.compact_text() is None
+    assert extraction.missing_required == []
@@ -0,0 +1,268 @@
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import threading
+
+import pytest
+
+import contract_jobs
+
+
+def make_queue(tmp_path):
+    return contract_jobs.ContractJobQueue(str(tmp_path / "jobs.sqlite3"), str(tmp_path / "files"))
+
+
+def submit_contract(app, tmp_path, monkeypatch):
+    """把 app 的任务队列换成临时队列（没有 worker，任务一直排队），返回记录任务编号的列表。"""
+    queue = make_queue(tmp_path)
+    monkeypatch.setattr(app, "contract_job_queue", queue)
+    job_ids = []
+    submit = queue.submit
+    monkeypatch.setattr(queue, "submit", lambda *args, **kwargs: job_ids.append(submit(*args, **kwargs)) or job_ids[-1])
+    contract = tmp_path / "contract.pdf"
+    contract.write_bytes(b"%PDF-1.4")
+    return queue, job_ids, str(contract)
+
+
+def test_client_disconnect_cancels_job(app_module, tmp_path, monkeypatch):
+    app = app_module
+    queue, job_ids, contract = submit_contract(app, tmp_path, monkeypatch)
+
+    stream = app.analyze_contracts([contract], user_id="contract-user")
+    assert "已提交" in next(stream)
+    # Gradio 在客户端断开时关闭生成器
+    stream.close()
+
+    job = queue.get(job_ids[0])
+    assert job["status"] == "cancelled" and job["cancel_requested"] == 1
+
+
+def test_cancelled_turn_cancels_job(app_module, tmp_path, monkeypatch):
+    app = app_module
+    queue, job_ids, contract = submit_contract(app, tmp_path, monkeypatch)
+    token = app.cancellation.CancellationToken()
+
+    stream = app.analyze_contracts([contract], cancel_token=token, user_id="contract-user")
+    next(stream)
+    token.cancel("superseded")
+    # 取消在收到下一次输出时生效
+    queue.append_event(job_ids[0], "append", "正在识别合同类型...")
+    assert list(stream) == []
+    assert queue.get(job_ids[0])["status"] == "cancelled"
+
+
+def submit_file(queue, tmp_path, user_id="contract-user"):
+    contract = tmp_path / "contract.docx"
+    contract.write_bytes(b"PK")
+    job_id = queue.submit([str(contract)], user_id=user_id)
+    return job_id, tmp_path / "files" / job_id
+
+
+def test_job_files_are_removed_when_finished(tmp_path):
+    queue = make_queue(tmp_path)
+    done_id, done_dir = submit_file(queue, tmp_path)
+    cancelled_id, cancelled_dir = submit_file(queue, tmp_path)
+    assert done_dir.is_dir() and cancelled_dir.is_dir()
+
+    queue.claim("worker")
+    queue.finish(done_id, "done")
+    # 排队中的任务取消后直接结束
+    queue.request_cancel(cancelled_id)
+
+    assert not done_dir.exists() and not cancelled_dir.exists()
+    assert queue.get(cancelled_id)["status"] == "cancelled"
+
+
+def test_sweep_requeues_stale_jobs(tmp_path, monkeypatch):
+    queue = make_queue(tmp_path)
+    stale_id, stale_dir = submit_file(queue, tmp_path)
+    abandoned_id, abandoned_dir = submit_file(queue, tmp_path)
+    live_id, _ = submit_file(queue, tmp_path)
+    for _ in range(3):
+        queue.claim("worker")
+    queue.request_cancel(abandoned_id)
+    with queue._connect() as conn:
+        conn.execute("UPDATE jobs SET heartbeat = heartbeat - 1000 WHERE id IN (?, ?)", (stale_id, abandoned_id))
+    queue.heartbeat(live_id)
+
+    assert queue.sweep() == 1
+    assert queue.get(stale_id)["status"] == "queued" and stale_dir.is_dir()
+    # 已请求取消的任务不再执行
+    assert queue.get(abandoned_id)["status"] == "cancelled" and not abandoned_dir.exists()
+    assert queue.get(live_id)["status"] == "running"
+    assert queue.claim("worker")["id"] == stale_id
+
+
+def test_worker_heartbeat_keeps_slow_job_running(tmp_path, monkeypatch):
+    monkeypatch.setattr(contract_jobs.config, "CONTRACT_JOB_HEARTBEAT_INTERVAL", 0.05)
+    queue = make_queue(tmp_path)
+    job_id, _ = submit_file(queue, tmp_path)
+    job = queue.claim("worker")
+
+    class SlowAnalyzer:
+        def review_files(self, file_paths, deadline):
+            started = queue.get(job_id)["heartbeat"]
+            # 长时间的 OCR，没有任何输出
+            threading.Event().wait(0.3)
+            assert queue.get(job_id)["heartbeat"] > started
+            yield "审查完成"
+
+    contract_jobs.run_job(queue, SlowAnalyzer(), job)
+    assert queue.get(job_id)["status"] == "done"
+    assert queue.read_text(job_id)[0] == "审查完成"
+
+
+def test_old_database_gains_user_column(tmp_path):
+    db_path = tmp_path / "old.sqlite3"
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("CREATE TABLE jobs (id TEXT PRIMARY KEY, status TEXT NOT NULL, file_paths TEXT NOT NULL, "
+                     "created_at REAL NOT NULL, started_at REAL, finished_at REAL, heartbeat REAL, worker TEXT, "
+                     "attempts INTEGER NOT NULL DEFAULT 0, cancel_requested INTEGER NOT NULL DEFAULT 0, error TEXT)")
+        conn.execute("INSERT INTO jobs (id, status, file_paths, created_at) VALUES ('old', 'done', '[]', 1)")
+    queue = contract_jobs.ContractJobQueue(str(db_path), str(tmp_path / "files"))
+    assert queue.get("old")["user_id"] is None and queue.get("old")["deadline_at"] is None
+
+
+def test_resume_review_by_job_id(app_module, tmp_path, monkeypatch):
+    pytest.importorskip("sse_starlette")
+    from fastapi.testclient import TestClient
+
+    import api
+
+    app = app_module
+    queue = make_queue(tmp_path)
+    monkeypatch.setattr(app, "contract_job_queue", queue)
+    token = "resume-session"
+    job_id, _ = submit_file(queue, tmp_path, user_id=api._user_id_from_token(token))
+    queue.claim("worker")
+    queue.append_event(job_id, "replace", "📄 正在识别合同类型...")
+    queue.append_event(job_id, "append", "\n审查完成")
+    queue.finish(job_id, "done")
+
+    client = TestClient(api.api)
+    response = client.get(f"/api/contracts/{job_id}", headers={"X-Session-Token": token})
+    assert response.status_code == 200
+    assert "审查完成" in response.text and "event: done" in response.text
+    # 其他会话不能获取
+    assert client.get(f"/api/contracts/{job_id}", headers={"X-Session-Token": "other"}).status_code == 404
+
+
+def test_attached_stream_follows_requeued_job(tmp_path):
+    """worker 崩溃后任务重新执行，已连接的 stream 丢弃上一次的文本并读到新一次的全部输出。"""
+    queue = make_queue(tmp_path)
+    job_id, _ = submit_file(queue, tmp_path)
+    queue.claim("worker-1")
+    queue.append_event(job_id, "replace", "第一次：")
+    queue.append_event(job_id, "append", "识别中")
+
+    stream = queue.stream(job_id, poll_interval=0.01)
+    assert next(stream) == "第一次：识别中"
+
+    assert queue.requeue_stale(timeout=-1) == 1
+    queue.claim("worker-2")
+    assert queue.get(job_id)["attempts"] == 2
+    queue.append_event(job_id, "replace", "第二次：")
+    queue.append_event(job_id, "append", "分析")
+    queue.append_event(job_id, "append", "完成")
+    queue.finish(job_id)
+
+    outputs = list(stream)
+    assert outputs[-1] == "第二次：分析完成"
+    assert not any(text.startswith("第一次") for text in outputs)
+
+
+def test_worker_pool_starts_once_per_database(tmp_path, monkeypatch):
+    monkeypatch.setattr(contract_jobs, "_pool_lock", None)
+    db_path = str(tmp_path / "jobs.sqlite3")
+    assert contract_jobs.start_worker_pool(0, db_path, str(tmp_path / "files")) == []
+    lock = contract_jobs._pool_lock
+    try:
+        assert lock is not None
+        # 同一进程再次启动、其他进程（如另一个 uvicorn worker）启动都不会得到锁
+        assert not contract_jobs._acquire_pool_lock(db_path)
+        script = f"import contract_jobs, sys; sys.exit(0 if contract_jobs._acquire_pool_lock({db_path!r}) else 3)"
+        result = subprocess.run([sys.executable, "-c", script], cwd=os.path.dirname(contract_jobs.__file__))
+        assert result.returncode == 3
+    finally:
+        lock.close()
+
+
+def test_upload_reports_submitted_job_id(app_module, tmp_path, monkeypatch):
+    pytest.importorskip("sse_starlette")
+    from fastapi.testclient import TestClient
+
+    import api
+
+    app = app_module
+    queue = make_queue(tmp_path)
+    monkeypatch.setattr(app, "contract_job_queue", queue)
+    # 同一用户之前提交的任务不影响本次返回的任务编号
+    submit_file(queue, tmp_path, user_id=api._user_id_from_token("upload-session"))
+    submitted, upload_dirs = [], []
+    submit = queue.submit
+
+    def submit_and_finish(file_paths, **kwargs):
+        job_id = submit(file_paths, **kwargs)
+        submitted.append(job_id)
+        upload_dirs.append(os.path.dirname(file_paths[0]))
+        stored = json.loads(queue.get(job_id)["file_paths"])
+        queue.claim("worker")
+        contents = "、".join(open(path, encoding="utf-8").read() for path in stored)
+        queue.append_event(job_id, "replace", f"审查完成：{contents}")
+        queue.finish(job_id)
+        return job_id
+
+    monkeypatch.setattr(queue, "submit", submit_and_finish)
+    files = [("files", ("page.jpg", b"first", "image/jpeg")), ("files", ("page.jpg", b"second", "image/jpeg"))]
+    response = TestClient(api.api).post("/api/contracts", files=files, headers={"X-Session-Token": "upload-session"})
+
+    assert response.status_code == 200
+    assert f'event: job\r\ndata: {{"job_id": "{submitted[0]}"}}' in response.text
+    # 同名文件分别保存，不会互相覆盖
+    assert "审查完成：first、second" in response.text
+    # 响应结束后删除上传目录
+    assert not os.path.exists(upload_dirs[0])
+
+
+class StreamingAnalyzer:
+    """先输出一条状态，再逐字流式输出报告。"""
+
+    def __init__(self, report, on_chunk=None):
+        self.report = report
+        self.on_chunk = on_chunk
+        self.finished = False
+
+    def review_files(self, file_paths, deadline):
+        yield "📄 正在分析合同..."
+        for end in range(1, len(self.report) + 1):
+            if self.on_chunk:
+                self.on_chunk(end)
+            yield "📄 正在分析合同...\n" + self.report[:end]
+        self.finished = True
+
+
+def test_streamed_deltas_are_batched(tmp_path):
+    queue = make_queue(tmp_path)
+    job_id, _ = submit_file(queue, tmp_path)
+    report = "经审查，本合同试用期约定合法。" * 50
+    contract_jobs.run_job(queue, StreamingAnalyzer(report), queue.claim("worker"))
+
+    assert queue.get(job_id)["status"] == "done"
+    assert queue.read_text(job_id)[0] == "📄 正在分析合同...\n" + report
+    with queue._connect() as conn:
+        events = conn.execute("SELECT COUNT(*) FROM job_events WHERE job_id = ?", (job_id,)).fetchone()[0]
+    # 每 CONTRACT_JOB_FLUSH_CHARS 个字符最多写一次，而不是每个字一次
+    assert events <= len(report) // contract_jobs.config.CONTRACT_JOB_FLUSH_CHARS + 3
+
+
+def test_cancel_is_seen_at_next_flush(tmp_path):
+    queue = make_queue(tmp_path)
+    job_id, _ = submit_file(queue, tmp_path)
+    analyzer = StreamingAnalyzer("条款" * 1000, on_chunk=lambda end: end == 10 and queue.request_cancel(job_id))
+    contract_jobs.run_job(queue, analyzer, queue.claim("worker"))
+
+    assert queue.get(job_id)["status"] == "cancelled"
+    assert not analyzer.finished
+    assert len(queue.read_text(job_id)[0]) < 2000
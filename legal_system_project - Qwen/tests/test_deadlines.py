@@ -0,0 +1,75 @@
+import threading
+
+import pytest
+
+import deadlines
+
+
+class StalledStream:
+    """模拟 OpenAI Stream：输出一个分片后阻塞在读取上，直到连接被关闭。"""
+
+    def __init__(self):
+        self.closed = threading.Event()
+        self.reader_exited = threading.Event()
+
+    def __iter__(self):
+        try:
+            yield "第一段"
+            if not self.closed.wait(5):
+                yield "连接恢复"
+            raise ConnectionError("stream closed")
+        finally:
+            self.reader_exited.set()
+
+    def close(self):
+        self.closed.set()
+
+
+def stalled_generator(stream, upstream):
+    """模拟 services 中包装上游流的生成器：建立连接后向 upstream 登记关闭函数。"""
+    upstream.attach(stream.close)
+    yield from stream
+
+
+def test_timeout_closes_stalled_stream():
+    stream = StalledStream()
+    chunks = []
+    with pytest.raises(deadlines.DeadlineExceeded):
+        for chunk in deadlines.iter_within(stream, 5, "analysis", idle_timeout=0.1):
+            chunks.append(chunk)
+
+    assert chunks == ["第一段"]
+    # 后台线程不再阻塞在读取上
+    assert stream.closed.is_set() and stream.reader_exited.wait(1)
+
+
+def test_timeout_closes_upstream_of_generator():
+    stream, upstream = StalledStream(), deadlines.Upstream()
+    with pytest.raises(deadlines.DeadlineExceeded):
+        list(deadlines.iter_within(stalled_generator(stream, upstream), 5, "contract_analysis",
+                                   idle_timeout=0.1, close=upstream.close))
+    assert stream.closed.is_set() and stream.reader_exited.wait(1)
+
+
+def test_consumer_stopping_early_closes_upstream():
+    stream, upstream = StalledStream(), deadlines.Upstream()
+    chunks = deadlines.iter_within(stalled_generator(stream, upstream), 5, "analysis", close=upstream.close)
+    assert next(chunks) == "第一段"
+    chunks.close()
+    assert stream.reader_exited.wait(1)
+
+
+def test_completed_stream_is_not_closed_by_consumer():
+    closed = []
+    upstream = deadlines.Upstream()
+    upstream.attach(lambda: closed.append(True))
+    assert list(deadlines.iter_within(iter(["a", "b"]), 5, "analysis", close=lambda: closed.append("consumer"))) == ["a", "b"]
+    assert closed == []
+
+
+def test_connection_attached_after_close_is_closed_immediately():
+    upstream = deadlines.Upstream()
+    upstream.close()
+    stream = StalledStream()
+    upstream.attach(stream.close)
+    assert stream.closed.is_set()
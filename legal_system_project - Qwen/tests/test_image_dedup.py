@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+
+cv2 = pytest.importorskip("cv2")
+
+import image_dedup
+
+_TEXT_LINES = [f"Article {i}: the employee shall work at the post assigned by the employer." for i in range(1, 31)]
+# 签署页：只有几行签署栏
+_SIGNATURE_LINES = ["Party A (seal):", "Date:", "Party B:", "Date:"]
+
+
+class FakeReader:
+    """只实现 Reader.detect：有深色像素的图片返回一个文本框。"""
+
+    def __init__(self):
+        self.detected = []
+
+    def detect(self, image):
+        self.detected.append(image.shape)
+        boxes = [[0, 10, 0, 10]] if (image < 128).any() else []
+        return [boxes], [[]]
+
+
+def write_page(path, lines, spacing=50, scale=0.9, thickness=2, shift=0):
+    image = np.full((1754, 1240, 3), 250, np.uint8)
+    for i, line in enumerate(lines):
+        cv2.putText(image, line, (100 + shift, 120 + i * spacing + shift), cv2.FONT_HERSHEY_SIMPLEX,
+                    scale, (30, 30, 30), thickness)
+    noise = np.random.RandomState(len(lines)).normal(0, 2, image.shape)
+    cv2.imwrite(str(path), (image + noise).clip(0, 255).astype(np.uint8), [cv2.IMWRITE_JPEG_QUALITY, 90])
+    return str(path)
+
+
+@pytest.fixture
+def pages(tmp_path):
+    return {
+        "text": write_page(tmp_path / "page1.jpg", _TEXT_LINES),
+        # 同一页连拍：有轻微位移
+        "duplicate": write_page(tmp_path / "page1_again.jpg", _TEXT_LINES, shift=1),
+        "other": write_page(tmp_path / "page2.jpg", _TEXT_LINES[::-1], spacing=45),
+        "blank": write_page(tmp_path / "blank.jpg", []),
+        "signature": write_page(tmp_path / "signature.jpg", _SIGNATURE_LINES, spacing=260, scale=0.6, thickness=1),
+    }
+
+
+def test_sparse_signature_page_is_below_old_threshold(pages):
+    ratio = image_dedup.edge_ratio(image_dedup._load_gray(pages["signature"]))
+    assert 0 < ratio < 0.002
+
+
+def test_duplicates_and_blank_pages_are_skipped(pages):
+    paths = [pages[name] for name in ("text", "duplicate", "blank", "signature", "other")]
+    kept, skipped = image_dedup.select_images(paths, FakeReader())
+
+    assert kept == [pages["text"], pages["signature"], pages["other"]]
+    assert skipped == [
+        {"path": pages["duplicate"], "reason": "duplicate", "duplicate_of": pages["text"]},
+        {"path": pages["blank"], "reason": "blank", "duplicate_of": None},
+    ]
+
+
+def test_blank_candidate_with_text_boxes_is_kept(pages, monkeypatch):
+    # 阈值调高后签署页也成为空白候选，由文本检测确认有文字而保留
+    monkeypatch.setattr(image_dedup.config, "IMAGE_BLANK_EDGE_RATIO", 0.01)
+    reader = FakeReader()
+    kept, skipped = image_dedup.select_images([pages["signature"], pages["blank"]], reader)
+
+    assert kept == [pages["signature"]]
+    assert [item["reason"] for item in skipped] == ["blank"]
+    # 只有空白候选才运行文本检测
+    assert len(reader.detected) == 2
+
+
+def test_detection_failure_keeps_image(pages, monkeypatch):
+    class BrokenReader:
+        def detect(self, image):
+            raise RuntimeError("model not loaded")
+
+    kept, skipped = image_dedup.select_images([pages["blank"]], BrokenReader())
+    assert kept == [pages["blank"]] and skipped == []
@@ -0,0 +1,44 @@
+import random
+
+import pytest
+
+for _name in ("cv2", "easyocr", "PyPDF2", "docx"):
+    pytest.importorskip(_name)
+
+import utils
+
+
+def naive_count(keywords, text):
+    """逐个关键词统计所有（可重叠的）出现位置。"""
+    counts = {}
+    for keyword in keywords:
+        positions = [i for i in range(len(text)) if text.startswith(keyword, i)]
+        if positions:
+            counts[keyword] = (len(positions), positions[0])
+    return counts
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("本合同由劳务派遣单位签订", {"劳务派遣": (1, 4), "派遣单位": (1, 6)}),
+    ("乙方累计工作时间安排如下", {"累计工作时间": (1, 2), "工作时间安排": (1, 4)}),
+    ("竞业限制期为两年，竞业限制期内", {"竞业限制期": (2, 0), "竞业限制": (2, 0)}),
+])
+def test_overlapping_keywords_are_counted(text, expected):
+    assert utils._CONTRACT_KEYWORD_MATCHER.count(text) == expected
+
+
+def test_matches_naive_count_on_random_text():
+    keywords = list(utils._KEYWORD_CATEGORIES)
+    alphabet = "".join(sorted(set("".join(keywords)))) + "，。的了"
+    matcher = utils.KeywordMatcher(keywords)
+    rng = random.Random(0)
+    for _ in range(50):
+        # 由关键词片段拼接，制造大量相邻和重叠的命中
+        text = "".join(rng.choice(keywords)[rng.randrange(2):] + rng.choice(alphabet) for _ in range(40))
+        assert matcher.count(text) == naive_count(keywords, text)
+
+
+def test_dispatch_contract_is_ranked_first():
+    ranking = utils.rank_contract_types("劳务派遣协议\n乙方由派遣单位派往用工单位工作，第三方用工期间遵守用工单位规章。")
+    assert ranking[0]["type"] == "劳务派遣合同"
+    assert set(ranking[0]["keywords"]) == {"劳务派遣", "派遣单位", "第三方用工"}
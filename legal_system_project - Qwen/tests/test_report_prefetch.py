@@ -0,0 +1,80 @@
+import threading
+
+import cancellation
+import report_prefetch
+
+
+class SlowAnalyzer:
+    """报告逐段输出，每段之间等待，直到令牌取消。"""
+
+    def __init__(self):
+        self.tokens = []
+        self.stopped = threading.Event()
+
+    def generate_case_analysis_stream(self, conversation_content, cancel_token=None, **kwargs):
+        self.tokens.append(cancel_token)
+        try:
+            for index in range(200):
+                if cancel_token.cancelled:
+                    return
+                yield f"第{index}段"
+                threading.Event().wait(0.01)
+        finally:
+            self.stopped.set()
+
+
+def test_cancelled_turn_stops_prefetch():
+    analyzer = SlowAnalyzer()
+    prefetcher = report_prefetch.ReportPrefetcher(analyzer)
+    turn_token = cancellation.CancellationToken()
+    report = prefetcher.start("user", "key", "对话内容", cancel_token=turn_token)
+
+    turn_token.cancel("resubmit")
+    assert analyzer.stopped.wait(5)
+    assert report.token.cancelled and report.token.reason == "resubmit"
+    assert report.token is not turn_token
+
+
+def test_discarded_prefetch_does_not_cancel_turn():
+    analyzer = SlowAnalyzer()
+    prefetcher = report_prefetch.ReportPrefetcher(analyzer)
+    turn_token = cancellation.CancellationToken()
+    report = prefetcher.start("user", "key", "对话内容", cancel_token=turn_token)
+
+    prefetcher.discard("user")
+    assert analyzer.stopped.wait(5)
+    assert report.token.cancelled and not turn_token.cancelled
+    assert prefetcher.take("user", "key") is None
+
+
+def test_reset_discards_prefetch(app_module, monkeypatch):
+    app = app_module
+    analyzer = SlowAnalyzer()
+    monkeypatch.setattr(app, "report_prefetcher", report_prefetch.ReportPrefetcher(analyzer))
+    report = app.report_prefetcher.start("reset-user", "key", "对话内容")
+
+    app.reset_system(user_id="reset-user")
+    assert analyzer.stopped.wait(5)
+    assert report.token.cancelled
+    assert app.report_prefetcher.take("reset-user", "key") is None
+
+
+def test_disconnect_discards_prefetch(app_module, monkeypatch):
+    app = app_module
+    analyzer = SlowAnalyzer()
+    monkeypatch.setattr(app, "report_prefetcher", report_prefetch.ReportPrefetcher(analyzer))
+
+    def turn(message, history, request, files, user_id, cancel_token, deadline, on_contract_job=None):
+        # 律师回复输出期间判定为收尾，开始预生成
+        app.report_prefetcher.start(user_id, "key", "对话内容", cancel_token=cancel_token)
+        yield [(message, "【律师回复】\n关键信息都梳理清楚了")]
+        yield [(message, "【律师回复】\n关键信息都梳理清楚了，祝您一切顺利")]
+
+    monkeypatch.setattr(app, "_unified_chat_turn", turn)
+    stream = app.unified_chat("没有了", None, None, user_id="gone-user")
+    next(stream)
+    stream.close()
+
+    assert analyzer.stopped.wait(5)
+    assert analyzer.tokens[0].cancelled
+    assert app.report_prefetcher.take("gone-user", "key") is None
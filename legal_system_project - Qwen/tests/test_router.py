@@ -0,0 +1,102 @@
+import math
+
+import numpy as np
+import pytest
+
+import config
+import router
+
+EXEMPLARS = {"contract_review": ["审查合同"], "case_strategy": ["被辞退了"]}
+
+
+def _query(contract, case):
+    """与两条示例的余弦相似度分别为 contract、case 的单位向量。"""
+    return [contract, case, math.sqrt(1 - contract ** 2 - case ** 2)]
+
+
+VECTORS = {
+    "审查合同": [1.0, 0.0, 0.0],
+    "被辞退了": [0.0, 1.0, 0.0],
+    "明确的合同问题": _query(0.65, 0.3),
+    "相似度不足": _query(0.55, 0.2),
+    "两类都很像": _query(0.7, 0.69),
+    "差距足够": _query(0.7, 0.6),
+}
+
+
+class StubEncoder:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, texts):
+        self.calls.append(list(texts))
+        return np.array([VECTORS[text] for text in texts], dtype=np.float32)
+
+
+@pytest.fixture
+def encoder():
+    return StubEncoder()
+
+
+@pytest.fixture
+def intent_router(encoder):
+    # 使用配置中的阈值（config.ROUTER_CONFIDENCE_THRESHOLD / ROUTER_MIN_MARGIN）
+    return router.EmbeddingRouter(EXEMPLARS, router.keyword_fast_path({"contract_review": ["合同审查"]}),
+                                  encode=encoder)
+
+
+@pytest.mark.parametrize("text, label, source", [
+    ("明确的合同问题", "contract_review", "embedding"),
+    ("相似度不足", None, "below_threshold"),
+    ("两类都很像", None, "below_threshold"),
+    ("差距足够", "contract_review", "embedding"),
+])
+def test_threshold_and_margin(intent_router, text, label, source):
+    assert config.ROUTER_CONFIDENCE_THRESHOLD == 0.6 and config.ROUTER_MIN_MARGIN == 0.02
+    result = intent_router.route(text)
+    assert (result.label, result.source) == (label, source)
+    assert result.confidence == pytest.approx(VECTORS[text][0], abs=1e-6)
+
+
+def test_fast_path_skips_encoder(intent_router, encoder):
+    encoder.calls.clear()
+    results = intent_router.route_batch(["帮我做合同审查", "差距足够"])
+    assert [(r.label, r.source) for r in results] == [("contract_review", "fast_path"), ("contract_review", "embedding")]
+    # 只有未命中快速通道的输入需要编码，且一次性编码
+    assert encoder.calls == [["差距足够"]]
+
+
+def test_exact_label_fast_path():
+    match = router.keyword_fast_path(router.CASE_TYPE_FAST_PATH, exact_labels=["1", "2"])
+    assert match(" 2 ") == "2" and match("我被辞退了") == "3" and match("你好") is None
+
+
+def test_failed_router_falls_back_to_keyword_rules(monkeypatch):
+    monkeypatch.setattr(config, "ROUTER_ENABLED", True)
+
+    def broken(*args, **kwargs):
+        raise OSError("模型文件不存在")
+
+    monkeypatch.setattr(router, "EmbeddingRouter", broken)
+    assert router.create_intent_router() is None
+    monkeypatch.setattr(config, "ROUTER_ENABLED", False)
+    assert router.create_case_type_router() is None
+
+
+def test_app_uses_keyword_rules_below_threshold(app_module, monkeypatch, encoder):
+    app = app_module
+    stub = router.EmbeddingRouter(EXEMPLARS, encode=encoder)
+    monkeypatch.setattr(app, "intent_router", stub)
+    VECTORS["我的劳动合同有没有问题"] = _query(0.3, 0.2)
+    VECTORS["帮我看看这个"] = _query(0.65, 0.3)
+    try:
+        # 向量路由没有结论时，按关键词规则判断
+        assert stub.route("我的劳动合同有没有问题").label is None
+        assert app.detect_user_intent("我的劳动合同有没有问题") == "contract_review"
+        # 向量路由有结论时直接采用
+        assert app.detect_user_intent("帮我看看这个") == "contract_review"
+    finally:
+        del VECTORS["我的劳动合同有没有问题"], VECTORS["帮我看看这个"]
+
+    monkeypatch.setattr(app, "intent_router", None)
+    assert app.detect_user_intent("我的劳动合同有没有问题") == "contract_review"
@@ -0,0 +1,35 @@
+import os
+
+import pytest
+
+import config
+import router
+from benchmarks.router_latency import SAMPLE_MESSAGES, measure_route_latency, percentile
+
+
+# 依赖真实句向量模型的延迟基准，默认不运行；路由判定的确定性测试见 test_router.py
+benchmark = pytest.mark.skipif(os.getenv("RUN_BENCHMARKS") != "1", reason="设置 RUN_BENCHMARKS=1 运行延迟基准")
+
+
+@pytest.fixture(scope="module")
+def intent_router():
+    """conftest 关闭了 ROUTER_ENABLED，这里直接构建向量路由；模型不可用时跳过。"""
+    pytest.importorskip("sentence_transformers")
+    try:
+        return router.EmbeddingRouter(router.INTENT_EXEMPLARS, router.keyword_fast_path(router.INTENT_FAST_PATH))
+    except Exception as e:
+        pytest.skip(f"句向量模型加载失败: {e}")
+
+
+@benchmark
+def test_route_p99_within_budget(intent_router):
+    timings = measure_route_latency(intent_router, rounds=20)
+    assert len(timings) == 20 * len(SAMPLE_MESSAGES)
+    assert percentile(timings, 99) <= config.ROUTER_LATENCY_BUDGET_MS
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 51
+    assert percentile(values, 99) == 99
+    assert percentile([3.0], 99) == 3.0
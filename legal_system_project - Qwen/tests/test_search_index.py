@@ -0,0 +1,84 @@
+import sqlite3
+
+import pytest
+
+import search_index
+
+REPORTS = {
+    "case_analysis_20250801_090000": "公司未签书面合同，应支付2倍工资差额。",
+    "case_analysis_20250802_090000": "提前解除未通知的，按N+1标准支付经济补偿。",
+    "case_analysis_20250803_090000": "违法解除劳动合同，应按2N支付赔偿金。",
+    "case_analysis_20250804_090000": "用人单位依第40条解除，需提前三十日通知。",
+}
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = search_index.CaseSearchIndex(str(tmp_path / "search.db"))
+    for report_id, analysis in REPORTS.items():
+        index.upsert(str(tmp_path / f"{report_id}.json"), {
+            "case_type": "劳动争议", "conversation": "用户：公司把我辞退了", "analysis_sections": {"分析": analysis},
+        }, mtime=1.0)
+    return index
+
+
+def found(index, query):
+    return sorted(item["id"][-15:-7] for item in index.search(query)["items"])
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("2倍", ["20250801"]),
+    ("2倍工资", ["20250801"]),
+    ("N+1", ["20250802"]),
+    ("n+1 经济补偿", ["20250802"]),
+    ("2N", ["20250803"]),
+    ("2N支付", ["20250803"]),
+    ("第40条", ["20250804"]),
+    ("倍", ["20250801"]),
+    ("金", ["20250803"]),
+    ("解除 通知", ["20250802", "20250804"]),
+    ("3倍", []),
+])
+def test_mixed_cjk_and_digit_terms(index, query, expected):
+    assert found(index, query) == expected
+
+
+def test_old_index_is_rebuilt_on_open(index):
+    with sqlite3.connect(index.db_path) as conn:
+        # 模拟旧版本分词写入的索引：末字没有单独成词
+        conn.execute("UPDATE analyses_fts SET analysis = '2 倍工 工资 资差 差额' WHERE rowid = 1")
+        conn.execute("PRAGMA user_version = 0")
+    assert found(index, "工资差额") == ["20250801"] and found(index, "额") == []
+
+    reopened = search_index.CaseSearchIndex(index.db_path)
+    assert found(reopened, "额") == ["20250801"]
+    assert found(reopened, "2倍") == ["20250801"]
+
+
+def test_search_scoped_to_user(tmp_path):
+    index = search_index.CaseSearchIndex(str(tmp_path / "search.db"))
+    for report_id, user_id, case_type in [("case_analysis_20250801_090000", "alice", "劳动合同解除"),
+                                          ("case_analysis_20250802_090000", "bob", "工资报酬")]:
+        index.upsert(str(tmp_path / f"{report_id}.json"), {
+            "user_id": user_id, "case_type": case_type, "conversation": "公司拖欠工资", "case_analysis": "应支付工资",
+        }, mtime=1.0)
+
+    result = index.search("工资", user_id="alice")
+    assert [item["id"] for item in result["items"]] == ["case_analysis_20250801_090000"]
+    assert result["facets"]["case_type"] == [{"value": "劳动合同解除", "count": 1}]
+    assert index.search("工资")["total"] == 2
+
+
+def test_old_index_gains_user_column(tmp_path):
+    db_path = str(tmp_path / "search.db")
+    with sqlite3.connect(db_path) as conn:
+        conn.executescript(search_index._SCHEMA.replace(",\n    user_id TEXT", "").replace(
+            "CREATE INDEX IF NOT EXISTS idx_analyses_user ON analyses (user_id, report_date);", ""))
+        conn.execute("INSERT INTO analyses (report_id, path, mtime, conversation, analysis) VALUES (?, ?, ?, '', '')",
+                     ("case_analysis_20250801_090000", str(tmp_path / "case_analysis_20250801_090000.json"), 5.0))
+
+    index = search_index.CaseSearchIndex(db_path)
+    # 旧记录没有用户，不属于任何用户；修改时间被清空，sync 时重新读取
+    assert index.search(user_id="alice")["total"] == 0
+    with sqlite3.connect(db_path) as conn:
+        assert conn.execute("SELECT mtime, user_id FROM analyses").fetchone() == (0, None)
@@ -0,0 +1,109 @@
+import os
+import subprocess
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import state_store
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 每个写入进程对同一条记录做若干次读-改-写
+_WRITER = """
+import sys
+import state_store
+
+backend = state_store.HTTPStateBackend(sys.argv[1])
+for _ in range(int(sys.argv[3])):
+    backend.update("shared-user", lambda data: {
+        "count": (data or {}).get("count", 0) + 1,
+        "writers": sorted(set((data or {}).get("writers", [])) | {sys.argv[2]}),
+    })
+"""
+
+
+@pytest.fixture
+def state_server():
+    server = state_store.StateServer("127.0.0.1", 0)
+    server.start_in_thread()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_put_rejects_stale_version():
+    backend = state_store.InProcessStateBackend()
+    record = backend.put("user", {"round": 1}, expected_version=0)
+    backend.put("user", {"round": 2}, expected_version=record.version)
+    with pytest.raises(state_store.VersionConflictError) as excinfo:
+        backend.put("user", {"round": 2}, expected_version=record.version)
+    assert excinfo.value.current_version == 2
+
+
+def test_http_backend_round_trip(state_server):
+    backend = state_store.HTTPStateBackend(state_server.url)
+    assert backend.get("用户/1") is None and backend.get_version("用户/1") == 0
+    record = backend.put("用户/1", {"history": [["你好", "您好"]]}, expected_version=0)
+    assert backend.get("用户/1").data == {"history": [["你好", "您好"]]}
+    with pytest.raises(state_store.VersionConflictError):
+        backend.put("用户/1", {}, expected_version=0)
+    assert backend.get_version("用户/1") == record.version
+    assert backend.delete("用户/1") and backend.get("用户/1") is None
+
+
+def test_concurrent_writers_in_separate_processes(state_server):
+    processes, rounds = 4, 25
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    writers = [
+        subprocess.Popen([sys.executable, "-c", _WRITER, state_server.url, f"writer-{i}", str(rounds)], cwd=ROOT, env=env)
+        for i in range(processes)
+    ]
+    assert all(writer.wait(timeout=60) == 0 for writer in writers)
+
+    record = state_server.backend.get("shared-user")
+    # 每次写入都基于最新版本，没有丢失的更新
+    assert record.data["count"] == processes * rounds
+    assert record.version == processes * rounds
+    assert record.data["writers"] == [f"writer-{i}" for i in range(processes)]
+
+
+class _BadGatewayHandler(BaseHTTPRequestHandler):
+    """模拟状态服务前面的代理在服务不可用时返回的错误页。"""
+
+    def _bad_gateway(self):
+        body = b"<html><body>502 Bad Gateway</body></html>"
+        self.send_response(502)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_PUT = do_DELETE = _bad_gateway
+
+    def log_message(self, format, *args):
+        pass
+
+
+def test_http_backend_errors_raise_backend_error():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _BadGatewayHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        backend = state_store.HTTPStateBackend(f"http://127.0.0.1:{server.server_address[1]}")
+        for call in (lambda: backend.get("user"), lambda: backend.get_version("user"),
+                     lambda: backend.put("user", {}, expected_version=0), lambda: backend.delete("user")):
+            with pytest.raises(state_store.StateBackendError, match="502"):
+                call()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    # 服务已关闭，连接失败
+    with pytest.raises(state_store.StateBackendError):
+        backend.get("user")
+
+
+def test_state_backend_is_abstract():
+    with pytest.raises(TypeError):
+        state_store.StateBackend()
@@ -0,0 +1,58 @@
+import text_normalizer
+from text_normalizer import PAGE_BREAK, normalize
+
+
+def test_form_values_on_their_own_line_are_kept():
+    text = "合同期限为\n3\n年，试用期\n2\n个月\n月工资\n800\n元\n每日工作\n8\n小时"
+    result = normalize(text)
+    for value in ("3", "2", "800", "8"):
+        assert value in result.text.split("\n")
+    assert "page_numbers" not in result.removed
+
+
+def test_explicit_page_numbers_are_removed():
+    result = normalize("第一条 合同期限\n第 1 页 共 2 页" + PAGE_BREAK + "第二条 工作内容\n- 2 -")
+    assert "页" not in result.text
+    assert "- 2 -" not in result.text
+    assert result.removed["page_numbers"] == len("第 1 页 共 2 页") + len("- 2 -")
+
+
+def test_bare_numbers_repeating_at_page_edges_are_removed():
+    bodies = ["第一条 合同期限\n试用期（月）：\n6", "第二条 劳动报酬\n月工资（元）：\n800", "第三条 工作时间\n每日（小时）：\n8"]
+    pages = [f"{body}\n{n}" for n, body in enumerate(bodies, start=1)]
+    result = normalize(PAGE_BREAK.join(pages))
+    lines = result.text.split("\n")
+    assert {"6", "800", "8"} <= set(lines)
+    assert not any(line in ("1", "2", "3") for line in lines)
+    assert result.removed["page_numbers"] == 3
+
+
+def test_single_bare_number_at_page_end_is_kept():
+    result = normalize("第一条 合同期限\n试用期（月）\n3" + PAGE_BREAK + "第二条 工作内容\n销售岗位")
+    assert "3" in result.text.split("\n")
+
+
+def test_repeated_headers_keep_first_occurrence():
+    header = "某某科技有限公司 劳动合同"
+    bodies = ["第一条 合同期限为三年", "第二条 工作地点为北京", "第三条 月工资八千元"]
+    pages = [f"{header}\n{body}\n第 {n} 页" for n, body in enumerate(bodies, start=1)]
+    result = normalize(PAGE_BREAK.join(pages))
+    assert result.text.count(header) == 1
+    assert result.removed["page_furniture"] == 2 * len(header)
+
+
+def test_photo_overlap_is_merged_with_ocr_differences():
+    first = "第三条 劳动报酬\n乙方月工资为8000元，于每月十日前以银行转账方式发放。\n第四条 社会保险\n甲方依法为乙方缴纳养老、医疗、失业、工伤和生育保险。"
+    second = "方式发放。\n第四条 社会保险\n甲方依法为乙方缴纳养老、医疗、失业、工伤和生肓保险。\n第五条 劳动保护\n甲方为乙方提供劳动条件。"
+    result = normalize(first + PAGE_BREAK + second)
+    assert result.text.count("第四条 社会保险") == 1
+    assert "第五条 劳动保护" in result.text
+    assert result.removed["overlap"] > 0
+
+
+def test_removed_chars_matches_length_difference():
+    text = "劳 动 合 同\n\n\n第一条  期限\n第 1 页"
+    result = normalize(text)
+    assert result.text == "劳动合同\n第一条  期限"
+    assert result.removed_chars == len(text) - len(result.text)
+    assert text_normalizer.NormalizedText("", 0, {}).removed_chars == 0
@@ -0,0 +1,188 @@
+"""合同文本清洗：在类型识别和深度分析之前去掉 OCR / PDF 提取带来的噪声。
+
+_extract_from_image、_extract_from_pdf 以及多张图片拼接得到的文本里常见：
+- 每页重复的页眉页脚（公司名称、合同编号、“劳动合同书”等）
+- 单独成行的页码（“第 3 页 共 8 页”、“- 3 -”、“3/8”，以及多数页面首行或末行上的单独数字）
+- 中文之间被版面折断的行、OCR 在汉字之间插入的空格
+- 相邻两张照片拍到同一段内容，分页处出现重复的行（两次识别结果可能有个别字不同）
+
+这些内容既干扰合同类型识别，也挤占分析时 15000 字的窗口。提取阶段用 PAGE_BREAK 分隔各页，
+这里逐页清洗，统计各类被删掉的字符数。
+"""
+import re
+from collections import Counter
+from difflib import SequenceMatcher
+from typing import Dict, List
+
+# 提取阶段的分页符（PDF 各页、多张图片之间）
+PAGE_BREAK = "\f"
+
+_CJK = r"一-鿿"
+# 带有页码标记的写法，出现在任何位置都可以删除
+_PAGE_NUMBER_PATTERN = re.compile(
+    r"^(?:第\s*\d+\s*页(?:\s*[/，,]?\s*共\s*\d+\s*页)?|共\s*\d+\s*页\s*第\s*\d+\s*页|[-—–]\s*\d{1,3}\s*[-—–]"
+    r"|\d{1,3}\s*/\s*\d{1,3}|page\s*\d+(?:\s*(?:of|/)\s*\d+)?)$",
+    re.IGNORECASE,
+)
+# 单独成行的数字也可能是表单中的填写值（“试用期\n2\n个月”），只有在多数页面的首行或末行都出现时才当作页码
+_BARE_NUMBER_PATTERN = re.compile(r"^\d{1,3}$")
+# OCR 把一个词识别成逐字隔开（“社 会 保 险”）；只处理连续三个以上单字，保留“第一条 合同期限”这类正常空格
+_LETTER_SPACED_PATTERN = re.compile(rf"[{_CJK}](?:[ \t　][{_CJK}]){{2,}}")
+# 以编号或“甲方”“乙方”等开头的行是新的条款 / 栏目，不与上一行合并
+_NEW_BLOCK_PATTERN = re.compile(
+    r"^(?:第\s*[一二三四五六七八九十百零〇两\d]+\s*[章条节]|[一二三四五六七八九十]+\s*[、．.]|\d{1,3}\s*[、．.]"
+    r"|[（(]\s*[一二三四五六七八九十\d]{1,3}\s*[）)]|甲方|乙方|附件|签订)"
+)
+_TERMINAL_CHARS = "。；：！？;:!?）)》」』"
+# 每页开头 / 结尾的这几行里查找页眉页脚
+_FURNITURE_LINES = 3
+# 页眉页脚至少出现在这一比例的页面上，且至少出现在三页上（只有两页时无法与拍照重叠区分）
+_FURNITURE_PAGE_RATIO = 0.5
+_MIN_FURNITURE_PAGES = 3
+# 分页处重复内容的最少字符数，太短的重复（如“甲方：”）不当作拍照重叠
+_MIN_OVERLAP_CHARS = 12
+# 重叠部分最多比较的行数，以及两行视为同一行的最低相似度
+_MAX_OVERLAP_LINES = 40
+_OVERLAP_LINE_SIMILARITY = 0.85
+# 一行长度达到本页常见整行长度的这一比例，才认为是被版面折断的
+_WRAP_LENGTH_RATIO = 0.85
+
+
+class NormalizedText:
+    def __init__(self, text: str, original_chars: int, removed: Dict[str, int]):
+        self.text = text
+        self.original_chars = original_chars
+        self.removed = removed
+
+    @property
+    def removed_chars(self) -> int:
+        return sum(self.removed.values())
+
+
+def _furniture_key(line: str) -> str:
+    # 页眉页脚中常带页码或日期，数字不参与比较
+    return re.sub(r"\d+", "#", re.sub(r"\s+", "", line))
+
+
+def _remove_page_furniture(pages: List[List[str]], removed: Counter) -> List[List[str]]:
+    if len(pages) < _MIN_FURNITURE_PAGES:
+        return pages
+    # 页眉和页脚分开统计：上一页末尾和下一页开头相同的行是拍照重叠，不是页眉页脚
+    head_counts, foot_counts = Counter(), Counter()
+    for lines in pages:
+        head_counts.update({_furniture_key(line) for line in lines[:_FURNITURE_LINES]})
+        foot_counts.update({_furniture_key(line) for line in lines[-_FURNITURE_LINES:]})
+    threshold = max(_MIN_FURNITURE_PAGES, len(pages) * _FURNITURE_PAGE_RATIO)
+    # 纯数字的行去掉数字后都一样，不按页眉页脚处理（页码由 _remove_bare_page_numbers 处理）
+    headers = {key for key, count in head_counts.items() if count >= threshold and key.strip("#")}
+    footers = {key for key, count in foot_counts.items() if count >= threshold and key.strip("#")}
+    if not headers and not footers:
+        return pages
+
+    seen = set()
+    cleaned = []
+    for lines in pages:
+        kept = []
+        for position, line in enumerate(lines):
+            key = _furniture_key(line)
+            if (position < _FURNITURE_LINES and key in headers) or \
+                    (position >= len(lines) - _FURNITURE_LINES and key in footers):
+                # 保留第一次出现（首页的标题、合同编号等仍有用）
+                if key in seen:
+                    removed["page_furniture"] += len(line)
+                    continue
+                seen.add(key)
+            kept.append(line)
+        cleaned.append(kept)
+    return cleaned
+
+
+def _remove_bare_page_numbers(pages: List[List[str]], removed: Counter) -> List[List[str]]:
+    if len(pages) < 2:
+        return pages
+    for edge in (0, -1):
+        numbered = [lines for lines in pages if _BARE_NUMBER_PATTERN.match(lines[edge])]
+        if len(numbered) < max(2, len(pages) * _FURNITURE_PAGE_RATIO):
+            continue
+        for lines in numbered:
+            removed["page_numbers"] += len(lines[edge])
+            del lines[edge]
+        pages = [lines for lines in pages if lines]
+    return pages
+
+
+def _same_line(a: str, b: str) -> bool:
+    """两次拍照的 OCR 结果常有个别字不同，相似度足够高即视为同一行。"""
+    if a == b:
+        return True
+    if abs(len(a) - len(b)) > max(len(a), len(b)) * (1 - _OVERLAP_LINE_SIMILARITY):
+        return False
+    return SequenceMatcher(None, a, b, autojunk=False).ratio() >= _OVERLAP_LINE_SIMILARITY
+
+
+def _overlap_size(previous: List[str], lines: List[str]) -> int:
+    """上一页末尾与本页开头重叠的行数。本页第一行可能只拍到半行，只要求它是对应行的结尾。"""
+    for size in range(min(len(previous), len(lines), _MAX_OVERLAP_LINES), 0, -1):
+        tail = previous[-size:]
+        if not (_same_line(tail[0], lines[0]) or tail[0].endswith(lines[0])):
+            continue
+        if all(_same_line(a, b) for a, b in zip(tail[1:], lines[1:size])):
+            return size
+    return 0
+
+
+def _remove_page_overlap(pages: List[List[str]], removed: Counter) -> List[List[str]]:
+    """上一页末尾与下一页开头重复的若干行（相邻照片拍到同一段内容）只保留上一页的一份。"""
+    cleaned = [pages[0]] if pages else []
+    for lines in pages[1:]:
+        overlap = _overlap_size(cleaned[-1], lines)
+        overlap_chars = sum(len(line) for line in lines[:overlap])
+        if overlap and overlap_chars >= _MIN_OVERLAP_CHARS:
+            removed["overlap"] += overlap_chars
+            lines = lines[overlap:]
+        cleaned.append(lines)
+    return cleaned
+
+
+def _join_wrapped_lines(lines: List[str], removed: Counter) -> str:
+    lengths = sorted(len(line) for line in lines if len(line) >= 10)
+    if not lengths:
+        return "\n".join(lines)
+    full_line = lengths[int(len(lengths) * 0.8)] if len(lengths) > 1 else lengths[0]
+    joined = [lines[0]] if lines else []
+    for line in lines[1:]:
+        previous = joined[-1]
+        if (len(previous) >= full_line * _WRAP_LENGTH_RATIO
+                and re.match(rf"[{_CJK}]", previous[-1:]) and previous[-1] not in _TERMINAL_CHARS
+                and re.match(rf"[{_CJK}\w，、]", line) and not _NEW_BLOCK_PATTERN.match(line)):
+            joined[-1] = previous + line
+            removed["line_wraps"] += 1
+        else:
+            joined.append(line)
+    return "\n".join(joined)
+
+
+def normalize(text: str) -> NormalizedText:
+    original_chars = len(text or "")
+    removed = Counter()
+    pages = []
+    for page in (text or "").split(PAGE_BREAK):
+        lines = []
+        for raw in page.splitlines():
+            line = _LETTER_SPACED_PATTERN.sub(lambda m: re.sub(r"[ \t　]", "", m.group()), raw.strip())
+            if not line:
+                continue
+            if _PAGE_NUMBER_PATTERN.match(line):
+                removed["page_numbers"] += len(line)
+                continue
+            lines.append(line)
+        if lines:
+            pages.append(lines)
+
+    pages = _remove_bare_page_numbers(pages, removed)
+    pages = _remove_page_furniture(pages, removed)
+    pages = _remove_page_overlap(pages, removed)
+    cleaned = "\n\n".join(_join_wrapped_lines(lines, removed) for lines in pages if lines)
+    # 空格、空行和分页符不逐个计数，按总差额计入 whitespace
+    removed["whitespace"] = max(0, original_chars - len(cleaned) - sum(removed.values()))
+    return NormalizedText(cleaned, original_chars, {kind: count for kind, count in removed.items() if count})
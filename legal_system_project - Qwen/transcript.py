@@ -0,0 +1,109 @@
+"""案件咨询对话的增量文本（案例分析报告的输入）。
+
+每轮对话结束时只追加一条已清洗、带角色标签的文本，同时累计 token 数和内容哈希，
+生成报告、保存结果和缓存判重时都直接复用，不必在咨询结束时重新遍历整段对话。
+"""
+import hashlib
+import re
+from typing import Any, Dict, List, Optional
+
+# 去掉【律师回复】【案件类型确认】等界面标签
+_TAG_PREFIX_PATTERN = re.compile(r'^【.*?】\s*')
+_CJK_PATTERN = re.compile(r'[　-〿㐀-鿿＀-￯]')
+
+_encoding = None
+_encoding_failed = False
+
+
+def estimate_tokens(text: str) -> int:
+    """估算 token 数。优先使用 tiktoken；离线环境加载失败时按中文一字一 token、其余四字符一 token 估算。"""
+    global _encoding, _encoding_failed
+    if not text:
+        return 0
+    if _encoding is None and not _encoding_failed:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _encoding_failed = True
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    cjk_count = len(_CJK_PATTERN.findall(text))
+    return cjk_count + (len(text) - cjk_count + 3) // 4
+
+
+def role_label(role: str) -> Optional[str]:
+    if role in ('user', 'human'):
+        return "用户"
+    if role in ('assistant', 'gpt', 'AI'):
+        return "律师"
+    return None
+
+
+class CaseTranscript:
+    """按轮次增量维护的对话文本，每次追加的开销只与该条消息长度有关。"""
+
+    def __init__(self):
+        self.parts: List[str] = []
+        self.token_count = 0
+        self._hasher = hashlib.sha256()
+        self._text = None
+
+    def append(self, role: str, content: str) -> bool:
+        """追加一条消息，system 等非对话角色会被忽略。"""
+        label = role_label(role)
+        if label is None:
+            return False
+        part = f"{label}: {_TAG_PREFIX_PATTERN.sub('', content or '')}"
+        self.parts.append(part)
+        self.token_count += estimate_tokens(part)
+        self._hasher.update(part.encode('utf-8'))
+        self._hasher.update(b'\x00')
+        self._text = None
+        return True
+
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            self._text = "\n\n".join(self.parts).strip()
+        return self._text
+
+    @property
+    def content_hash(self) -> str:
+        return self._hasher.copy().hexdigest()
+
+    def __len__(self):
+        return len(self.parts)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"parts": self.parts, "token_count": self.token_count}
+
+    @classmethod
+    def from_dict(cls, payload: Dict[str, Any]) -> "CaseTranscript":
+        transcript = cls()
+        transcript.parts = list(payload.get("parts", []))
+        transcript.token_count = payload.get("token_count", 0)
+        for part in transcript.parts:
+            transcript._hasher.update(part.encode('utf-8'))
+            transcript._hasher.update(b'\x00')
+        return transcript
+
+    @classmethod
+    def from_messages(cls, messages: List[Dict[str, Any]]) -> "CaseTranscript":
+        """从 OpenAI 风格的消息列表构建（兼容升级前保存的会话状态）。"""
+        transcript = cls()
+        for msg in messages:
+            transcript.append(msg.get('role', ''), msg.get('content', ''))
+        return transcript
+
+    @classmethod
+    def from_sharegpt(cls, conversation_data) -> "CaseTranscript":
+        """从 ShareGPT 格式的对话数据构建，接受单条记录或记录列表（取第一条）。"""
+        transcript = cls()
+        if isinstance(conversation_data, list) and len(conversation_data) > 0:
+            conversation_data = conversation_data[0]
+        if not isinstance(conversation_data, dict) or 'conversations' not in conversation_data:
+            return transcript
+        for conv in conversation_data['conversations']:
+            transcript.append('human' if conv['from'] == 'human' else 'gpt', conv['value'])
+        return transcript
@@ -1,43 +1,144 @@
+import math
 import os
+import re
+from collections import Counter
+from typing import Any, Dict, List, Tuple
+
 import cv2
 import numpy as np
 from PyPDF2 import PdfReader
 from docx import Document
 import easyocr
 
-def classify_contract_type(text: str) -> str:
-    categories = {
-        # 按期限
-        "固定期限劳动合同": ["合同期限自", "为期", "终止时间"],
-        "无固定期限劳动合同": ["无固定期限", "不设终止日期", "除非双方解除"],
-        "以完成工作任务为期限劳动合同": ["任务完成之日", "项目结束即终止", "工作成果"],
-        # 按工作时间强度
-        "全日制劳动合同": ["标准工时制", "五天八小时", "每日工作时长"],
-        "非全日制用工合同": ["非全日制", "小时工", "计时工", "累计工作时间"],
-        "零工/临时工合同": ["临时", "一次性任务", "单次派工", "劳务报酬"],
-        # 按用工主体
-        "劳务派遣合同": ["派遣公司", "派遣单位", "劳务派遣", "第三方用工"],
-        "劳务外包合同": ["承揽", "外包", "服务费"],
-        # 按身份资历
-        "实习/见习协议": ["实习", "见习", "学校三方协议", "实习期间"],
-        "试用期协议": ["试用期", "不符合录用条件", "提前通知解除"],
-        "顾问/专家聘用合同": ["顾问", "专家", "咨询服务", "顾问费"],
-        "兼职协议": ["兼职", "兼任", "工作时间安排"],
-        # 专项条款（独立或附属）
-        "保密协议（NDA）": ["保密协议", "保密信息", "违约责任", "保密期限"],
-        "竞业限制协议": ["竞业限制", "竞业限制期", "经济补偿", "地域范围"],
-        "员工持股/股权激励协议": ["股权激励", "员工持股", "认购价格", "归属期限"],
-        "劳动争议调解/赔偿协议": ["争议解决", "和解", "一次性赔偿", "调解"],
-        # 新兴用工模式
-        "平台经济用工协议": ["平台", "派单", "灵活用工", "平台与劳动者"],
-        "远程/异地用工合同": ["远程办公", "异地", "通信工具", "工作地点"],
-        "弹性用工协议": ["弹性工时", "核心工作时段", "自主排班"],
-    }
+from text_normalizer import PAGE_BREAK
+
+CONTRACT_TYPE_KEYWORDS = {
+    # 按期限
+    "固定期限劳动合同": ["合同期限自", "为期", "终止时间"],
+    "无固定期限劳动合同": ["无固定期限", "不设终止日期", "除非双方解除"],
+    "以完成工作任务为期限劳动合同": ["任务完成之日", "项目结束即终止", "工作成果"],
+    # 按工作时间强度
+    "全日制劳动合同": ["标准工时制", "五天八小时", "每日工作时长"],
+    "非全日制用工合同": ["非全日制", "小时工", "计时工", "累计工作时间"],
+    "零工/临时工合同": ["临时", "一次性任务", "单次派工", "劳务报酬"],
+    # 按用工主体
+    "劳务派遣合同": ["派遣公司", "派遣单位", "劳务派遣", "第三方用工"],
+    "劳务外包合同": ["承揽", "外包", "服务费"],
+    # 按身份资历
+    "实习/见习协议": ["实习", "见习", "学校三方协议", "实习期间"],
+    "试用期协议": ["试用期", "不符合录用条件", "提前通知解除"],
+    "顾问/专家聘用合同": ["顾问", "专家", "咨询服务", "顾问费"],
+    "兼职协议": ["兼职", "兼任", "工作时间安排"],
+    # 专项条款（独立或附属）
+    "保密协议（NDA）": ["保密协议", "保密信息", "违约责任", "保密期限"],
+    "竞业限制协议": ["竞业限制", "竞业限制期", "经济补偿", "地域范围"],
+    "员工持股/股权激励协议": ["股权激励", "员工持股", "认购价格", "归属期限"],
+    "劳动争议调解/赔偿协议": ["争议解决", "和解", "一次性赔偿", "调解"],
+    # 新兴用工模式
+    "平台经济用工协议": ["平台", "派单", "灵活用工", "平台与劳动者"],
+    "远程/异地用工合同": ["远程办公", "异地", "通信工具", "工作地点"],
+    "弹性用工协议": ["弹性工时", "核心工作时段", "自主排班"],
+}
+
+UNKNOWN_CONTRACT_TYPE = "无法识别/可能为非标准劳动合同"
+
+# 合同标题和开头条款最能说明合同类型，越靠前的命中权重越高（最高 2 倍）
+_HEAD_WINDOW = 500
+# 两个字的关键词（如“为期”“临时”“平台”）更容易误命中，权重低于更具体的长关键词
+_KEYWORD_LENGTH_WEIGHT = {2: 0.6, 3: 0.8}
+# 与最高分相比达到该比例的类型一并作为附加标签返回
+_SECONDARY_LABEL_RATIO = 0.5
+
+
+class KeywordMatcher:
+    """一次扫描统计文本中所有关键词的出现次数和首次出现位置。
+
+    关键词按长度降序编译成一个多模式正则，放在零宽前瞻中，由正则引擎在 C 层逐个位置匹配，
+    命中之间可以重叠（“劳务派遣单位”同时命中“劳务派遣”和“派遣单位”）。每个位置只取最长的关键词，
+    同一位置开头的较短关键词（如“竞业限制期”中的“竞业限制”）通过预先计算的前缀关系补齐计数。
+    """
+
+    def __init__(self, keywords):
+        self.keywords = sorted(set(keywords), key=len, reverse=True)
+        # 先用关键词首字的字符集过滤位置，只在可能命中的位置尝试整个分支列表
+        first_chars = "".join(sorted({re.escape(k[0]) for k in self.keywords}))
+        self._pattern = re.compile(f"(?=[{first_chars}])(?=(" + "|".join(re.escape(k) for k in self.keywords) + "))")
+        self._prefixes = {
+            k: [other for other in self.keywords if other != k and k.startswith(other)]
+            for k in self.keywords
+        }
+
+    def count(self, text: str) -> Dict[str, Tuple[int, int]]:
+        """返回 关键词 -> (出现次数, 首次出现位置)。"""
+        counts = Counter()
+        for keyword, hits in Counter(self._pattern.findall(text)).items():
+            counts[keyword] += hits
+            for inner in self._prefixes[keyword]:
+                counts[inner] += hits
+        # 只对实际命中的少数关键词再取一次首次位置
+        return {keyword: (hits, text.find(keyword)) for keyword, hits in counts.items()}
+
 
+def _index_keywords(categories: Dict[str, List[str]]) -> Dict[str, List[str]]:
+    """关键词 -> 所属类型列表（同一关键词可能属于多个类型）。"""
+    index = {}
     for name, keywords in categories.items():
-        if any(keyword in text for keyword in keywords):
-            return name
-    return "无法识别/可能为非标准劳动合同"
+        for keyword in keywords:
+            index.setdefault(keyword, []).append(name)
+    return index
+
+
+# 匹配器在导入时构建一次
+_KEYWORD_CATEGORIES = _index_keywords(CONTRACT_TYPE_KEYWORDS)
+_CONTRACT_KEYWORD_MATCHER = KeywordMatcher(_KEYWORD_CATEGORIES)
+
+
+def rank_contract_types(text: str, top_k: int = 3) -> List[Dict[str, Any]]:
+    """按命中次数和命中位置为每个合同类型打分，返回按得分排序的多标签结果。
+
+    每项包含 type、score、confidence（占全部得分的比例）和命中的 keywords；
+    只返回得分不低于最高分一半的类型，最多 top_k 个。
+    """
+    scores = {}
+    matched_keywords = {}
+    for keyword, (hits, first_position) in _CONTRACT_KEYWORD_MATCHER.count(text).items():
+        position_weight = 1.0 + max(0.0, 1.0 - first_position / _HEAD_WINDOW)
+        # 重复出现的收益递减，避免正文里反复出现的通用词压过标题
+        keyword_score = _KEYWORD_LENGTH_WEIGHT.get(len(keyword), 1.0) * position_weight * (1.0 + math.log(hits))
+        for name in _KEYWORD_CATEGORIES[keyword]:
+            scores[name] = scores.get(name, 0.0) + keyword_score
+            matched_keywords.setdefault(name, []).append(keyword)
+
+    if not scores:
+        return []
+    total = sum(scores.values())
+    ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+    top_score = ranked[0][1]
+    return [
+        {
+            "type": name,
+            "score": round(score, 3),
+            "confidence": round(score / total, 3),
+            "keywords": matched_keywords[name],
+        }
+        for name, score in ranked[:top_k]
+        if score >= top_score * _SECONDARY_LABEL_RATIO
+    ]
+
+
+def describe_contract_types(ranking: List[Dict[str, Any]]) -> str:
+    """把 rank_contract_types 的结果整理成展示和提示词中使用的标签文本。"""
+    if not ranking:
+        return UNKNOWN_CONTRACT_TYPE
+    label = f"{ranking[0]['type']}（置信度 {ranking[0]['confidence']:.0%}）"
+    if len(ranking) > 1:
+        label += "；同时涉及：" + "、".join(item["type"] for item in ranking[1:])
+    return label
+
+
+def classify_contract_type(text: str) -> str:
+    ranking = rank_contract_types(text, top_k=1)
+    return ranking[0]["type"] if ranking else UNKNOWN_CONTRACT_TYPE
 
 def detect_seal_in_text(text: str) -> bool:
     """通过关键字判断 OCR 文本中是否有'公章'、'盖章'等字样。"""
@@ -101,15 +202,13 @@ def _extract_from_image(file_path: str, reader=None) -> str:
         raise RuntimeError(f"图片OCR识别失败: {str(e)}")
 
 def _extract_from_pdf(file_path: str) -> str:
-    text = ""
+    """各页之间用 PAGE_BREAK 分隔，供 text_normalizer 识别页眉页脚。"""
     try:
         with open(file_path, 'rb') as file:
             reader = PdfReader(file)
-            for page in reader.pages:
-                text += page.extract_text() or ""
+            return PAGE_BREAK.join(page.extract_text() or "" for page in reader.pages)
     except Exception as e:
         raise RuntimeError(f"PDF文件读取失败: {str(e)}")
-    return text
 
 def _extract_from_docx(file_path: str) -> str:
     try: